@@ -0,0 +1,69 @@
+"""
+Import time benchmark.
+
+Measures cumulative `python -X importtime` time of hodl_net entry points
+and compares it with the saved baseline.
+
+    python benchmarks/import_time.py          # compare with baseline
+    python benchmarks/import_time.py --save   # write new baseline
+"""
+
+import subprocess
+import argparse
+import json
+import sys
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE = os.path.join(ROOT, 'benchmarks', 'baselines', 'import_time.json')
+
+TARGETS = ['hodl_net', 'hodl_net.models', 'hodl_net.net_protocol']
+
+
+def import_time(module: str, repeat: int = 5) -> int:
+    """
+    :return: Best cumulative import time of `module` in microseconds
+    """
+    best = None
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                             cwd=ROOT, stderr=subprocess.PIPE, universal_newlines=True, check=True).stderr
+        for line in out.splitlines():
+            _, self_time, cumulative, name = [part.strip() for part in line.replace(':', '|', 1).split('|')]
+            if name == module:
+                best = int(cumulative) if best is None else min(best, int(cumulative))
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--save', action='store_true', help='Save results as baseline')
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help='Allowed slowdown factor against baseline')
+    args = parser.parse_args()
+
+    results = {module: import_time(module) for module in TARGETS}
+    if args.save:
+        with open(BASELINE, 'w') as f:
+            f.write(json.dumps(results, indent=4, sort_keys=True) + '\n')
+        return 0
+
+    try:
+        with open(BASELINE) as f:
+            baseline = json.loads(f.read())
+    except FileNotFoundError:
+        baseline = {}
+
+    failed = False
+    for module, us in results.items():
+        base = baseline.get(module)
+        # 5 ms slack: a cold import of a tiny module is mostly noise
+        slow = base is not None and us > base * args.tolerance + 5000
+        failed |= slow
+        print(f'{module:<28} {us / 1000:>9.1f} ms  baseline '
+              f'{base / 1000 if base else float("nan"):>9.1f} ms{"  REGRESSION" if slow else ""}')
+    return int(failed)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,423 @@
+"""
+Microbenchmarks of hot paths: codec, crypto, erasure coding, TempDict,
+peer map, cover traffic, storage, datagram handling and handler dispatch.
+
+Every case reports the median of several runs of best time per operation and
+is compared with the saved baseline, so slowdowns show up in review. Baseline
+records the machine it was taken on; results of another machine are only
+indicative.
+
+    python benchmarks/micro.py                  # compare with baseline
+    python benchmarks/micro.py --save           # write new baseline
+    python benchmarks/micro.py --filter crypto  # run matching cases only
+    python benchmarks/micro.py --quick          # skip the largest sizes
+    python benchmarks/micro.py --runs 9         # median of 9 runs
+"""
+
+from collections import OrderedDict, namedtuple
+from typing import Callable
+import statistics
+import platform
+import argparse
+import tempfile
+import timeit
+import random
+import copy
+import json
+import time
+import sys
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE = os.path.join(ROOT, 'benchmarks', 'baselines', 'micro.json')
+sys.path.insert(0, ROOT)
+
+from hodl_net.models import Message, MessageWrapper, TempDict  # noqa: E402
+from hodl_net import cryptogr, erasure  # noqa: E402
+from hodl_net.discovery.peermap import PeerMap  # noqa: E402
+from hodl_net.cover import Cover  # noqa: E402
+
+Case = namedtuple('Case', 'run setup ops')
+Case.__new__.__defaults__ = (None, 1)
+
+BENCHMARKS = OrderedDict()
+QUICK_LIMIT = 10 ** 4
+
+
+def benchmark(name: str, params=(None,)):
+    """
+    Register benchmark. Decorated function gets a parameter and returns `Case`:
+    `run` is timed, `setup` is called before every run if given,
+    `ops` is number of operations in one run.
+    """
+
+    def decorator(func: Callable):
+        BENCHMARKS[name] = (func, params)
+        return func
+
+    return decorator
+
+
+def measure(case: Case, repeat: int = 5) -> float:
+    """
+    :return: Best time per operation in nanoseconds
+    """
+    if case.setup:
+        best = None
+        for _ in range(repeat):
+            case.setup()
+            start = time.perf_counter()
+            case.run()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best * 1e9 / case.ops
+    timer = timeit.Timer(case.run)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) * 1e9 / number / case.ops
+
+
+def median_time(case: Case, repeat: int = 5, runs: int = 5) -> float:
+    """
+    :return: Median of `runs` measurements, so a single noisy run doesn't become a baseline
+    """
+    return statistics.median(measure(case, repeat) for _ in range(runs))
+
+
+def machine() -> dict:
+    cpu = platform.processor()
+    try:
+        with open('/proc/cpuinfo') as f:
+            cpu = next((line.split(':', 1)[1].strip() for line in f if line.startswith('model name')), cpu)
+    except OSError:
+        pass
+    return {
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'cpu': cpu,
+        'cpus': os.cpu_count()
+    }
+
+
+def payload(size: int) -> dict:
+    return {'data': 'x' * size}
+
+
+_keys = None
+
+
+def keys():
+    global _keys
+    if _keys is None:
+        _keys = cryptogr.gen_keys()
+    return _keys
+
+
+# Codec
+
+
+@benchmark('message_to_json', [64, 1024, 8192])
+def message_to_json(size):
+    message = Message('bench', payload(size))
+    return Case(message.to_json)
+
+
+@benchmark('wrapper_to_json', [64, 1024, 8192])
+def wrapper_to_json(size):
+    wrapper = MessageWrapper(Message('bench', payload(size)), 'request')
+    return Case(wrapper.to_json)
+
+
+@benchmark('wrapper_from_bytes', [64, 1024, 8192])
+def wrapper_from_bytes(size):
+    data = MessageWrapper(Message('bench', payload(size)), 'request').to_json().encode()
+    return Case(lambda: MessageWrapper.from_bytes(data))
+
+
+# Crypto
+
+
+@benchmark('crypto_sign', [64, 1024, 8192])
+def crypto_sign(size):
+    private_key, _ = keys()
+    text = 'x' * size
+    return Case(lambda: cryptogr.sign(text, private_key))
+
+
+@benchmark('crypto_verify', [64, 1024, 8192])
+def crypto_verify(size):
+    private_key, public_key = keys()
+    text = 'x' * size
+    signature = cryptogr.sign(text, private_key)
+    return Case(lambda: cryptogr.verify(text, signature, public_key))
+
+
+@benchmark('crypto_encrypt', [64, 1024, 8192])
+def crypto_encrypt(size):
+    _, public_key = keys()
+    text = 'x' * size
+    return Case(lambda: cryptogr.encrypt(text, public_key))
+
+
+@benchmark('crypto_decrypt', [64, 1024, 8192])
+def crypto_decrypt(size):
+    private_key, public_key = keys()
+    text = cryptogr.encrypt('x' * size, public_key)
+    return Case(lambda: cryptogr.decrypt(text, private_key))
+
+
+# Erasure coding
+
+
+@benchmark('erasure_encode', [1024, 65536])
+def erasure_encode(size):
+    data = bytes(random.getrandbits(8) for _ in range(size))
+    return Case(lambda: erasure.encode(data, 4, 2))
+
+
+@benchmark('erasure_decode', [1024, 65536])
+def erasure_decode(size):
+    data = bytes(random.getrandbits(8) for _ in range(size))
+    shards = dict(enumerate(erasure.encode(data, 4, 2)))
+    del shards[0], shards[2]
+    return Case(lambda: erasure.decode(shards, 4, size))
+
+
+# Peer map
+
+
+def peer_map(n: int, degree: int = 20) -> PeerMap:
+    rnd = random.Random(n)
+    addrs = [f'10.{i >> 16}.{i >> 8 & 255}.{i & 255}:8000' for i in range(n)]
+    m = PeerMap(max_nodes=n)
+    for addr in addrs:
+        m.report(addr, rnd.sample(addrs, degree), full=True)
+    return m
+
+
+@benchmark('peermap_report', [10 ** 3, 10 ** 4, 10 ** 5])
+def peermap_report(n):
+    m = peer_map(n)
+    rnd = random.Random(0)
+    # Every reporter alternates between two peer sets, so every report changes the map
+    reports = [(rnd.choice(m.addrs), rnd.sample(m.addrs, 20)) for _ in range(50)]
+    reports += [(reporter, rnd.sample(m.addrs, 20)) for reporter, _ in reports]
+
+    def run():
+        for reporter, addrs in reports:
+            m.report(reporter, addrs, full=True)
+
+    return Case(run, ops=len(reports))
+
+
+@benchmark('peermap_components', [10 ** 3, 10 ** 4, 10 ** 5])
+def peermap_components(n):
+    m = peer_map(n)
+
+    def setup():
+        m._labels = None
+
+    return Case(m.component_sizes, setup)
+
+
+# Cover traffic
+
+
+@benchmark('cover_slot', [10, 1000])
+def cover_slot(n):
+    addrs = [f'10.0.{i >> 8}.{i & 255}:8000' for i in range(n)]
+    cover = Cover(None, lambda: addrs, lambda key, data, addr, _type: True)
+    real = MessageWrapper(Message('bench', payload(64)), 'message').to_json().encode()
+
+    def run():
+        for addr in addrs[::2]:
+            cover.put(addr, real, None, 'message')
+        cover.slot()
+
+    return Case(run, ops=n)
+
+
+# Storage
+
+
+def storage(backend: str, n: int):
+    from hodl_net.database import DBWorker
+
+    worker = DBWorker()
+    worker.create_connection(os.path.join(tempfile.mkdtemp(), f'bench_db.{backend}'), backend)
+    worker.storage.add_users([(f'user{i}', f'key{i}') for i in range(n)])
+    return worker.storage
+
+
+def storage_user_key(backend: str, n: int) -> Case:
+    store = storage(backend, n)
+    names = [f'user{i}' for i in random.Random(0).sample(range(n), 100)]
+
+    def run():
+        for name in names:
+            store.user_key(name)
+
+    return Case(run, ops=len(names))
+
+
+@benchmark('storage_user_key_sqlite', [10 ** 3, 10 ** 5])
+def storage_user_key_sqlite(n):
+    return storage_user_key('sqlite', n)
+
+
+@benchmark('storage_user_key_log', [10 ** 3, 10 ** 5])
+def storage_user_key_log(n):
+    return storage_user_key('log', n)
+
+
+# TempDict
+
+
+def filled(n: int) -> TempDict:
+    d = TempDict(factory=None)
+    for i in range(n):
+        d[i] = i
+    return d
+
+
+@benchmark('tempdict_insert', [10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6])
+def tempdict_insert(n):
+    return Case(lambda: filled(n), ops=n)
+
+
+@benchmark('tempdict_lookup', [10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6])
+def tempdict_lookup(n):
+    d = filled(n)
+    keys_ = random.sample(range(n), 1000)
+
+    def run():
+        for key in keys_:
+            d.get(key)
+
+    return Case(run, ops=len(keys_))
+
+
+@benchmark('tempdict_expire', [10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6])
+def tempdict_expire(n):
+    state = {}
+
+    def setup():
+        d = state['d'] = filled(n)
+        for i in range(0, n, 2):
+            dict.__getitem__(d, i)['time'] -= d.expire
+        d.last_check -= d.update_time
+
+    return Case(lambda: state['d'].check(), setup, ops=n)
+
+
+# Datagram handling and dispatch
+
+
+_server = None
+
+
+def bench_server():
+    """
+    Server without background subsystems, DB in temp dir, in-memory transport
+    """
+    global _server
+    if _server is not None:
+        return _server
+
+    from hodl_net.server import Server
+    from hodl_net.database import db_worker, create_db
+    from hodl_net.config_loader import default_conf
+
+    class MemoryTransport:
+        def __init__(self):
+            self.written = 0
+
+        def write(self, data, addr):
+            self.written += 1
+
+    conf = copy.deepcopy(default_conf())
+    for section in ('deadpeer', 'ppx', 'dht', 'lpd', 'upnp'):
+        conf[section]['enabled'] = False
+    _server = Server(conf=conf)
+    _server.udp.name = 'bench'
+    _server.udp.transport = MemoryTransport()
+    db_worker.create_connection(os.path.join(tempfile.mkdtemp(), 'bench_db.sqlite'))
+    create_db()
+
+    @_server.handle('bench_noop', 'request', in_thread=False)
+    async def bench_noop(_):
+        pass
+
+    return _server
+
+
+@benchmark('handle_datagram')
+def handle_datagram(_):
+    server = bench_server()
+    data = MessageWrapper(Message('bench_noop', payload(64)), 'request').to_json().encode()
+    addr = ('127.0.0.1', 8001)
+    return Case(lambda: server.udp.handle_datagram(data, addr))
+
+
+@benchmark('dispatch')
+def dispatch(_):
+    handler = bench_server()._handlers['request']['bench_noop'][0]
+    message = Message('bench_noop', payload(64))
+    return Case(lambda: handler(message))
+
+
+def cases(pattern: str = None, quick: bool = False):
+    for name, (func, params) in BENCHMARKS.items():
+        for param in params:
+            if quick and param is not None and param > QUICK_LIMIT:
+                continue
+            key = name if param is None else f'{name}[{param}]'
+            if pattern and pattern not in key:
+                continue
+            yield key, func, param
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--save', action='store_true', help='Save results as baseline')
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help='Allowed slowdown factor against baseline')
+    parser.add_argument('--filter', help='Run cases which names contain this string')
+    parser.add_argument('--quick', action='store_true', help=f'Skip sizes above {QUICK_LIMIT}')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs of one measurement, best is taken')
+    parser.add_argument('--runs', type=int, default=5, help='Measurements of case, median is taken')
+    args = parser.parse_args()
+
+    try:
+        with open(BASELINE) as f:
+            saved = json.loads(f.read())
+    except FileNotFoundError:
+        saved = {'machine': None, 'cases': {}}
+    baseline = saved['cases']
+    if saved['machine'] is not None and saved['machine'] != machine():
+        print(f'Baseline was taken on another machine: {saved["machine"]}')
+
+    results = {}
+    failed = False
+    for key, func, param in cases(args.filter, args.quick):
+        ns = results[key] = median_time(func(param), args.repeat, args.runs)
+        base = baseline.get(key)
+        slow = base is not None and ns > base * args.tolerance
+        failed |= slow
+        print(f'{key:<32} {ns / 1000:>12.3f} us/op  baseline '
+              f'{base / 1000 if base else float("nan"):>12.3f} us/op{"  REGRESSION" if slow else ""}')
+
+    if args.save:
+        baseline.update(results)
+        saved = {
+            'machine': machine(),
+            'runs': args.runs,
+            'cases': {key: round(ns, 1) for key, ns in baseline.items()}
+        }
+        with open(BASELINE, 'w') as f:
+            f.write(json.dumps(saved, indent=4, sort_keys=True) + '\n')
+        return 0
+    return int(failed)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
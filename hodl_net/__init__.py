@@ -1,3 +1,46 @@
-from .globals import *
-from .server import call_from_thread, db_worker
-from .net_protocol import protocol, server
+"""
+Submodules and default `server`/`protocol` are loaded on first access,
+so `import hodl_net` costs nothing until they are needed.
+"""
+
+import importlib
+import types
+import sys
+
+_lazy = {
+    'local': 'globals',
+    'session': 'globals',
+    'peer': 'globals',
+    'user': 'globals',
+    'node': 'globals',
+    'call_from_thread': 'server',
+    'db_worker': 'database',
+    'protocol': 'net_protocol',
+    'server': 'net_protocol',
+}
+
+__all__ = list(_lazy)
+
+
+class _Package(types.ModuleType):
+    def __setattr__(self, name, value):
+        # `hodl_net.server` is the default server, not the submodule
+        if name == 'server' and isinstance(value, types.ModuleType):
+            return
+        super().__setattr__(name, value)
+
+
+def __getattr__(name):
+    if name not in _lazy:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = getattr(importlib.import_module(f'.{_lazy[name]}', __name__), name)
+    # `globals` here may be shadowed by `hodl_net.globals` submodule
+    setattr(sys.modules[__name__], name, value)
+    return value
+
+
+def __dir__():
+    return sorted(set(vars(sys.modules[__name__])) | set(_lazy))
+
+
+sys.modules[__name__].__class__ = _Package
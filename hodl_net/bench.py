@@ -0,0 +1,354 @@
+"""
+Load generator.
+
+Start a node with echo handlers and drive it from N loopback client nodes,
+each in its own process:
+
+    python -m hodl_net.bench serve --port 8000
+    python -m hodl_net.bench run --target 127.0.0.1:8000 --clients 4 --rate 200 \\
+        --duration 30 --mix request=8 message=1 shout=1 --size 256
+
+Clients are open-loop: sends are scheduled at fixed intended times and do not
+wait for responses. Latency is measured from the intended send time, so a
+stalled node shows up as latency instead of as a lower send rate
+(no coordinated omission). Responses missing after `--timeout` are drops.
+"""
+
+from typing import Dict
+import subprocess
+import tempfile
+import argparse
+import random
+import json
+import time
+import sys
+import os
+
+from .metrics import Histogram
+
+KINDS = ('request', 'message', 'shout')
+
+
+def dump_histogram(histogram: Histogram) -> dict:
+    return {
+        'counts': {i: count for i, count in enumerate(histogram.counts) if count},
+        'count': histogram.count,
+        'sum': histogram.sum,
+        'max': histogram.max
+    }
+
+
+def load_histogram(data: dict, histogram: Histogram = None) -> Histogram:
+    """
+    Load dumped histogram or merge it into `histogram`
+    """
+    histogram = histogram or Histogram('latency')
+    for i, count in data['counts'].items():
+        histogram.counts[int(i)] += count
+    histogram.count += data['count']
+    histogram.sum += data['sum']
+    histogram.max = max(histogram.max, data['max'])
+    return histogram
+
+
+def register_echo(server):
+    """
+    Handlers of the target node
+    """
+    from .server import peer, user, node
+    from .database import db_worker
+    from .models import Message
+
+    @server.handle('bench_hello', 'request')
+    async def bench_hello(message):
+        db_worker.storage.add_users([(message.data['name'], message.data['key'])])
+        peer.response(message, Message('bench_hello', {'name': node.name, 'key': node.udp.public_key}))
+
+    @server.handle('bench_echo', 'request', in_thread=False)
+    async def bench_echo_request(message):
+        peer.response(message, Message('bench_echo', message.data))
+
+    @server.handle('bench_echo', 'message', in_thread=False)
+    async def bench_echo_message(message):
+        user.response(message, Message('bench_echo', message.data))
+
+    @server.handle('bench_echo', 'shout', in_thread=False)
+    async def bench_echo_shout(message):
+        user.response(message, Message('bench_echo', message.data))
+
+
+def first_response(responses: list):
+    from twisted.internet import defer
+
+    if not responses:
+        raise defer.TimeoutError()
+    return responses[0]
+
+
+class LoadClient:
+    """
+    :param server: Prepared client `Server`
+    :param str target: Target address
+    :param float rate: Messages per second
+    :param float duration: Load duration in seconds
+    :param dict mix: Weights of message kinds
+    :param int size: Payload size in bytes
+    :param float timeout: Response timeout
+    :param int seed: Random seed of kind choice
+    """
+
+    def __init__(self, server, target: str, rate: float, duration: float, mix: Dict[str, float],
+                 size: int = 256, timeout: float = 5, seed: int = 0):
+        self.server = server
+        self.target = target
+        self.target_name = None
+        self.interval = 1 / rate
+        self.total = int(rate * duration)
+        self.kinds = [kind for kind in KINDS if mix.get(kind)]
+        self.weights = [mix[kind] for kind in self.kinds]
+        self.pad = 'x' * size
+        self.timeout = timeout
+        self.random = random.Random(seed)
+        self.stats = {kind: {'sent': 0, 'ok': 0, 'dropped': 0, 'latency': Histogram('latency')}
+                      for kind in self.kinds}
+        self.sent = 0
+        self.start = None
+        self.finished = None
+
+    async def hello(self):
+        from .models import Message, Peer
+        from .database import db_worker
+
+        udp = self.server.udp
+        response = await Peer(udp, addr=self.target).request(
+            Message('bench_hello', {'name': udp.name, 'key': udp.public_key}), watch=True).addTimeout(
+            self.timeout, self.server.reactor)
+        self.target_name = response.data['name']
+        db_worker.storage.add_users([(self.target_name, response.data['key'])], replace=True)
+        udp.add_peer(Peer(udp, addr=self.target), 'bench')
+
+    async def run(self) -> dict:
+        await self.hello()
+        return await self.load()
+
+    def load(self):
+        """
+        :return: Deferred, which fires with results after the last response or timeout
+        """
+        from twisted.internet import defer
+
+        self.finished = defer.Deferred()
+        self.start = self.server.reactor.seconds()
+        self._tick()
+        return self.finished.addCallback(lambda _: self.dump())
+
+    def _tick(self):
+        reactor = self.server.reactor
+        now = reactor.seconds()
+        while self.sent < self.total and self.start + self.sent * self.interval <= now:
+            self.fire(self.random.choices(self.kinds, self.weights)[0], self.start + self.sent * self.interval)
+            self.sent += 1
+        if self.sent < self.total:
+            reactor.callLater(self.start + self.sent * self.interval - now, self._tick)
+        else:
+            reactor.callLater(self.timeout, self.finished.callback, None)
+
+    def fire(self, kind: str, intended: float):
+        from twisted.internet import defer
+        from .models import Message, Peer
+
+        udp = self.server.udp
+        stats = self.stats[kind]
+        stats['sent'] += 1
+        data = {'pad': self.pad}
+        if kind == 'request':
+            d = Peer(udp, addr=self.target).request(Message('bench_echo', data), watch=True)
+        elif kind == 'message':
+            d = udp.send(Message('bench_echo', data), self.target_name)
+        else:
+            responses = udp.shout(Message('bench_echo', data), first_n=1, deadline=self.timeout)
+            d = defer.ensureDeferred(responses.collect()).addCallback(first_response)
+
+        def done(_):
+            stats['ok'] += 1
+            stats['latency'].record(int((self.server.reactor.seconds() - intended) * 1e9))
+
+        def dropped(_):
+            stats['dropped'] += 1
+
+        d.addTimeout(self.timeout, self.server.reactor).addCallbacks(done, dropped)
+
+    def dump(self) -> dict:
+        duration = self.server.reactor.seconds() - self.start - self.timeout
+        return {
+            'duration': duration,
+            'kinds': {kind: dict(stats, latency=dump_histogram(stats['latency']))
+                      for kind, stats in self.stats.items()}
+        }
+
+
+def merge(results) -> dict:
+    """
+    Merge results of clients
+    """
+    merged = {}
+    for result in results:
+        for kind, stats in result['kinds'].items():
+            total = merged.setdefault(kind, {'sent': 0, 'ok': 0, 'dropped': 0, 'latency': Histogram('latency'),
+                                             'duration': 0.})
+            for key in ('sent', 'ok', 'dropped'):
+                total[key] += stats[key]
+            load_histogram(stats['latency'], total['latency'])
+            total['duration'] = max(total['duration'], result['duration'])
+
+    report = {}
+    for kind, total in merged.items():
+        latency = total.pop('latency')
+        duration = total.pop('duration')
+        report[kind] = dict(total,
+                            throughput=total['ok'] / duration if duration else 0.,
+                            drop_rate=total['dropped'] / total['sent'] if total['sent'] else 0.,
+                            **latency.dump())
+    return report
+
+
+def format_report(report: dict) -> str:
+    lines = [f'{"kind":<8} {"sent":>8} {"ok":>8} {"drop %":>7} {"msg/s":>9} '
+             f'{"p50 ms":>9} {"p90 ms":>9} {"p99 ms":>9} {"p99.9 ms":>9} {"max ms":>9}']
+    for kind, r in report.items():
+        lines.append(f'{kind:<8} {r["sent"]:>8} {r["ok"]:>8} {r["drop_rate"] * 100:>7.2f} {r["throughput"]:>9.1f} '
+                     f'{r["p50"] * 1e3:>9.2f} {r["p90"] * 1e3:>9.2f} {r["p99"] * 1e3:>9.2f} '
+                     f'{r["p99.9"] * 1e3:>9.2f} {r["max"] * 1e3:>9.2f}')
+    return '\n'.join(lines)
+
+
+def parse_mix(items) -> Dict[str, float]:
+    mix = {}
+    for item in items:
+        kind, _, weight = item.partition('=')
+        if kind not in KINDS:
+            raise argparse.ArgumentTypeError(f'Unknown message kind {kind}')
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+def serve(args):
+    from .server import get_server
+    from .database import create_db
+    from . import net_protocol  # noqa: F401
+
+    server = get_server()
+    register_echo(server)
+    server.prepare(port=args.port, name=args.name or f'bench{args.port}')
+    create_db(with_drop=True)
+    server.run()
+
+
+def client(args):
+    from twisted.internet import defer
+    from .config_loader import default_conf
+
+    conf = default_conf()
+    for section in ('lpd', 'upnp', 'dht', 'deadpeer', 'ppx'):
+        conf[section]['enabled'] = False
+
+    from .server import get_server
+    from .database import create_db
+    from . import net_protocol  # noqa: F401
+
+    os.chdir(tempfile.mkdtemp(prefix='hodl_bench_'))
+    server = get_server()
+
+    @server.handle('bench_echo', 'shout', in_thread=False)
+    async def other_shout(_):
+        pass
+
+    server.prepare(port=args.port, name=f'bench{args.port}')
+    create_db(with_drop=True)
+    load = LoadClient(server, args.target, args.rate, args.duration, parse_mix(args.mix),
+                      args.size, args.timeout, args.seed)
+
+    def finish(result):
+        if isinstance(result, dict):
+            print(json.dumps(result), flush=True)
+        else:
+            print(f'Client failed: {result.getErrorMessage()}', file=sys.stderr)
+        server.reactor.stop()
+
+    server.reactor.callWhenRunning(lambda: defer.ensureDeferred(load.run()).addBoth(finish))
+    server.run()
+
+
+def run(args):
+    procs = []
+    for i in range(args.clients):
+        procs.append(subprocess.Popen(
+            [sys.executable, '-m', 'hodl_net.bench', 'client',
+             '--port', str(args.port + i),
+             '--target', args.target,
+             '--rate', str(args.rate / args.clients),
+             '--duration', str(args.duration),
+             '--size', str(args.size),
+             '--timeout', str(args.timeout),
+             '--seed', str(args.seed + i),
+             '--mix', *args.mix],
+            stdout=subprocess.PIPE, stderr=None if args.verbose else subprocess.DEVNULL,
+            universal_newlines=True))
+
+    results = []
+    for proc in procs:
+        out, _ = proc.communicate()
+        lines = out.strip().splitlines()
+        if proc.returncode or not lines:
+            print(f'Client {proc.args[4]} failed', file=sys.stderr)
+            continue
+        results.append(json.loads(lines[-1]))
+
+    report = merge(results)
+    print(format_report(report))
+    if args.json:
+        with open(args.json, 'w') as f:
+            f.write(json.dumps({'args': vars(args), 'time': time.time(), 'report': report}, indent=4) + '\n')
+    return 0 if results else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description='hodl_net load generator')
+    commands = parser.add_subparsers(dest='command')
+
+    p = commands.add_parser('serve', help='Run target node with echo handlers')
+    p.add_argument('--port', type=int, default=8000)
+    p.add_argument('--name')
+
+    load_args = argparse.ArgumentParser(add_help=False)
+    load_args.add_argument('--target', default='127.0.0.1:8000')
+    load_args.add_argument('--rate', type=float, default=100, help='Total messages per second')
+    load_args.add_argument('--duration', type=float, default=10, help='Seconds')
+    load_args.add_argument('--mix', nargs='+', default=['request=1'],
+                           help='Weights of kinds, e.g. request=8 message=1 shout=1')
+    load_args.add_argument('--size', type=int, default=256, help='Payload size, bytes')
+    load_args.add_argument('--timeout', type=float, default=5, help='Response timeout, s')
+    load_args.add_argument('--seed', type=int, default=0)
+
+    p = commands.add_parser('run', parents=[load_args], help='Drive target from loopback clients')
+    p.add_argument('--clients', type=int, default=4)
+    p.add_argument('--port', type=int, default=9000, help='Port of the first client')
+    p.add_argument('--json', help='Write report to file')
+    p.add_argument('--verbose', action='store_true', help='Show client logs')
+
+    p = commands.add_parser('client', parents=[load_args], help=argparse.SUPPRESS)
+    p.add_argument('--port', type=int, required=True)
+
+    args = parser.parse_args()
+    if args.command == 'serve':
+        return serve(args)
+    if args.command == 'client':
+        return client(args)
+    if args.command == 'run':
+        return run(args)
+    parser.print_help()
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,118 @@
+"""
+Response cache of idempotent request handlers
+
+    @server.handle('ping', 'request', cache=ResponseCache(30))
+    async def ping(message):
+        return Message('pong')
+
+Cached handler returns its response instead of sending it. The response is
+serialized once into a datagram template; requesters get the template with
+their callback (or a new one, if `reply` is False) and a fresh message id
+substituted. Entries live `ttl` seconds and are dropped when a DB table they
+depend on changes, or expire `refresh` seconds after they were built, so a
+burst of changes costs one rebuild per `refresh`.
+"""
+
+from twisted.internet import defer
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+import threading
+import json
+import time
+import uuid
+
+from .models import Message, MessageWrapper, Peer
+from .database import db_worker
+from . import metrics
+
+
+def data_key(message: Message) -> str:
+    return json.dumps(message.data, sort_keys=True)
+
+
+class ResponseCache:
+    """
+    :param float ttl: Lifetime of cached response
+    :param key: Function `(message) -> hashable`, message data by default
+    :param tables: Names of tables, which changes drop the cache. Any table by default.
+    :param bool reply: Send response with callback of request, like `Peer.response`.
+        Otherwise it is sent with a new callback, like `Peer.request`.
+    :param float refresh: On change of `tables` entries live till `refresh` seconds
+        after they were built instead of being dropped at once
+    """
+
+    def __init__(self, ttl: float, key: Callable[[Message], Any] = None, tables: Iterable[str] = None,
+                 reply: bool = True, refresh: float = 0):
+        self.ttl = ttl
+        self.refresh = refresh
+        self.key = key or data_key
+        self.tables = set(tables) if tables is not None else None
+        self.reply = reply
+        self.entries: Dict[Any, Tuple[float, float, bytes, bytes, bytes]] = {}
+        self.lock = threading.Lock()
+        self.hits = metrics.cache_hits.labels('')
+        db_worker.on_change(self.invalidate)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def invalidate(self, table: str = None):
+        if table is not None and self.tables is not None and table not in self.tables:
+            return
+        if not self.refresh:
+            self.entries = {}
+            return
+        for key, entry in list(self.entries.items()):
+            expire = entry[1] + self.refresh
+            if expire < entry[0]:
+                self.entries[key] = (expire,) + entry[1:]
+
+    def get(self, key) -> Optional[tuple]:
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry
+
+    def put(self, response: Optional[Message], key) -> Optional[tuple]:
+        """
+        Serialize response into template: datagram split at callback and message id
+        """
+        if response is None:
+            return None
+        callback, uid = uuid.uuid4().hex, uuid.uuid4().hex
+        response.callback = callback
+        data = MessageWrapper(response, 'request', id=uid).to_json().encode()
+        head, _, rest = data.partition(callback.encode())
+        middle, _, tail = rest.partition(uid.encode())
+        now = time.monotonic()
+        entry = self.entries[key] = (now + self.ttl, now, head, middle, tail)
+        return entry
+
+    @staticmethod
+    def send(entry: Optional[tuple], _peer: Peer, callback: str):
+        """
+        Send response from template. Handlers run in threads, so the datagram
+        is handed over to the reactor thread by `PeerProtocol._write`.
+        """
+        if entry is None:
+            return
+        _, _, head, middle, tail = entry
+        data = b''.join((head, callback.encode(), middle, str(uuid.uuid4()).encode(), tail))
+        _peer.proto._write(data, _peer.addr, 'request')
+
+    def respond(self, func: Callable, message: Message, _peer: Peer) -> defer.Deferred:
+        """
+        Answer `message` from cache or by `func`. Misses are serialized, so
+        handler, which does not wait inside, builds the response once per burst.
+        """
+        key = self.key(message)
+        callback = message.callback if self.reply else str(uuid.uuid4())
+        entry = self.get(key)
+        if entry is None:
+            with self.lock:
+                entry = self.get(key)
+                if entry is None:
+                    d = defer.ensureDeferred(func(message)).addCallback(self.put, key)
+                    return d.addCallback(self.send, _peer, callback)
+        self.hits.inc()
+        self.send(entry, _peer, callback)
+        return defer.succeed(None)
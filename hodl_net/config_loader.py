@@ -1,8 +1,18 @@
-import toml
+import functools
 import os
 
 
 def load_conf(path=os.path.dirname(os.path.abspath(__file__))+"/config/default.toml"):
+    import toml
+
     with open(path) as f:
         conf_file = toml.load(f)
     return conf_file
+
+
+@functools.lru_cache()
+def default_conf():
+    """
+    `config/default.toml`, parsed once
+    """
+    return load_conf()
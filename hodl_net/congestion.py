@@ -0,0 +1,211 @@
+"""
+Per-peer Congestion Control
+
+Every peer has a congestion window: the number of datagrams, which may be
+in flight to it. A datagram stays in flight until the peer answers a request
+(ack) or until about two round trips pass, as most datagrams are never
+answered. Window grows by one datagram per window of acks and is halved on
+loss (unanswered request or probe), at most once per round trip.
+
+Datagrams above the window wait in a bounded per-peer queue, which drains as
+the window opens. When the queue is full, `send` refuses the datagram, and
+random-hop traffic goes to another peer instead, see `PeerProtocol.random_send`.
+"""
+
+from collections import deque
+from typing import Callable, Dict
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class Window:
+    __slots__ = ('cwnd', 'srtt', 'sent', 'queue', 'decreased', 'timer')
+
+    def __init__(self, cwnd: float, srtt: float):
+        self.cwnd = cwnd
+        self.srtt = srtt
+        self.sent = deque()  # Send times of datagrams in flight
+        self.queue = deque()  # (data, addr, type) waiting for window
+        self.decreased = float('-inf')
+        self.timer = None
+
+
+class Congestion:
+    """
+    :param wheel: `TimerWheel` instance. Windows are not enforced until it is running.
+    :param write: Callable(data, addr, type), which sends datagram
+    :param float initial: Initial window, datagrams
+    :param float min_window: Window is never decreased below it
+    :param float max_window: Window is never increased above it
+    :param float beta: Window is multiplied by it on loss
+    :param float rtt: Round trip time assumed before the first sample
+    :param float min_flight: Min time in flight of unanswered datagram
+    :param float max_flight: Max time in flight of unanswered datagram
+    :param int queue_size: Max datagrams waiting for window of one peer
+    :param int max_peers: Idle windows are dropped above this number of peers
+    """
+
+    def __init__(self,
+                 wheel,
+                 write: Callable,
+                 initial: float = 32,
+                 min_window: float = 2,
+                 max_window: float = 1024,
+                 beta: float = 0.5,
+                 rtt: float = 0.1,
+                 min_flight: float = 0.05,
+                 max_flight: float = 1.,
+                 queue_size: int = 256,
+                 max_peers: int = 4096):
+        self.wheel = wheel
+        self.write = write
+        self.initial = initial
+        self.min_window = min_window
+        self.max_window = max_window
+        self.beta = beta
+        self.rtt = rtt
+        self.min_flight = min_flight
+        self.max_flight = max_flight
+        self.queue_size = queue_size
+        self.max_peers = max_peers
+        self.windows: Dict[str, Window] = {}
+        self._limit = max_peers
+        self.queued = 0
+        self.overflowed = 0
+
+    def now(self) -> float:
+        return self.wheel.clock.seconds()
+
+    def window(self, key: str) -> Window:
+        w = self.windows.get(key)
+        if w is None:
+            if len(self.windows) >= self._limit:
+                self._prune()
+            w = self.windows[key] = Window(self.initial, self.rtt)
+        return w
+
+    def flight(self, w: Window) -> float:
+        return min(self.max_flight, max(self.min_flight, 2 * w.srtt))
+
+    def _expire(self, w: Window, now: float):
+        deadline = now - self.flight(w)
+        sent = w.sent
+        while sent and sent[0] <= deadline:
+            sent.popleft()
+
+    def is_open(self, key: str) -> bool:
+        """
+        :return: True if datagram to peer goes out at once
+        """
+        w = self.windows.get(key)
+        if w is None:
+            return True
+        self._expire(w, self.now())
+        return not w.queue and len(w.sent) < w.cwnd
+
+    def send(self, key: str, data: bytes, addr, _type: str) -> bool:
+        """
+        Send datagram within window of peer `key` or queue it
+
+        :return: False if queue of peer is full and datagram is dropped
+        """
+        if not self.wheel.running:
+            self.write(data, addr, _type)
+            return True
+        w = self.window(key)
+        if w.queue:
+            self._drain(w)
+        else:
+            self._expire(w, self.now())
+        if not w.queue and len(w.sent) < w.cwnd:
+            w.sent.append(self.now())
+            self.write(data, addr, _type)
+            return True
+        if len(w.queue) >= self.queue_size:
+            self.overflowed += 1
+            return False
+        w.queue.append((data, addr, _type))
+        self.queued += 1
+        self._schedule(w)
+        return True
+
+    def ack(self, key: str, rtt: float = None):
+        """
+        Peer answered: one datagram leaves flight, window grows additively
+
+        :param float rtt: Round trip time sample
+        """
+        w = self.windows.get(key)
+        if w is None:
+            return
+        if rtt is not None:
+            self.sample(key, rtt)
+        if w.sent:
+            w.sent.popleft()
+        w.cwnd = min(self.max_window, w.cwnd + 1 / w.cwnd)
+        self._drain(w)
+
+    def sample(self, key: str, rtt: float):
+        """
+        Round trip time sample of peer, e.g. from dead peer detector probe
+        """
+        w = self.windows.get(key)
+        if w is not None:
+            w.srtt += (rtt - w.srtt) / 8
+
+    def loss(self, key: str):
+        """
+        Datagram to peer is lost: window shrinks multiplicatively, once per round trip
+        """
+        w = self.windows.get(key)
+        if w is None:
+            return
+        now = self.now()
+        if now - w.decreased < w.srtt:
+            return
+        w.decreased = now
+        w.cwnd = max(self.min_window, w.cwnd * self.beta)
+        log.debug(f'Congestion window of {key} decreased to {w.cwnd:.1f}')
+
+    def forget(self, key: str):
+        w = self.windows.pop(key, None)
+        if w is not None and w.timer:
+            w.timer.cancel()
+
+    def _drain(self, w: Window):
+        now = self.now()
+        self._expire(w, now)
+        queue, sent = w.queue, w.sent
+        while queue and len(sent) < w.cwnd:
+            sent.append(now)
+            self.write(*queue.popleft())
+        if queue:
+            self._schedule(w)
+
+    def _on_timer(self, w: Window):
+        w.timer = None
+        self._drain(w)
+
+    def _schedule(self, w: Window):
+        """
+        Drain queue when the oldest datagram leaves flight
+        """
+        if w.timer is not None or not w.sent:
+            return
+        delay = max(0., w.sent[0] + self.flight(w) - self.now())
+        w.timer = self.wheel.call_later(delay, self._on_timer, w)
+
+    def _prune(self):
+        now = self.now()
+        for key, w in list(self.windows.items()):
+            self._expire(w, now)
+            if not w.queue and not w.sent:
+                del self.windows[key]
+        self._limit = max(self.max_peers, 2 * len(self.windows))
+
+    def backlog(self) -> int:
+        """
+        Datagrams waiting for window of all peers
+        """
+        return sum(len(w.queue) for w in self.windows.values())
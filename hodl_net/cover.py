@@ -0,0 +1,169 @@
+"""
+Constant-rate Cover Traffic
+
+Every peer gets one datagram of `size` bytes per slot, `rate` slots per
+second. Anonymous traffic (messages, shouts and tunnel keepalives) waits for
+the next slot of its peer and replaces cover there, so the number, sizes and
+timing of datagrams on the link are the same whether the node talks or not.
+Requests to peers are not anonymous anyway and go out at once.
+
+Cover datagram is a keepalive of a new tunnel with no hops left: byte for
+byte the layout of a real last-hop keepalive, with fresh salt, callback and
+ids. The peer installs the tunnel entry and drops it like a real one, and it
+goes no further. Random fields are substituted into a prebuilt template, and
+real datagrams are padded with JSON whitespace from a prebuilt buffer, so a
+slot costs a few uuids, a queue pop and a transport write. Real datagrams
+longer than `size` go out unpadded.
+
+.. warning:: The wire format has no link encryption. Shouts are plaintext, and
+    messages carry their type, sender and signature in the clear, so an observer,
+    who reads datagrams, tells them from cover. Cover hides traffic only from
+    observers of sizes and timing, e.g. of an encrypted tunnel the node runs over.
+"""
+
+from collections import deque
+from typing import Callable, Dict, Iterable, List
+import logging
+import base64
+import uuid
+import os
+
+from .models import Message, MessageWrapper
+from . import metrics
+
+log = logging.getLogger(__name__)
+
+_fields = ('salt', 'callback', 'id', 'tunnel_id')
+
+
+def _template() -> List[bytes]:
+    """
+    Last-hop keepalive split at its random fields
+    """
+    message = Message('keepalive', salt='<salt>', callback='<callback>')
+    data = MessageWrapper(message, 'tunnel', id='<id>', tunnel_id='<tunnel_id>', ttl=0).to_json().encode()
+    parts = []
+    for field in _fields:
+        head, _, data = data.partition(f'<{field}>'.encode())
+        parts.append(head)
+    parts.append(data)
+    return parts
+
+
+_parts = _template()
+
+
+def cover_datagram(size: int) -> bytes:
+    """
+    Keepalive of a new last-hop tunnel, padded to `size` bytes if it fits
+    """
+    # One urandom call for all fields: salt like `cryptogr.get_random`, JSON-escaped, and three uuid4
+    rnd = os.urandom(56)
+    callback, uid, tunnel_id = (str(uuid.UUID(bytes=rnd[i:i + 16], version=4)).encode() for i in (0, 16, 32))
+    salt = base64.encodebytes(rnd[48:]).replace(b'\n', b'\\n')
+    data = b''.join((_parts[0], salt, _parts[1], callback, _parts[2], uid, _parts[3], tunnel_id, _parts[4]))
+    return data + b' ' * (size - len(data))
+
+
+class Cover:
+    """
+    :param wheel: `TimerWheel` instance
+    :param peers: Callable returning addresses of peers, which get cover traffic
+    :param emit: Callable(key, data, addr, type), which sends datagram to peer `key`
+    :param float rate: Datagrams per second to every peer
+    :param int size: Datagram size, bytes
+    :param int queue_size: Max datagrams waiting for slots of one peer, further ones are sent at once
+    """
+
+    types = ('message', 'shout', 'tunnel')
+
+    def __init__(self,
+                 wheel,
+                 peers: Callable[[], Iterable[str]],
+                 emit: Callable,
+                 rate: float = 2,
+                 size: int = 1024,
+                 queue_size: int = 64):
+        self.wheel = wheel
+        self.peers = peers
+        self.emit = emit
+        self.interval = 1 / rate
+        self.size = size
+        self.queue_size = queue_size
+        self._padding = b' ' * size
+        self.queues: Dict[str, deque] = {}
+        self._addrs: Dict[str, tuple] = {}
+        self.timer = None
+        self.real = 0
+        self.cover = 0
+        self._real_count = metrics.cover_datagrams.labels('real')
+        self._cover_count = metrics.cover_datagrams.labels('cover')
+
+    def start(self):
+        self.timer = self.wheel.call_later(self.interval, self._tick)
+
+    def stop(self):
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+
+    def pad(self, data: bytes) -> bytes:
+        if len(data) >= self.size:
+            return data
+        return data + self._padding[:self.size - len(data)]
+
+    def put(self, key: str, data: bytes, addr: tuple, _type: str) -> bool:
+        """
+        Queue real datagram for the next slot of peer `key`
+        """
+        queue = self.queues.get(key)
+        if queue is None:
+            queue = self.queues[key] = deque()
+        if len(queue) >= self.queue_size:
+            self.real += 1
+            self._real_count.inc()
+            return self.emit(key, self.pad(data), addr, _type)
+        self._addrs[key] = addr
+        queue.append((data, _type))
+        return True
+
+    def ratio(self) -> float:
+        """
+        Share of real datagrams among sent in slots
+        """
+        total = self.real + self.cover
+        return self.real / total if total else 0.
+
+    def _tick(self):
+        self.timer = self.wheel.call_later(self.interval, self._tick)
+        self.slot()
+
+    def slot(self):
+        """
+        Send one datagram to every peer: queued real one, cover if there is none
+        """
+        real = cover = 0
+        size, queues, addrs = self.size, self.queues, self._addrs
+        keys = set(self.peers())
+        keys.update(queues)
+        for key in keys:
+            addr = addrs.get(key)
+            if addr is None:
+                host, _, port = key.rpartition(':')
+                addr = addrs[key] = (host, int(port))
+            queue = queues.get(key)
+            if queue:
+                data, _type = queue.popleft()
+                if not queue:
+                    del queues[key]
+                self.emit(key, self.pad(data), addr, _type)
+                real += 1
+            else:
+                self.emit(key, cover_datagram(size), addr, 'cover')
+                cover += 1
+        if len(addrs) > 2 * len(keys):
+            self._addrs = {key: addrs[key] for key in keys if key in addrs}
+        self.real += real
+        self.cover += cover
+        self._real_count.inc(real)
+        self._cover_count.inc(cover)
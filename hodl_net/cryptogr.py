@@ -1,13 +1,17 @@
-from Crypto.PublicKey import RSA
-from Crypto.Signature import PKCS1_v1_5
-from Crypto.Hash import SHA256 as SHA
-from Crypto.Cipher import PKCS1_OAEP
-from Crypto.Random import get_random_bytes
+"""
+Cryptography helpers. pycryptodome is imported on first RSA operation,
+hashes and random salts don't need it.
+"""
+
+from .metrics import crypto_latency
+
+import hashlib
+import secrets
 import base64
 
 
 def hex_hash(s):
-    return SHA.new(s.encode('utf-8')).hexdigest()
+    return hashlib.sha256(s.encode('utf-8')).hexdigest()
 
 
 def get_random(n=8):
@@ -15,20 +19,28 @@ def get_random(n=8):
     Random bytes in base64
     :return: str
     """
-    return base64.encodebytes(get_random_bytes(n)).decode()
+    return base64.encodebytes(secrets.token_bytes(n)).decode()
 
 
+@crypto_latency.labels('gen_keys').time
 def gen_keys():
     """
     Generates keys
     :return: (private key, public_key key)
     """
+    from Crypto.PublicKey import RSA
+
     privatekey = RSA.generate(2048)
     publickey = privatekey.publickey()
     return privatekey.exportKey().decode(), publickey.exportKey().decode()
 
 
+@crypto_latency.labels('sign').time
 def sign(plaintext: str, private_key: str) -> str:
+    from Crypto.PublicKey import RSA
+    from Crypto.Signature import PKCS1_v1_5
+    from Crypto.Hash import SHA256 as SHA
+
     priv_key = RSA.importKey(private_key)
     plaintext = plaintext.encode('utf-8')
     # creation of signature
@@ -38,23 +50,31 @@ def sign(plaintext: str, private_key: str) -> str:
     return base64.encodebytes(signature).decode()
 
 
+@crypto_latency.labels('verify').time
 def verify(plaintext: str, s: str, public_key: str) -> bool:
+    from Crypto.PublicKey import RSA
+    from Crypto.Signature import PKCS1_v1_5
+    from Crypto.Hash import SHA256 as SHA
+
     pub_key = RSA.importKey(public_key)
     plaintext = plaintext.encode('utf-8')
     # decryption signature
     myhash = SHA.new(plaintext)
     signature = PKCS1_v1_5.new(pub_key)
     try:
-        signature.verify(myhash, base64.decodebytes(s.encode()))
-        return True
+        return bool(signature.verify(myhash, base64.decodebytes(s.encode())))
     except ValueError:
         return False
 
 
+@crypto_latency.labels('encrypt').time
 def encrypt(plaintext: str, pub_key: str) -> str:
     """
     Encrypt text with RSA
     """
+    from Crypto.PublicKey import RSA
+    from Crypto.Cipher import PKCS1_OAEP
+
     key = RSA.importKey(pub_key)
     encrypter = PKCS1_OAEP.new(key)
 
@@ -67,10 +87,14 @@ def encrypt(plaintext: str, pub_key: str) -> str:
     return base64.encodebytes(ciphertext).decode()
 
 
+@crypto_latency.labels('decrypt').time
 def decrypt(text: str, priv_key: str) -> str:
     """
     Decrypt ciphertext with RSA
     """
+    from Crypto.PublicKey import RSA
+    from Crypto.Cipher import PKCS1_OAEP
+
     key = RSA.importKey(priv_key)
     text = base64.decodebytes(text.encode())
     decrypter = PKCS1_OAEP.new(key)
@@ -1,24 +1,86 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import SingletonThreadPool
 from sqlalchemy.ext.declarative import declarative_base
 from .globals import local, session
-import os
+from .metrics import db_latency, now_ns
+from typing import Callable, List
+import importlib
+import functools
 
 Base = declarative_base()
 
 
 class DBWorker:
+    """
+    Storage of peers and users, see `hodl_net.storage`. ORM sessions
+    (`get_session`, `with_session`) need 'sqlite' backend.
+    """
+
     def __init__(self):
         self.filename: str = None
         self.engine = None
+        self.storage = None
+        self.listeners: List[Callable[[str], None]] = []
+
+    def create_connection(self, filename: str, backend: str = 'sqlite', **options):
+        """
+        Open storage
+
+        :param str filename: Storage file. Memory only for 'log' backend if None.
+        :param str backend: Name of backend in `hodl_net.storage.backends`
+        :param options: Options of backend
+        """
+        from .storage import backends
 
-    def create_connection(self, filename):
         self.filename = filename
-        self.engine = create_engine(f'sqlite:///{filename}', poolclass=SingletonThreadPool,
-                                    connect_args={'check_same_thread': False})
+        self.engine = None
+        if self.storage is not None:
+            self.storage.close()
+        if backend == 'sqlite':
+            self.engine = create_engine(f'sqlite:///{filename}', poolclass=SingletonThreadPool,
+                                        connect_args={'check_same_thread': False})
+            event.listen(self.engine, 'before_cursor_execute', self._query_started)
+            event.listen(self.engine, 'after_cursor_execute', self._query_finished)
+            event.listen(self.engine, 'commit', self._committed)
+            event.listen(self.engine, 'rollback', self._rolled_back)
+            options['engine'] = self.engine
+        cls = getattr(importlib.import_module('.storage', __package__), backends[backend])
+        self.storage = cls(path=filename, notify=self._notify, **options)
+        self.storage.create()
+
+    def on_change(self, func: Callable[[str], None]):
+        """
+        Call `func(table name)` after every commit, which changed the table
+        """
+        self.listeners.append(func)
+
+    @staticmethod
+    def _query_started(conn, *_):
+        conn.info.setdefault('query_start', []).append(now_ns())
+
+    @staticmethod
+    def _query_finished(conn, cursor, statement, parameters, context, executemany):
+        db_latency.record(now_ns() - conn.info['query_start'].pop())
+        # INSERT OR IGNORE of known row changes nothing
+        if context is not None and (context.isinsert or context.isupdate or context.isdelete) and \
+                context.compiled is not None and cursor.rowcount > 0:
+            conn.info.setdefault('changed', set()).add(context.compiled.statement.table.name)
+
+    def _committed(self, conn):
+        for table in conn.info.pop('changed', ()):
+            self._notify(table)
+
+    def _notify(self, table: str):
+        for func in self.listeners:
+            func(table)
+
+    @staticmethod
+    def _rolled_back(conn):
+        conn.info.pop('changed', None)
 
     def with_session(self, func):
+        @functools.wraps(func)
         def wrapper(*args, **kwargs):
             local.session = self.get_session()
             try:
@@ -37,22 +99,27 @@ class DBWorker:
         ses.close()
 
     def get_session(self):
-        return sessionmaker(bind=self.engine)()
+        if self.engine is None:
+            raise RuntimeError('ORM sessions need sqlite storage backend')
+        return sessionmaker(bind=self.engine, expire_on_commit=False)()
 
 
 db_worker = DBWorker()
 
 
-@db_worker.with_session
+def connect(name: str, conf: dict):
+    """
+    Open storage of `storage` section of `conf` in `{name}_db.{backend}` file
+    """
+    backend = conf['storage']['backend']
+    db_worker.create_connection(f'{name}_db.{backend}', backend, **conf['storage'].get(backend, {}))
+
+
 def create_db(with_drop=False):
     if with_drop:
         drop_db()
-    Base.metadata.create_all(db_worker.engine)
-    session.commit()
+    db_worker.storage.create()
 
 
 def drop_db():
-    try:
-        os.remove(db_worker.filename)
-    except FileNotFoundError:
-        pass
+    db_worker.storage.drop()
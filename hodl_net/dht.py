@@ -0,0 +1,396 @@
+"""
+Kademlia DHT for user lookup.
+
+Node ids and keys are SHA256 digests: node id is hash of node's public key,
+user record is stored under hash of user name. Every node keeps only
+O(log N) contacts in its k-buckets and the records it is close to,
+instead of the whole `users` table.
+
+User records are signed with the user's private key, so a node can't
+publish a key it doesn't own. The first key stored for a name wins
+until its record expires; other keys for that name are refused.
+"""
+
+from twisted.internet import defer
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import heapq
+
+from .models import TempDict, Peer, Message
+from .cryptogr import hex_hash, sign, verify
+
+import logging
+import random
+
+log = logging.getLogger(__name__)
+
+ID_BITS = 256
+
+
+def digest(s: str) -> int:
+    """
+    DHT id of string
+    """
+    return int(hex_hash(s), 16)
+
+
+def user_record(name: str, public_key: str, private_key: str) -> dict:
+    """
+    Signed user record
+    """
+    return {'name': name, 'key': public_key, 'sign': sign(f'{name}\n{public_key}', private_key)}
+
+
+def check_record(key: int, record) -> bool:
+    """
+    Is `record` a user record stored under `key` and signed by its key
+    """
+    if not isinstance(record, dict):
+        return False
+    name, public_key, signature = record.get('name'), record.get('key'), record.get('sign')
+    if not all(isinstance(field, str) for field in (name, public_key, signature)) or digest(name) != key:
+        return False
+    try:
+        return verify(f'{name}\n{public_key}', signature, public_key)
+    except (ValueError, IndexError, TypeError):
+        return False
+
+
+class Contact:
+    __slots__ = ('id', 'addr')
+
+    def __init__(self, node_id: int, addr: str):
+        self.id = node_id
+        self.addr = addr
+
+    def dump(self) -> List[str]:
+        return [format(self.id, 'x'), self.addr]
+
+    @classmethod
+    def load(cls, data: List[str]) -> 'Contact':
+        return cls(int(data[0], 16), str(data[1]))
+
+    def __repr__(self):
+        return f'<Contact {self.id:x} {self.addr}>'
+
+
+class KBucket:
+    """
+    Up to `k` contacts, least recently seen first,
+    plus replacement cache for the time one of them dies
+    """
+
+    def __init__(self, k: int):
+        self.k = k
+        self.contacts: Dict[int, Contact] = OrderedDict()
+        self.replacements: Dict[int, Contact] = OrderedDict()
+
+    def __len__(self):
+        return len(self.contacts)
+
+    @property
+    def oldest(self) -> Contact:
+        return next(iter(self.contacts.values()))
+
+    def touch(self, contact: Contact) -> bool:
+        """
+        Move contact to the tail of bucket.
+
+        :return: False if bucket is full and contact went to replacement cache
+        """
+        if contact.id in self.contacts:
+            self.contacts.move_to_end(contact.id)
+            self.contacts[contact.id] = contact
+            return True
+        if len(self.contacts) < self.k:
+            self.contacts[contact.id] = contact
+            return True
+        self.replacements.pop(contact.id, None)
+        self.replacements[contact.id] = contact
+        if len(self.replacements) > self.k:
+            self.replacements.popitem(last=False)
+        return False
+
+    def remove(self, node_id: int):
+        self.replacements.pop(node_id, None)
+        if self.contacts.pop(node_id, None) and self.replacements:
+            _, contact = self.replacements.popitem()
+            self.contacts[contact.id] = contact
+
+
+class RoutingTable:
+    def __init__(self, node_id: int, k: int = 20):
+        self.node_id = node_id
+        self.k = k
+        self.buckets = [KBucket(k) for _ in range(ID_BITS)]
+        self.addrs: Dict[str, int] = {}
+
+    def __len__(self):
+        return len(self.addrs)
+
+    def bucket(self, node_id: int) -> KBucket:
+        return self.buckets[(self.node_id ^ node_id).bit_length() - 1]
+
+    def add(self, contact: Contact, is_dead=None) -> bool:
+        """
+        Add or refresh contact
+
+        :param is_dead: Optional predicate on address. If bucket is full and its
+            oldest contact is dead, the contact is replaced.
+        """
+        if contact.id == self.node_id:
+            return False
+        old_id = self.addrs.get(contact.addr)
+        if old_id is not None and old_id != contact.id:
+            self.remove(contact.addr)
+        bucket = self.bucket(contact.id)
+        if not bucket.touch(contact) and is_dead and is_dead(bucket.oldest.addr):
+            self.remove(bucket.oldest.addr)
+        if contact.id in bucket.contacts:
+            self.addrs[contact.addr] = contact.id
+            return True
+        return False
+
+    def remove(self, addr: str):
+        node_id = self.addrs.pop(addr, None)
+        if node_id is None:
+            return
+        bucket = self.bucket(node_id)
+        bucket.remove(node_id)
+        for contact in bucket.contacts.values():
+            self.addrs[contact.addr] = contact.id
+
+    def closest(self, target: int, count: int = None) -> List[Contact]:
+        contacts = (c for bucket in self.buckets if bucket.contacts for c in bucket.contacts.values())
+        return heapq.nsmallest(count or self.k, contacts, key=lambda c: c.id ^ target)
+
+
+class ValueStore(TempDict):
+    """
+    Records, which expire after `expire` seconds.
+    Oldest ones are evicted beyond `max_records`.
+    """
+
+    def __init__(self, expire: float, max_records: int = 100000):
+        super().__init__(factory=None)
+        self.expire = expire
+        self.max_records = max_records
+
+    def __setitem__(self, key, value):
+        self.pop(key, None)
+        super().__setitem__(key, value)
+        while len(self) > self.max_records:
+            del self[next(iter(self))]
+
+
+class DHT:
+    """
+    :param proto: `PeerProtocol` instance
+    :param wheel: `TimerWheel` instance for RPC timeouts and republishing
+    :param int k: Bucket size and replication factor
+    :param int alpha: Lookup concurrency
+    :param float timeout: RPC timeout in seconds
+    :param float expire: Lifetime of stored records
+    :param float cache_expire: Lifetime of records cached along lookup path
+    :param int max_records: Max number of stored and of cached records
+    """
+
+    def __init__(self,
+                 proto,
+                 wheel,
+                 k: int = 20,
+                 alpha: int = 3,
+                 timeout: float = 2,
+                 expire: float = 86400,
+                 cache_expire: float = 3600,
+                 max_records: int = 100000):
+        self.proto = proto
+        self.wheel = wheel
+        self.k = k
+        self.alpha = alpha
+        self.timeout = timeout
+        self.expire = expire
+
+        self.table: RoutingTable = None
+        self.storage = ValueStore(expire, max_records)
+        self.cache = ValueStore(cache_expire, max_records)
+
+    @property
+    def node_id(self) -> int:
+        return self.table.node_id
+
+    def is_dead(self, addr: str) -> bool:
+        deadpeer = self.proto.server.deadpeer
+        return deadpeer is not None and (deadpeer.is_suspect(addr) or addr not in deadpeer)
+
+    def start(self, seeds: List[str] = None):
+        """
+        Join the DHT: look up own id through known peers and publish own record
+        """
+        self.table = RoutingTable(digest(self.proto.public_key), self.k)
+        if seeds is None:
+            seeds = [_peer.addr for _peer in self.proto.peers]
+        return defer.ensureDeferred(self.bootstrap(seeds))
+
+    async def bootstrap(self, seeds: List[str]):
+        seeds = random.sample(seeds, min(len(seeds), self.alpha))
+        await defer.gatherResults([self.rpc(addr, 'dht_find_node', {'key': format(self.node_id, 'x')})
+                                   for addr in seeds])
+        await self.find_node(self.node_id)
+        log.info(f'DHT joined, {len(self.table)} contacts')
+        await self.republish()
+
+    async def republish(self):
+        await self.publish_user(self.proto.name, self.proto.public_key, self.proto.private_key)
+        self.wheel.call_later(self.expire / 2, lambda: defer.ensureDeferred(self.republish()))
+
+    def seen(self, addr: str, node_id: Optional[str]):
+        if not node_id or not isinstance(node_id, str) or self.table is None:
+            return
+        try:
+            contact = Contact(int(node_id, 16), addr)
+        except ValueError:
+            return
+        self.table.add(contact, self.is_dead)
+
+    def remove(self, addr: str):
+        if self.table is not None:
+            self.table.remove(addr)
+
+    def rpc(self, addr: str, name: str, data: dict) -> defer.Deferred:
+        """
+        Send DHT request to peer
+
+        :return: Deferred, which fires with response `Message` or None on timeout
+        """
+        result = defer.Deferred()
+        timer = self.wheel.call_later(self.timeout, lambda: result.called or result.callback(None))
+
+        def answered(message):
+            timer.cancel()
+            self.seen(addr, message.data.get('id'))
+            if not result.called:
+                result.callback(message)
+
+        data = dict(data, id=format(self.node_id, 'x'))
+        Peer(self.proto, addr=addr).request(Message(name, data), watch=True).addCallback(answered)
+        return result
+
+    def get(self, key: int) -> Optional[dict]:
+        return self.storage.get(key, self.cache.get(key))
+
+    def put(self, store: ValueStore, key: int, value) -> bool:
+        """
+        Save record, if it's valid and doesn't change key of known user
+
+        :return: Is record saved
+        """
+        if not check_record(key, value):
+            return False
+        known = self.get(key)
+        if known is not None and known['key'] != value['key']:
+            log.warning(f'DHT record of {value["name"]} with another key refused')
+            return False
+        store[key] = value
+        return True
+
+    def handle(self, message: Message, addr: str) -> Message:
+        """
+        Answer DHT request from peer
+
+        :return: Response message
+        """
+        self.seen(addr, message.data.get('id'))
+        data = {'id': format(self.node_id, 'x')}
+        key = int(message.data['key'], 16)
+        if message.name == 'dht_store':
+            store = self.cache if message.data.get('cache') else self.storage
+            if not self.put(store, key, message.data.get('value')):
+                return Message('dht_refused', data)
+            return Message('dht_stored', data)
+        if message.name == 'dht_find_value':
+            value = self.get(key)
+            if value is not None:
+                data['value'] = value
+                return Message('dht_value', data)
+        data['nodes'] = [c.dump() for c in self.table.closest(key) if c.addr != addr]
+        return Message('dht_nodes', data)
+
+    async def _lookup(self, target: int, find_value: bool = False):
+        shortlist = {c.id: c for c in self.table.closest(target)}
+        queried = set()
+        without_value = []
+        name = 'dht_find_value' if find_value else 'dht_find_node'
+
+        while True:
+            closest = heapq.nsmallest(self.k, shortlist.values(), key=lambda c: c.id ^ target)
+            pending = [c for c in closest if c.id not in queried][:self.alpha]
+            if not pending:
+                return None, closest
+            queried.update(c.id for c in pending)
+            responses = await defer.gatherResults([
+                self.rpc(c.addr, name, {'key': format(target, 'x')}) for c in pending
+            ])
+            for contact, response in zip(pending, responses):
+                if response is None:
+                    shortlist.pop(contact.id, None)
+                    continue
+                if find_value and check_record(target, response.data.get('value')):
+                    value = response.data['value']
+                    if without_value:
+                        cache_at = min(without_value, key=lambda c: c.id ^ target)
+                        self.rpc(cache_at.addr, 'dht_store', {
+                            'key': format(target, 'x'), 'value': value, 'cache': True
+                        })
+                    return value, closest
+                without_value.append(contact)
+                for data in response.data.get('nodes', []):
+                    try:
+                        found = Contact.load(data)
+                    except (ValueError, TypeError, IndexError):
+                        continue
+                    if found.id != self.node_id:
+                        shortlist.setdefault(found.id, found)
+
+    async def find_node(self, target: int) -> List[Contact]:
+        """
+        Iterative parallel lookup of `k` nodes closest to `target`
+        """
+        _, closest = await self._lookup(target)
+        return closest
+
+    async def find_value(self, key: int):
+        """
+        Iterative parallel lookup of value. Value is cached
+        at the closest node on lookup path which didn't have it.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+        value, _ = await self._lookup(key, find_value=True)
+        if value is not None:
+            self.put(self.cache, key, value)
+        return value
+
+    async def store(self, key: int, value):
+        """
+        Store value at `k` nodes closest to `key`
+        """
+        closest = await self.find_node(key)
+        if not closest or (key ^ self.node_id) < (key ^ closest[-1].id) or len(closest) < self.k:
+            self.put(self.storage, key, value)
+        await defer.gatherResults([
+            self.rpc(c.addr, 'dht_store', {'key': format(key, 'x'), 'value': value}) for c in closest
+        ])
+
+    async def publish_user(self, name: str, public_key: str, private_key: str):
+        await self.store(digest(name), user_record(name, public_key, private_key))
+
+    async def find_user(self, name: str) -> Optional[dict]:
+        """
+        :return: User record with `name`, `key` and `sign` fields or None
+        """
+        record = await self.find_value(digest(name))
+        if not isinstance(record, dict) or record.get('name') != name:
+            return None
+        return record
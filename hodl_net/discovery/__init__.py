@@ -1 +1,19 @@
-from .lpd import LPD
+import importlib
+
+_lazy = {
+    'LPD': 'lpd',
+    'DeadPeerDetector': 'deadpeer',
+    'PeerExchange': 'ppx',
+    'PeerTable': 'peertable',
+    'PeerMap': 'peermap',
+    'Bootstrap': 'bootstrap',
+    'DiscoverySource': 'bootstrap',
+}
+
+__all__ = list(_lazy)
+
+
+def __getattr__(name):
+    if name not in _lazy:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    return getattr(importlib.import_module(f'.{_lazy[name]}', __name__), name)
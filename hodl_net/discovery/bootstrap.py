@@ -0,0 +1,264 @@
+"""
+Concurrent Bootstrap for Hodleum Networking Stack
+
+On start all discovery sources run at once: peer snapshot, peers in DB,
+static seeds, LPD and PEX. Found addresses pass the peer table, are stored
+with one DB statement per batch and pinged in parallel, and bootstrap is
+over as soon as `target` peers answered.
+
+Alternative discovery method is a `DiscoverySource`:
+
+    class DNSSeeds(DiscoverySource):
+        name = 'dns'
+
+        def start(self, found):
+            return lookup_seeds().addCallback(found)
+
+    server.bootstrap.register(DNSSeeds())
+"""
+
+from twisted.internet import defer
+from collections import deque
+from typing import Callable, Dict, Iterable, List, Optional
+import functools
+import logging
+
+from ..models import Peer, Message
+from ..database import db_worker
+from .snapshot import read
+
+log = logging.getLogger(__name__)
+
+
+class DiscoverySource:
+    """
+    Source of peer addresses. `start` gets `found` callable, which takes an
+    iterable of "ip:port" addresses; the source may call it any number of
+    times, at once or later.
+    """
+
+    name = 'source'
+
+    def start(self, found: Callable[[Iterable[str]], None]) -> Optional[defer.Deferred]:
+        """
+        :return: Deferred, which fires when the source has nothing more to find.
+            None if it is done at once.
+        """
+        raise NotImplementedError
+
+    def connected(self, addr: str):
+        """
+        Peer found by any source answered
+        """
+
+    def stop(self):
+        pass
+
+
+class SnapshotSource(DiscoverySource):
+    """
+    Peers and user keys of the warm-start snapshot, see `hodl_net.discovery.snapshot`
+    """
+
+    name = 'snapshot'
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def start(self, found):
+        snapshot = read(self.path)
+        if snapshot is None:
+            return
+        db_worker.storage.add_users(snapshot.users)
+        log.info(f'Peer snapshot: {len(snapshot.peers)} peers, {len(snapshot.users)} users')
+        found(snapshot.peers)
+
+
+class DBSource(DiscoverySource):
+    """
+    Peers persisted in DB
+    """
+
+    name = 'db'
+
+    def __init__(self, proto):
+        self.proto = proto
+
+    def start(self, found):
+        found(_peer.addr for _peer in self.proto.peers)
+
+
+class StaticSource(DiscoverySource):
+    """
+    Configured seed nodes. Host names are resolved concurrently.
+
+    :param list seeds: "host:port" addresses
+    :param resolver: Object with `resolve(name)` method, reactor by default
+    """
+
+    name = 'static'
+
+    def __init__(self, seeds: List[str], resolver=None):
+        if resolver is None:
+            from twisted.internet import reactor as resolver
+        self.seeds = seeds
+        self.resolver = resolver
+
+    def start(self, found):
+        lookups = []
+        for seed in self.seeds:
+            host, _, port = seed.rpartition(':')
+            d = self.resolver.resolve(host.strip('[]'))
+            d.addCallback(lambda ip, port=port: found([f'{ip}:{port}']))
+            d.addErrback(lambda f, seed=seed: log.warning(f'Seed {seed} is not resolved: {f.getErrorMessage()}'))
+            lookups.append(d)
+        return defer.DeferredList(lookups)
+
+
+class LPDSource(DiscoverySource):
+    """
+    Peers announced in LAN. LPD reports them to bootstrap instead of storing.
+    """
+
+    name = 'lpd'
+
+    def __init__(self, lpd):
+        self.lpd = lpd
+
+    def start(self, found):
+        self.lpd.found = found
+
+    def stop(self):
+        self.lpd.found = None
+
+
+class PexSource(DiscoverySource):
+    """
+    Peers of the first answered peers: PEX sync, `share` request if PEX is off
+
+    :param int fanout: Number of answered peers asked
+    """
+
+    name = 'pex'
+
+    def __init__(self, proto, fanout: int = 3):
+        self.proto = proto
+        self.fanout = fanout
+        self.found = None
+        self.asked = 0
+
+    def start(self, found):
+        self.found = found
+
+    def connected(self, addr: str):
+        if self.asked >= self.fanout:
+            return
+        self.asked += 1
+        ppx = self.proto.server.ppx
+        if ppx is not None:
+            ppx.sync(addr).addCallback(self.found)
+        else:
+            Peer(self.proto, addr=addr).request(Message('share'))
+
+
+class Bootstrap:
+    """
+    :param proto: `PeerProtocol` instance
+    :param wheel: `TimerWheel` instance
+    :param int target: Number of answered peers, at which node is ready
+    :param float timeout: Node is ready after this time anyway
+    :param int concurrency: Max pings in flight
+    :param float ping_timeout: Time to wait for `pong`
+    """
+
+    def __init__(self, proto, wheel, target: int = 8, timeout: float = 10, concurrency: int = 32,
+                 ping_timeout: float = 1):
+        self.proto = proto
+        self.wheel = wheel
+        self.target = target
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.ping_timeout = ping_timeout
+
+        self.sources: List[DiscoverySource] = []
+        self.ready = defer.Deferred()
+        self.connected = 0
+        self.seen = set()
+        self.started = None
+        self._queue = deque()
+        self._inflight: Dict[str, object] = {}
+        self._running = 0
+
+    def register(self, source: DiscoverySource):
+        self.sources.append(source)
+
+    def now(self) -> float:
+        return self.wheel.clock.seconds()
+
+    def start(self) -> defer.Deferred:
+        """
+        Run all sources
+
+        :return: Deferred, which fires with the number of answered peers, when node is ready
+        """
+        self.started = self.now()
+        self.wheel.call_later(self.timeout, self._finish)
+        self._running = len(self.sources)
+        for source in list(self.sources):
+            try:
+                d = source.start(functools.partial(self._found, source))
+            except Exception as ex:
+                log.error(f'Discovery source {source.name} failed: {ex}')
+                d = None
+            if d is None:
+                self._source_done(None, source)
+            else:
+                d.addErrback(lambda f, source=source: log.error(
+                    f'Discovery source {source.name} failed: {f.getErrorMessage()}'))
+                d.addBoth(self._source_done, source)
+        return self.ready
+
+    def stop(self):
+        for source in self.sources:
+            source.stop()
+
+    def _source_done(self, _, source: DiscoverySource):
+        self._running -= 1
+        self._check()
+
+    def _found(self, source: DiscoverySource, addrs: Optional[Iterable[str]]):
+        new = [addr for addr in addrs or () if addr not in self.seen]
+        self.seen.update(new)
+        if new:
+            self._queue.extend(self.proto.add_peers(new, source.name))
+            self._pump()
+
+    def _pump(self):
+        while self._queue and len(self._inflight) < self.concurrency:
+            addr = self._queue.popleft()
+            self._inflight[addr] = self.wheel.call_later(self.ping_timeout, self._answered, addr, False)
+            Peer(self.proto, addr=addr).request(Message('ping'), watch=True).addCallback(
+                lambda _, addr=addr: self._answered(addr, True))
+        self._check()
+
+    def _answered(self, addr: str, ok: bool):
+        timer = self._inflight.pop(addr, None)
+        if timer is None:
+            return
+        if ok:
+            timer.cancel()
+            self.connected += 1
+            for source in self.sources:
+                source.connected(addr)
+        self._pump()
+
+    def _check(self):
+        if self.connected >= self.target or not self._running and not self._queue and not self._inflight:
+            self._finish()
+
+    def _finish(self):
+        if self.ready.called:
+            return
+        log.info(f'Bootstrap: {self.connected} of {len(self.seen)} peers answered '
+                 f'in {self.now() - self.started:.3f}s')
+        self.ready.callback(self.connected)
@@ -4,5 +4,8 @@ class Core:
         def __init__(self):
             self.peers = []
 
+        def add_peer(self, _peer, method=None):
+            self.peers.append(_peer)
+
     def __init__(self):
         self.udp = self.PeerProtocol()
@@ -1 +1,244 @@
-# TODO
+"""
+Dead Peer Detection for Hodleum Networking Stack
+
+SWIM-style failure detector. Every known peer gets one timer on the shared
+`TimerWheel`; a peer is probed directly with `ping`, then indirectly with
+`ping_req` through a few other peers, and evicted once its phi-accrual
+suspicion level crosses the threshold.
+
+Any datagram received from a peer counts as a heartbeat, so busy peers are
+never probed at all.
+"""
+
+from twisted.internet import defer
+from collections import deque
+from typing import Callable, Dict, List
+
+from ..models import Peer, Message
+
+import logging
+import random
+import math
+
+log = logging.getLogger(__name__)
+
+
+class PhiAccrual:
+    """
+    Phi-accrual suspicion level with exponentially distributed heartbeat
+    inter-arrival times.
+
+    :param float first: Inter-arrival time assumed until first heartbeats arrive
+    :param int window: Number of inter-arrival times to remember
+    """
+
+    __slots__ = ('intervals', 'total', 'last')
+
+    window = 64
+
+    def __init__(self, now: float, first: float):
+        self.intervals = deque([first], maxlen=self.window)
+        self.total = first
+        self.last = now
+
+    def heartbeat(self, now: float):
+        interval = now - self.last
+        if len(self.intervals) == self.intervals.maxlen:
+            self.total -= self.intervals[0]
+        self.intervals.append(interval)
+        self.total += interval
+        self.last = now
+
+    @property
+    def mean(self) -> float:
+        return max(self.total / len(self.intervals), 1e-3)
+
+    def phi(self, now: float) -> float:
+        """
+        -log10 of the probability that a heartbeat is still to come
+        """
+        return (now - self.last) / (self.mean * math.log(10))
+
+
+class PeerState:
+    __slots__ = ('addr', 'detector', 'interval', 'timer', 'sent', 'indirect', 'suspect', 'index')
+
+    def __init__(self, addr: str, detector: PhiAccrual, interval: float, index: int):
+        self.addr = addr
+        self.detector = detector
+        self.interval = interval
+        self.timer = None
+        self.sent = None
+        self.indirect = False
+        self.suspect = False
+        self.index = index
+
+
+class DeadPeerDetector:
+    """
+    :param proto: `PeerProtocol` instance
+    :param wheel: `TimerWheel` instance, shared with other subsystems
+    :param float interval: Minimal probe interval in seconds
+    :param float max_interval: Probe interval of long-time stable peers
+    :param float timeout: Time to wait for `pong` before indirect probing
+    :param int indirect_probes: Number of peers asked to probe a silent peer
+    :param float phi_threshold: Suspicion level at which peer is evicted
+    """
+
+    def __init__(self,
+                 proto,
+                 wheel,
+                 interval: float = 2,
+                 max_interval: float = 60,
+                 timeout: float = 1,
+                 indirect_probes: int = 3,
+                 phi_threshold: float = 8):
+        self.proto = proto
+        self.wheel = wheel
+        self.interval = interval
+        self.max_interval = max_interval
+        self.timeout = timeout
+        self.indirect_probes = indirect_probes
+        self.phi_threshold = phi_threshold
+
+        self.members: Dict[str, PeerState] = {}
+        self._order: List[str] = []
+        self.on_rtt: Callable[[str, float], None] = None  # Called with round trip time of answered probe
+        self.on_loss: Callable[[str], None] = None  # Called with address of peer, which missed direct probe
+        self._watchers: Dict[str, List[defer.Deferred]] = {}
+
+    def __len__(self):
+        return len(self.members)
+
+    def __contains__(self, addr: str):
+        return addr in self.members
+
+    def now(self) -> float:
+        return self.wheel.clock.seconds()
+
+    def start(self):
+        """
+        Start tracking all peers known at the moment
+        """
+        for _peer in self.proto.peers:
+            self.track(_peer.addr)
+        self.wheel.start()
+        log.info(f'Dead peer detection started for {len(self)} peers')
+
+    def track(self, addr: str):
+        if addr in self.members:
+            return
+        state = PeerState(addr, PhiAccrual(self.now(), self.interval), self.interval, len(self._order))
+        self.members[addr] = state
+        self._order.append(addr)
+        self._schedule(state, random.uniform(0, self.interval))
+
+    def forget(self, addr: str):
+        state = self.members.pop(addr, None)
+        if not state:
+            return
+        if state.timer:
+            state.timer.cancel()
+        last = self._order.pop()
+        if last != addr:
+            self._order[state.index] = last
+            self.members[last].index = state.index
+        for d in self._watchers.pop(addr, []):
+            d.callback(False)
+
+    def is_suspect(self, addr: str) -> bool:
+        state = self.members.get(addr)
+        return bool(state and state.suspect)
+
+    def heard_from(self, addr: str):
+        """
+        Record heartbeat of peer. Called for every received datagram.
+        """
+        state = self.members.get(addr)
+        if not state:
+            self.track(addr)
+        else:
+            state.detector.heartbeat(self.now())
+            if state.suspect:
+                log.info(f'Peer {addr} is alive again')
+                state.suspect = False
+                state.interval = self.interval
+        for d in self._watchers.pop(addr, []):
+            d.callback(True)
+
+    def relay(self, addr: str) -> defer.Deferred:
+        """
+        Probe peer on behalf of another peer (`ping_req`)
+
+        :return: Deferred, which fires with True if peer answered in time
+        """
+        d = defer.Deferred()
+        self._watchers.setdefault(addr, []).append(d)
+        self.wheel.call_later(self.timeout, self._relay_timeout, addr, d)
+        Peer(self.proto, addr=addr).request(Message('ping'))
+        return d
+
+    def _relay_timeout(self, addr: str, d: defer.Deferred):
+        watchers = self._watchers.get(addr, [])
+        if d in watchers:
+            watchers.remove(d)
+            if not watchers:
+                del self._watchers[addr]
+            d.callback(False)
+
+    def _schedule(self, state: PeerState, delay: float):
+        if state.timer:
+            state.timer.cancel()
+        state.timer = self.wheel.call_later(delay, self._probe, state)
+
+    def _probe(self, state: PeerState):
+        now = self.now()
+        silence = now - state.detector.last
+        if not state.suspect and silence < state.interval:
+            return self._schedule(state, state.interval - silence)
+        state.sent = now
+        state.indirect = False
+        d = Peer(self.proto, addr=state.addr).request(Message('ping'))
+        if self.on_rtt:
+            d.addCallback(lambda _, addr=state.addr: self.on_rtt(addr, self.now() - now))
+        state.timer = self.wheel.call_later(self.timeout, self._on_timeout, state)
+
+    def _on_timeout(self, state: PeerState):
+        if state.detector.last >= state.sent:
+            state.interval = min(state.interval * 2, self.max_interval)
+            return self._schedule(state, state.interval)
+
+        if not state.indirect:
+            state.indirect = True
+            if self.on_loss:
+                self.on_loss(state.addr)
+            for helper in self._helpers(state.addr):
+                d = Peer(self.proto, addr=helper).request(
+                    Message('ping_req', {'address': state.addr}))
+                d.addCallback(lambda _, addr=state.addr: self.heard_from(addr))
+            state.timer = self.wheel.call_later(self.timeout * 2, self._on_timeout, state)
+            return
+
+        phi = state.detector.phi(self.now())
+        if phi >= self.phi_threshold:
+            return self.evict(state.addr)
+        if not state.suspect:
+            log.debug(f'Peer {state.addr} is suspected, phi={phi:.2f}')
+        state.suspect = True
+        state.interval = self.interval
+        self._schedule(state, state.interval)
+
+    def _helpers(self, addr: str) -> List[str]:
+        helpers = set()
+        for _ in range(self.indirect_probes * 2):
+            if len(helpers) >= self.indirect_probes or len(self._order) < 2:
+                break
+            helper = random.choice(self._order)
+            if helper != addr and not self.members[helper].suspect:
+                helpers.add(helper)
+        return list(helpers)
+
+    def evict(self, addr: str):
+        log.info(f'Peer {addr} is dead, evicting')
+        self.forget(addr)
+        self.proto.remove_peer(addr)
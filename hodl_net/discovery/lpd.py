@@ -1,19 +1,23 @@
 """
 Local Peer Discovery realization for Hodleum Networking Stack
 
+Announcements are scheduled with Trickle algorithm (RFC 6206): the announce
+interval doubles up to `max_interval` while the neighbourhood is stable and
+drops back to `lpd_interval` when a new peer appears. A node also keeps
+silent in the current interval if it has heard enough known announcements.
+
 Changelog:
 v0.0.1 by DanGSun - Basic Realization
+v0.0.2 - Trickle timer, binary announcements, in-memory dedup
 
 """
 
 import logging
+import random
+import struct
 import json
 
 from twisted.internet.protocol import DatagramProtocol
-from twisted.internet import task
-from twisted.internet import reactor
-
-from time import sleep
 
 from .core_emul import Core
 from ..models import Peer
@@ -22,54 +26,127 @@ log = logging.getLogger(__name__)
 
 
 class LPD(DatagramProtocol):
+    """
+    :param core: `Server` instance
+    :param int lpd_port: Multicast port
+    :param int main_port: Port of our `PeerProtocol`
+    :param str multicast_ip: Multicast group
+    :param float lpd_interval: Minimal announce interval
+    :param float max_interval: Maximal announce interval
+    :param int redundancy: Announcement is suppressed if we've heard this many
+        announcements from known peers during the interval
+    :param clock: `IReactorTime` provider. Reactor by default.
+    """
+
+    magic = b'HDN'
+    version = 2
+    packet = struct.Struct('!3sBHI')
 
     def __init__(self,
                  core,
                  lpd_port: int = 9999,
                  main_port: int = 8000,
                  multicast_ip: str = '224.0.0.1',
-                 lpd_interval: int = 2):
+                 lpd_interval: float = 2,
+                 max_interval: float = 300,
+                 redundancy: int = 1,
+                 clock=None):
 
+        if clock is None:
+            from twisted.internet import reactor as clock
         self.core = core
+        self.clock = clock
         self.lpd_port = lpd_port
         self.lpd_ip = multicast_ip
         self.main_port = main_port
-        self.announce_interval = lpd_interval
-        self.data = {
-            'prt': {
-                'nm': "HDN-NetStack",
-                'v': '2.0'
-            },
-
-            'gl': "LPD",
-            'dt': {
-                'prt': self.main_port
-            }
-        }
-
-        self.announcer = task.LoopingCall(self.announce)
+        self.min_interval = lpd_interval
+        self.max_interval = max_interval
+        self.redundancy = redundancy
+
+        self.interval = lpd_interval
+        self.counter = 0
+        self.seen = set()
+        self.nonce = random.getrandbits(32)
+        self.data = None
+        self._calls = []
+        self.found = None  # Set by `hodl_net.discovery.bootstrap.LPDSource`
+
+    def _cancel(self):
+        for call in self._calls:
+            if call.active():
+                call.cancel()
+        self._calls = []
+
+    def _start_interval(self):
+        self._cancel()
+        self.counter = 0
+        self._calls = [
+            self.clock.callLater(random.uniform(self.interval / 2, self.interval), self.announce),
+            self.clock.callLater(self.interval, self._end_interval)
+        ]
+
+    def _end_interval(self):
+        self.interval = min(self.interval * 2, self.max_interval)
+        self._start_interval()
+
+    def reset(self):
+        """
+        Neighbourhood changed: announce soon
+        """
+        if self.interval == self.min_interval and self._calls:
+            return
+        self.interval = self.min_interval
+        self._start_interval()
 
     def announce(self):
-
+        if self.counter >= self.redundancy:
+            return
         try:
-            self.transport.write(json.dumps(self.data).encode(), (self.lpd_ip, self.lpd_port))
+            self.transport.write(self.data, (self.lpd_ip, self.lpd_port))
         except AttributeError:
             log.debug("Detected an AttributeError... Handling it, like a program stop")
-            self.announcer.stop()
+            self._cancel()
             log.info("LPD Caster Stopped...")
 
     def startProtocol(self):
         log.info(f"LPD Started at {self.lpd_port}")
-        self.announcer.start(self.announce_interval)
+        self.data = self.packet.pack(self.magic, self.version, self.main_port, self.nonce)
         # Join the multicast address, so we can receive replies:
         self.transport.joinGroup(self.lpd_ip)
+        self.reset()
+
+    def stopProtocol(self):
+        self._cancel()
+
+    def parse(self, datagram: bytes):
+        """
+        :return: (port, nonce) or None for foreign datagrams.
+            Nonce is None for JSON announcements of v0.0.1.
+        """
+        if len(datagram) == self.packet.size:
+            magic, version, port, nonce = self.packet.unpack(datagram)
+            if magic == self.magic and version == self.version:
+                return port, nonce
+            return None
+        try:
+            return int(json.loads(datagram.decode())['dt']['prt']), None
+        except (ValueError, UnicodeDecodeError, KeyError, TypeError):
+            return None
 
     def datagramReceived(self, datagram, address):
-        dtgrm = json.loads(datagram.decode())
-        addr = "{}:{}".format(address[0], dtgrm['dt']['prt'])
-        _peer = Peer(self, addr=addr)
-        if _peer not in self.core.udp.peers:
-            self.core.udp.add_peer(_peer, "LPD")
+        announce = self.parse(datagram)
+        if not announce or announce[1] == self.nonce:
+            return
+        addr = "{}:{}".format(address[0], announce[0])
+        if addr in self.seen:
+            self.counter += 1
+            return
+        self.seen.add(addr)
+        if self.found:
+            self.found([addr])
+        else:
+            self.core.udp.add_peer(Peer(self.core.udp, addr=addr), "LPD")
+        self.reset()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,239 @@
+"""
+Peer Map Builder for Hodleum Networking Stack
+
+Overlay topology as seen through peer exchanges: every `share_info` and PEX
+delta from a peer tells which peers it knows. Nodes are interned to integer
+ids; both the reports and the undirected graph are sorted `array('I')` rows,
+4 bytes per edge end. A report only touches the rows of its changed edges,
+so there are no rebuilds and queries always see the current map. 100k nodes
+with 50 known peers each take about 120 MB. Ids of nodes, which are left
+without edges and reports, are reused.
+"""
+
+from array import array
+from collections import deque
+from typing import Dict, List, Optional, Set
+import bisect
+
+import logging
+
+log = logging.getLogger(__name__)
+
+_empty = array('I')
+
+
+def _has(row: array, x: int) -> bool:
+    i = bisect.bisect_left(row, x)
+    return i < len(row) and row[i] == x
+
+
+def _insert(row: array, x: int):
+    i = bisect.bisect_left(row, x)
+    if i == len(row) or row[i] != x:
+        row.insert(i, x)
+
+
+def _remove(row: array, x: int):
+    i = bisect.bisect_left(row, x)
+    if i < len(row) and row[i] == x:
+        del row[i]
+
+
+class PeerMap:
+    """
+    :param int max_nodes: Max nodes in map. Reports about further nodes are ignored.
+    """
+
+    def __init__(self, max_nodes: int = 200000):
+        self.max_nodes = max_nodes
+        self.ids: Dict[str, int] = {}
+        self.addrs: List[Optional[str]] = []
+        self.edges = 0
+        self._free: List[int] = []
+        self._reports: Dict[int, array] = {}
+        self._adj: List[array] = []
+        self._labels: Optional[array] = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, addr: str):
+        return addr in self.ids
+
+    def _id(self, addr: str) -> Optional[int]:
+        i = self.ids.get(addr)
+        if i is None and self._free:
+            i = self.ids[addr] = self._free.pop()
+            self.addrs[i] = addr
+        elif i is None and len(self.addrs) < self.max_nodes:
+            i = self.ids[addr] = len(self.addrs)
+            self.addrs.append(addr)
+            self._adj.append(array('I'))
+        return i
+
+    def _release(self, i: int):
+        """
+        Free id of node without edges and report
+        """
+        if len(self._adj[i]) or len(self._reports.get(i, _empty)):
+            return
+        self._reports.pop(i, None)
+        del self.ids[self.addrs[i]]
+        self.addrs[i] = None
+        self._free.append(i)
+        self._labels = None
+
+    def report(self, reporter: str, addrs, full: bool = False):
+        """
+        Record that `reporter` knows `addrs`
+
+        :param bool full: `addrs` are all peers of reporter (`share_info`),
+            otherwise they are added to its known ones (PEX delta)
+        """
+        u = self._id(reporter)
+        if u is None:
+            return
+        ids = {v for v in map(self._id, addrs) if v is not None and v != u}
+        old = set(self._reports.get(u, _empty))
+        added = ids - old
+        removed = old - ids if full else set()
+        if not added and not removed:
+            self._release(u)
+            return
+        reports, adj = self._reports, self._adj
+        if full:
+            reports[u] = array('I', sorted(ids))
+        else:
+            reports[u] = array('I', sorted(old | ids))
+        # Edge lives while any of its ends reports it
+        for v in added:
+            if not _has(reports.get(v, _empty), u):
+                _insert(adj[u], v)
+                _insert(adj[v], u)
+                self.edges += 1
+        for v in removed:
+            if not _has(reports.get(v, _empty), u):
+                _remove(adj[u], v)
+                _remove(adj[v], u)
+                self.edges -= 1
+            self._release(v)
+        self._release(u)
+        self._labels = None
+
+    def forget(self, reporter: str):
+        """
+        Drop report of peer, e.g. when it is dead
+        """
+        if reporter in self.ids:
+            self.report(reporter, (), full=True)
+
+    def degree(self, addr: str) -> int:
+        i = self.ids.get(addr)
+        return 0 if i is None else len(self._adj[i])
+
+    def neighbours(self, addr: str) -> List[str]:
+        i = self.ids.get(addr)
+        return [] if i is None else [self.addrs[j] for j in self._adj[i]]
+
+    def k_hop(self, addr: str, k: int) -> Set[str]:
+        """
+        Nodes within `k` hops from `addr`, not including it
+        """
+        start = self.ids.get(addr)
+        if start is None:
+            return set()
+        seen = {start}
+        frontier = [start]
+        for _ in range(k):
+            nxt = []
+            for u in frontier:
+                for v in self._adj[u]:
+                    if v not in seen:
+                        seen.add(v)
+                        nxt.append(v)
+            frontier = nxt
+        seen.discard(start)
+        return {self.addrs[i] for i in seen}
+
+    def _components(self) -> array:
+        if self._labels is not None:
+            return self._labels
+        adj = self._adj
+        labels = array('i', [-1]) * len(adj)
+        label = 0
+        for start in range(len(adj)):
+            if labels[start] >= 0 or self.addrs[start] is None:
+                continue
+            labels[start] = label
+            stack = [start]
+            while stack:
+                for v in adj[stack.pop()]:
+                    if labels[v] < 0:
+                        labels[v] = label
+                        stack.append(v)
+            label += 1
+        self._labels = labels
+        return labels
+
+    def component_sizes(self) -> List[int]:
+        """
+        Sizes of connected components, largest first. More than one component
+        is a partition. Components are cached until the map changes.
+        """
+        sizes = {}
+        for label in self._components():
+            if label >= 0:
+                sizes[label] = sizes.get(label, 0) + 1
+        return sorted(sizes.values(), reverse=True)
+
+    def connected(self, a: str, b: str) -> bool:
+        i, j = self.ids.get(a), self.ids.get(b)
+        if i is None or j is None:
+            return False
+        labels = self._components()
+        return labels[i] == labels[j]
+
+    def disjoint_paths(self, src: str, dst: str, n: int = 3, max_len: int = 8) -> List[List[str]]:
+        """
+        Up to `n` paths from `src` to `dst` without common intermediate nodes.
+        Paths are found greedily by BFS, shortest first; inner nodes of every
+        found path are excluded from the next searches.
+
+        :param int max_len: Max number of hops
+        :return: Paths as lists of addresses from `src` to `dst`
+        """
+        s, t = self.ids.get(src), self.ids.get(dst)
+        if s is None or t is None or s == t:
+            return []
+        blocked = set()
+        paths = []
+        direct = False
+        while len(paths) < n:
+            parent = {s: None}
+            queue = deque([(s, 0)])
+            found = False
+            while queue and not found:
+                u, depth = queue.popleft()
+                if depth >= max_len:
+                    continue
+                for v in self._adj[u]:
+                    if v == t:
+                        if u == s and direct:
+                            continue
+                        parent[t] = u
+                        found = True
+                        break
+                    if v not in parent and v not in blocked:
+                        parent[v] = u
+                        queue.append((v, depth + 1))
+            if not found:
+                break
+            path = [t]
+            while parent[path[-1]] is not None:
+                path.append(parent[path[-1]])
+            path.reverse()
+            if len(path) == 2:
+                direct = True
+            blocked.update(path[1:-1])
+            paths.append([self.addrs[i] for i in path])
+        return paths
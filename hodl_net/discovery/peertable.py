@@ -0,0 +1,255 @@
+"""
+Bounded Peer Table for Hodleum Networking Stack
+
+Every peer address we learn - from a datagram, `share_info`, PEX, LPD or
+`add_peer` - has to be admitted by the table first. The table holds at most
+`capacity` peers and at most `bucket_size` of one address prefix (/16 for
+IPv4, /32 for IPv6), so one network can't fill it.
+
+Score of peer is kept as a time-invariant key in seconds: the time it was
+last heard from, plus bonuses for proven age, low latency and the number of
+different prefixes that told us about it. Peers which were never heard from
+start `untested` seconds in the past. Keys only change on events, so the
+worst peer of the table and of every bucket is the top of a heap, and
+admission with eviction costs O(log n).
+"""
+
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+import ipaddress
+import heapq
+import random
+
+import logging
+
+log = logging.getLogger(__name__)
+
+
+def prefix(addr: str) -> str:
+    """
+    Bucket of "ip:port" address: /16 network of IPv4 address, /32 network of IPv6 one.
+    Host names are their own buckets, so are local addresses: many nodes of one
+    host or LAN are fine.
+    """
+    host = addr.rpartition(':')[0].strip('[]') or addr
+    try:
+        ip = ipaddress.ip_address(host)
+    except ValueError:
+        return host
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    if not ip.is_global:
+        return addr
+    bits = 16 if ip.version == 4 else 32
+    return str(ipaddress.ip_network(f'{ip}/{bits}', strict=False))
+
+
+class PeerRecord:
+    __slots__ = ('addr', 'bucket', 'first_seen', 'last_seen', 'rtt', 'sources', 'key', 'seq', 'index')
+
+    def __init__(self, addr: str, bucket: str, now: float, untested: float, index: int):
+        self.addr = addr
+        self.bucket = bucket
+        self.first_seen = now
+        self.last_seen = now - untested
+        self.rtt: Optional[float] = None
+        self.sources: Set[str] = set()
+        self.key = 0.
+        self.seq = 0
+        self.index = index
+
+
+class PeerTable:
+    """
+    :param clock: Object with `seconds()` method, reactor or `twisted.internet.task.Clock`
+    :param int capacity: Max peers
+    :param int bucket_size: Max peers of one address prefix
+    :param float untested: Age of last contact assumed for peers, which were never heard from
+    :param float age_weight: Score seconds per second between the first and the last contact
+    :param float latency_weight: Score seconds of peer with zero round trip time
+    :param float latency_ref: Round trip time, which halves latency bonus
+    :param float source_weight: Score seconds per extra prefix, which reported the peer
+    :param int max_sources: Max counted prefixes
+    """
+
+    def __init__(self,
+                 clock,
+                 capacity: int = 1000,
+                 bucket_size: int = 32,
+                 untested: float = 600,
+                 age_weight: float = 0.1,
+                 latency_weight: float = 60,
+                 latency_ref: float = 0.1,
+                 source_weight: float = 60,
+                 max_sources: int = 8):
+        self.clock = clock
+        self.capacity = capacity
+        self.bucket_size = bucket_size
+        self.untested = untested
+        self.age_weight = age_weight
+        self.latency_weight = latency_weight
+        self.latency_ref = latency_ref
+        self.source_weight = source_weight
+        self.max_sources = max_sources
+
+        self.records: Dict[str, PeerRecord] = {}
+        self.loaded = False
+        self._order: List[str] = []
+        self._heap: List[Tuple[float, int, str]] = []
+        self._buckets: Dict[str, List[Tuple[float, int, str]]] = {}
+        self._sizes: Dict[str, int] = {}
+        self._seq = 0
+        self.evicted = 0
+        self.rejected = 0
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, addr: str):
+        return addr in self.records
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._order)
+
+    def score(self, addr: str) -> Optional[float]:
+        """
+        Current score of peer: seconds since its last contact, corrected by bonuses. Higher is better.
+        """
+        record = self.records.get(addr)
+        return record and record.key - self.clock.seconds()
+
+    def _key(self, record: PeerRecord) -> float:
+        key = record.last_seen + self.age_weight * max(record.last_seen - record.first_seen, 0)
+        if record.rtt is not None:
+            key += self.latency_weight / (1 + record.rtt / self.latency_ref)
+        return key + self.source_weight * max(len(record.sources) - 1, 0)
+
+    def _push(self, record: PeerRecord):
+        self._seq += 1
+        record.seq = self._seq
+        record.key = self._key(record)
+        entry = (record.key, record.seq, record.addr)
+        heapq.heappush(self._heap, entry)
+        heap = self._buckets[record.bucket]
+        heapq.heappush(heap, entry)
+        if len(heap) > 2 * self._sizes[record.bucket] + 16:
+            self._buckets[record.bucket] = self._compact(heap)
+        if len(self._heap) > 2 * len(self.records) + 64:
+            self._heap = self._compact(self._heap)
+
+    def _compact(self, heap: list) -> list:
+        heap = [entry for entry in heap if self._live(entry)]
+        heapq.heapify(heap)
+        return heap
+
+    def _live(self, entry: Tuple[float, int, str]) -> bool:
+        record = self.records.get(entry[2])
+        return record is not None and record.seq == entry[1]
+
+    def _worst(self, heap: list) -> Optional[PeerRecord]:
+        while heap and not self._live(heap[0]):
+            heapq.heappop(heap)
+        if not heap:
+            return None
+        return self.records[heap[0][2]]
+
+    def offer(self, addr: str, source: str = None) -> Tuple[bool, Optional[str]]:
+        """
+        Admit peer, evicting the worst peer of its bucket or of the table if they are full
+        and the newcomer scores better
+
+        :param str source: Address of peer, which told us about `addr`
+        :return: (peer is in table, evicted address or None)
+        """
+        record = self.records.get(addr)
+        if record is not None:
+            self._add_source(record, source)
+            return True, None
+
+        bucket = prefix(addr)
+        record = PeerRecord(addr, bucket, self.clock.seconds(), self.untested, len(self._order))
+        if source is not None:
+            record.sources.add(prefix(source))
+
+        victim = None
+        if self._sizes.get(bucket, 0) >= self.bucket_size:
+            victim = self._worst(self._buckets[bucket])
+        elif len(self.records) >= self.capacity:
+            victim = self._worst(self._heap)
+        if victim is not None and victim.key >= self._key(record):
+            self.rejected += 1
+            return False, None
+        if victim is not None:
+            self.discard(victim.addr)
+            self.evicted += 1
+            log.debug(f'Peer {victim.addr} evicted by {addr}')
+
+        record.index = len(self._order)
+        self.records[addr] = record
+        self._order.append(addr)
+        self._buckets.setdefault(bucket, [])
+        self._sizes[bucket] = self._sizes.get(bucket, 0) + 1
+        self._push(record)
+        return True, victim and victim.addr
+
+    def _add_source(self, record: PeerRecord, source: Optional[str]):
+        if source is None or len(record.sources) >= self.max_sources:
+            return
+        source = prefix(source)
+        if source not in record.sources:
+            record.sources.add(source)
+            self._push(record)
+
+    def heard(self, addr: str):
+        """
+        Record contact with peer
+        """
+        record = self.records.get(addr)
+        now = self.clock.seconds()
+        # Busy peers are heard on every datagram, the heap is updated once a second
+        if record is not None and now - record.last_seen >= 1:
+            record.last_seen = now
+            self._push(record)
+
+    def rtt(self, addr: str, seconds: float):
+        """
+        Record round trip time of peer, smoothed as in TCP
+        """
+        record = self.records.get(addr)
+        if record is not None:
+            record.rtt = seconds if record.rtt is None else 0.875 * record.rtt + 0.125 * seconds
+            self._push(record)
+
+    def discard(self, addr: str):
+        record = self.records.pop(addr, None)
+        if record is None:
+            return
+        last = self._order.pop()
+        if last != addr:
+            self._order[record.index] = last
+            self.records[last].index = record.index
+        self._sizes[record.bucket] -= 1
+        if not self._sizes[record.bucket]:
+            del self._sizes[record.bucket]
+            del self._buckets[record.bucket]
+
+    def choice(self, accept: Callable[[str], bool] = None, tries: int = 8) -> Optional[str]:
+        """
+        Random peer accepted by `accept`. A few random picks are tried before the full scan.
+        """
+        if not self._order:
+            return None
+        for _ in range(tries):
+            addr = random.choice(self._order)
+            if accept is None or accept(addr):
+                return addr
+        addrs = [addr for addr in self._order if accept(addr)]
+        return random.choice(addrs) if addrs else None
+
+    def best(self, n: int) -> List[str]:
+        """
+        `n` best-scored peers, best first
+        """
+        return [record.addr for record in heapq.nlargest(n, self.records.values(), key=lambda r: r.key)]
+
+    def sample(self, n: int) -> List[str]:
+        return random.sample(self._order, min(n, len(self._order)))
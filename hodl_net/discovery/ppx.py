@@ -1 +1,240 @@
-# TODO
+"""
+Public Peer Exchange for Hodleum Networking Stack
+
+Every node keeps an in-memory index of known peer addresses, each stamped
+with a version of the moment it was added. A node asks its peer for
+additions since the cursor `(epoch, version)` it got last time, and gets
+them in bounded pages of compact binary addresses. Epoch changes on
+restart, so stale cursors fall back to the full sync.
+"""
+
+from typing import Dict, Iterable, List, Set, Tuple
+import bisect
+import socket
+import struct
+import base64
+import random
+import logging
+import uuid
+
+from ..models import TempDict, Peer, Message
+from ..database import db_worker
+
+log = logging.getLogger(__name__)
+
+_families = {4: (socket.AF_INET, 4), 6: (socket.AF_INET6, 16)}
+
+
+def encode_addrs(addrs: Iterable[str]) -> bytes:
+    """
+    Pack "ip:port" addresses, 7 bytes per IPv4 address and 19 bytes per IPv6 one.
+    Host names are skipped.
+    """
+    data = bytearray()
+    for addr in addrs:
+        host, _, port = addr.rpartition(':')
+        for tag, (family, _) in _families.items():
+            try:
+                data += bytes([tag]) + socket.inet_pton(family, host.strip('[]')) + struct.pack('!H', int(port))
+                break
+            except (OSError, ValueError, struct.error):
+                continue
+    return bytes(data)
+
+
+def decode_addrs(data: bytes) -> List[str]:
+    addrs = []
+    i = 0
+    while i < len(data):
+        family, size = _families.get(data[i], (None, None))
+        if not family or i + 3 + size > len(data):
+            break
+        host = socket.inet_ntop(family, data[i + 1:i + 1 + size])
+        port, = struct.unpack('!H', data[i + 1 + size:i + 3 + size])
+        addrs.append(f'{host}:{port}')
+        i += 3 + size
+    return addrs
+
+
+def pack_addrs(addrs: Iterable[str]) -> str:
+    """
+    Addresses packed by `encode_addrs` as base64 string
+    """
+    return base64.b64encode(encode_addrs(addrs)).decode()
+
+
+def unpack_addrs(data: str) -> List[str]:
+    return decode_addrs(base64.b64decode(data))
+
+
+class PeerIndex:
+    """
+    Set of known peer addresses with version changelog
+    """
+
+    def __init__(self):
+        self.epoch = uuid.uuid4().hex[:16]
+        self.version = 0
+        self.versions: Dict[str, int] = {}
+        self._log_versions: List[int] = []
+        self._log_addrs: List[str] = []
+
+    def __len__(self):
+        return len(self.versions)
+
+    def __contains__(self, addr: str):
+        return addr in self.versions
+
+    def __iter__(self):
+        return iter(self.versions)
+
+    def add(self, addr: str) -> bool:
+        if addr in self.versions:
+            return False
+        self.version += 1
+        self.versions[addr] = self.version
+        self._log_versions.append(self.version)
+        self._log_addrs.append(addr)
+        return True
+
+    def update(self, addrs: Iterable[str]) -> Set[str]:
+        """
+        Add addresses
+
+        :return: Addresses which were not in index
+        """
+        new = set(addrs) - self.versions.keys()
+        for addr in new:
+            self.add(addr)
+        return new
+
+    def discard(self, addr: str):
+        if self.versions.pop(addr, None) is None:
+            return
+        if len(self._log_versions) > 2 * len(self.versions) + 64:
+            self._log_versions = list(self.versions.values())
+            self._log_addrs = list(self.versions.keys())
+
+    def since(self, version: int, limit: int) -> Tuple[List[str], int, bool]:
+        """
+        Addresses added after `version`
+
+        :return: (page of addresses, cursor for the next page, are there more pages)
+        """
+        addrs = []
+        i = bisect.bisect_right(self._log_versions, version)
+        cursor = version
+        while i < len(self._log_versions) and len(addrs) < limit:
+            addr, cursor = self._log_addrs[i], self._log_versions[i]
+            if self.versions.get(addr) == cursor:
+                addrs.append(addr)
+            i += 1
+        return addrs, cursor, i < len(self._log_versions)
+
+
+class PeerExchange:
+    """
+    :param proto: `PeerProtocol` instance
+    :param wheel: `TimerWheel` for periodic sync
+    :param int page_size: Max addresses in one `pex_delta` message
+    :param float interval: Interval of sync with random peer
+    :param int max_pages: Max pages requested in one sync
+    """
+
+    def __init__(self, proto, wheel, page_size: int = 100, interval: float = 30, max_pages: int = 10):
+        self.proto = proto
+        self.wheel = wheel
+        self.page_size = page_size
+        self.interval = interval
+        self.max_pages = max_pages
+        self.index = PeerIndex()
+        self.cursors = TempDict(factory=None)
+        self.cursors.expire = 24 * 60 * 60
+
+    def start(self):
+        self.index.update(_peer.addr for _peer in self.proto.peers)
+        self.wheel.call_later(self.interval, self._gossip)
+        log.info(f'PEX started with {len(self.index)} peers')
+
+    def _gossip(self):
+        if len(self.index):
+            self.sync(random.choice(list(self.index)))
+        self.wheel.call_later(self.interval, self._gossip)
+
+    def sync(self, addr: str, pages: int = None):
+        """
+        Request peers added since the last sync with `addr`
+
+        :param pages: Pages left in this sync, `max_pages` by default
+        :return: Deferred, which fires with new addresses of the first page
+        """
+        if pages is None:
+            pages = self.max_pages
+        epoch, version = self.cursors.get(addr, (None, 0))
+        d = Peer(self.proto, addr=addr).request(Message('pex', {
+            'epoch': epoch,
+            'since': version,
+            'limit': self.page_size
+        }), watch=True)
+        d.addCallback(self._on_delta, addr, (epoch, version), pages)
+        return d
+
+    def _on_delta(self, message: Message, addr: str, cursor: tuple, pages: int) -> Set[str]:
+        data = message.data
+        try:
+            epoch, version, added = data['epoch'], int(data['version']), data.get('added', '')
+            addrs = unpack_addrs(added)
+        except (KeyError, TypeError, ValueError) as e:
+            log.debug(f'Malformed PEX delta from {addr}: {e!r}')
+            return set()
+        if self.proto.server.peer_map is not None:
+            self.proto.server.peer_map.report(addr, addrs)
+        new = self.apply(addrs, addr)
+        self.cursors[addr] = (epoch, version)
+        # Next page only if cursor moved, so a peer can't keep us syncing forever
+        if data.get('more') and pages > 1 and (epoch != cursor[0] or version > cursor[1]):
+            self.sync(addr, pages - 1)
+        return new
+
+    def delta(self, data: dict) -> dict:
+        """
+        Answer `pex` request
+        """
+        try:
+            since = max(int(data.get('since') or 0), 0) if data.get('epoch') == self.index.epoch else 0
+        except (TypeError, ValueError):
+            since = 0
+        try:
+            limit = min(max(int(data.get('limit') or self.page_size), 1), self.page_size)
+        except (TypeError, ValueError):
+            limit = self.page_size
+        addrs, version, more = self.index.since(since, limit)
+        return {
+            'epoch': self.index.epoch,
+            'version': version,
+            'added': pack_addrs(addrs),
+            'more': more
+        }
+
+    def apply(self, addrs: Iterable[str], source: str = None) -> Set[str]:
+        """
+        Record new peers, admitted by the peer table, with one set difference and one DB statement
+
+        :param str source: Address of peer, which sent `addrs`
+        :return: New addresses
+        """
+        new = self.index.update(self.proto.admit_peers(set(addrs) - self.index.versions.keys(), source))
+        if not new:
+            return new
+        db_worker.storage.add_peers(new)
+        if self.proto.server.deadpeer is not None:
+            for addr in new:
+                self.proto.server.deadpeer.track(addr)
+        log.debug(f'{len(new)} new peers received by PEX')
+        return new
+
+    def added(self, addr: str):
+        self.index.add(addr)
+
+    def removed(self, addr: str):
+        self.index.discard(addr)
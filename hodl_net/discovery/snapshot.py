@@ -0,0 +1,165 @@
+"""
+Warm-start Peer Snapshot for Hodleum Networking Stack
+
+Node periodically writes the best-scored peers and known user keys into a
+small binary file, so after restart it can contact good peers at once
+instead of waiting for them to show up.
+
+Format, all numbers in network order::
+
+    header   '!3sBdHH'   magic, version, unix time, peer count, user count
+    peers    '!I' + ...  length and addresses packed by `ppx.encode_addrs`, best first
+    users    ('!H' + name, '!H' + key) * user count, UTF-8
+    trailer  '!I'        CRC32 of everything above
+
+The file is replaced atomically, and a torn or foreign file is ignored.
+"""
+
+from typing import List, NamedTuple, Optional, Tuple
+import logging
+import struct
+import time
+import zlib
+import os
+
+from .ppx import encode_addrs, decode_addrs
+from ..database import db_worker
+
+log = logging.getLogger(__name__)
+
+magic = b'HPS'
+version = 1
+_header = struct.Struct('!3sBdHH')
+_length = struct.Struct('!I')
+_short = struct.Struct('!H')
+
+
+class Snapshot(NamedTuple):
+    time: float
+    peers: List[str]
+    users: List[Tuple[str, str]]
+
+
+def dump(peers: List[str], users: List[Tuple[str, str]], now: float = None) -> bytes:
+    """
+    :param list peers: Addresses, best first
+    :param list users: (name, public key) pairs
+    """
+    addrs = encode_addrs(peers[:0xffff])
+    users = users[:0xffff]
+    parts = [_header.pack(magic, version, time.time() if now is None else now, len(decode_addrs(addrs)),
+                          len(users)),
+             _length.pack(len(addrs)), addrs]
+    for name, key in users:
+        for field in (name.encode(), key.encode()):
+            parts += [_short.pack(len(field)), field]
+    data = b''.join(parts)
+    return data + _length.pack(zlib.crc32(data))
+
+
+def load(data: bytes) -> Optional[Snapshot]:
+    """
+    :return: Snapshot, None if data is broken or has another version
+    """
+    if len(data) < _header.size + 2 * _length.size or \
+            _length.unpack_from(data, len(data) - _length.size)[0] != zlib.crc32(data[:-_length.size]):
+        return None
+    _magic, _version, created, peer_count, user_count = _header.unpack_from(data)
+    if _magic != magic or _version != version:
+        return None
+    offset = _header.size
+    size, = _length.unpack_from(data, offset)
+    offset += _length.size
+    peers = decode_addrs(data[offset:offset + size])[:peer_count]
+    offset += size
+    users = []
+    try:
+        for _ in range(user_count):
+            fields = []
+            for _ in range(2):
+                size, = _short.unpack_from(data, offset)
+                offset += _short.size
+                fields.append(data[offset:offset + size].decode())
+                offset += size
+            users.append(tuple(fields))
+    except (struct.error, UnicodeDecodeError):
+        return None
+    return Snapshot(created, peers, users)
+
+
+def write(path: str, data: bytes):
+    """
+    Replace file atomically: write and sync temporary file, then rename it
+    """
+    tmp = f'{path}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def read(path: str) -> Optional[Snapshot]:
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    snapshot = load(data)
+    if snapshot is None:
+        log.warning(f'Peer snapshot {path} is broken, ignored')
+    return snapshot
+
+
+class Snapshotter:
+    """
+    Periodic snapshot of peer table and users
+
+    :param proto: `PeerProtocol` instance
+    :param wheel: `TimerWheel` instance
+    :param str path: Snapshot file
+    :param float interval: Interval of writes
+    :param int peers: Max best-scored peers in snapshot
+    :param int users: Max user keys in snapshot
+    """
+
+    def __init__(self, proto, wheel, path: str, interval: float = 300, peers: int = 256, users: int = 1024):
+        self.proto = proto
+        self.wheel = wheel
+        self.path = path
+        self.interval = interval
+        self.peers = peers
+        self.users = users
+        self.timer = None
+
+    def start(self):
+        self.timer = self.wheel.call_later(self.interval, self._tick)
+
+    def stop(self):
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+
+    def _tick(self):
+        self.save()
+        self.timer = self.wheel.call_later(self.interval, self._tick)
+
+    def save(self) -> Optional[str]:
+        """
+        Write snapshot now
+
+        :return: Snapshot path, None if writing failed
+        """
+        table = self.proto.server.peer_table
+        if table is not None:
+            peers = table.best(self.peers)
+        else:
+            peers = [_peer.addr for _peer in self.proto.peers][:self.peers]
+        users = db_worker.storage.users(self.users)
+        try:
+            write(self.path, dump(peers, users))
+        except OSError as ex:
+            log.error(f'Peer snapshot failed: {ex}')
+            return None
+        log.debug(f'Peer snapshot of {len(peers)} peers and {len(users)} users written to {self.path}')
+        return self.path
@@ -0,0 +1,204 @@
+"""
+Erasure-coded multipath delivery
+
+Large encrypted message is split into `k` data shards and `m` parity shards
+of systematic Reed-Solomon code over GF(256) (Cauchy matrix), so any `k`
+shards rebuild it. Shards travel as separate `MessageWrapper`s along
+different tunnels; a lost or slow hop costs one shard instead of the message.
+
+Codec is pure Python: multiplication of a shard by a constant is one
+`bytes.translate` with a 256-byte table, addition is XOR of big integers.
+"""
+
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import base64
+import time
+
+from .models import MessageWrapper
+
+# GF(256) with polynomial x^8 + x^4 + x^3 + x^2 + 1
+
+_exp = [0] * 512
+_log = [0] * 256
+_x = 1
+for _i in range(255):
+    _exp[_i] = _x
+    _log[_x] = _i
+    _x <<= 1
+    if _x & 0x100:
+        _x ^= 0x11d
+for _i in range(255, 512):
+    _exp[_i] = _exp[_i - 255]
+
+
+def gf_mul(a: int, b: int) -> int:
+    if not a or not b:
+        return 0
+    return _exp[_log[a] + _log[b]]
+
+
+def gf_inv(a: int) -> int:
+    return _exp[255 - _log[a]]
+
+
+# Multiplication tables for `bytes.translate`, built on first use
+_tables: Dict[int, bytes] = {}
+
+
+def _table(c: int) -> bytes:
+    table = _tables.get(c)
+    if table is None:
+        table = _tables[c] = bytes(gf_mul(c, x) for x in range(256))
+    return table
+
+
+def _combine(coefs: List[int], shards: List[bytes], size: int) -> bytes:
+    """
+    Sum of `coefs[i] * shards[i]`
+    """
+    acc = 0
+    for c, shard in zip(coefs, shards):
+        if c == 1:
+            acc ^= int.from_bytes(shard, 'little')
+        elif c:
+            acc ^= int.from_bytes(shard.translate(_table(c)), 'little')
+    return acc.to_bytes(size, 'little')
+
+
+def _row(index: int, k: int) -> List[int]:
+    """
+    Generator matrix row of shard `index`: identity for data shards,
+    Cauchy matrix 1 / (x_j + y_i) with x_j = k + j, y_i = i for parity ones
+    """
+    if index < k:
+        return [int(i == index) for i in range(k)]
+    return [gf_inv(index ^ i) for i in range(k)]
+
+
+def _invert(matrix: List[List[int]]) -> List[List[int]]:
+    n = len(matrix)
+    a = [row[:] + [int(i == j) for j in range(n)] for i, row in enumerate(matrix)]
+    for col in range(n):
+        pivot = next(r for r in range(col, n) if a[r][col])
+        a[col], a[pivot] = a[pivot], a[col]
+        inv = gf_inv(a[col][col])
+        a[col] = [gf_mul(inv, x) for x in a[col]]
+        for r in range(n):
+            if r != col and a[r][col]:
+                f = a[r][col]
+                a[r] = [x ^ gf_mul(f, y) for x, y in zip(a[r], a[col])]
+    return [row[n:] for row in a]
+
+
+def encode(data: bytes, k: int, m: int) -> List[bytes]:
+    """
+    Split `data` into `k` data shards and `m` parity shards of equal size
+
+    :return: k + m shards
+    """
+    if not 0 < k or k + m > 256:
+        raise ValueError('k + m must be within 1..256')
+    size = -(-len(data) // k) or 1
+    data = data.ljust(size * k, b'\0')
+    shards = [data[i * size:(i + 1) * size] for i in range(k)]
+    return shards + [_combine(_row(k + j, k), shards[:k], size) for j in range(m)]
+
+
+def decode(shards: Dict[int, bytes], k: int, length: int) -> bytes:
+    """
+    Rebuild data from any `k` shards
+
+    :param dict shards: Shard index: shard
+    :param int length: Length of original data
+    """
+    if len(shards) < k:
+        raise ValueError(f'{k} shards required, {len(shards)} given')
+    if all(i in shards for i in range(k)):
+        return b''.join(shards[i] for i in range(k))[:length]
+    indexes = sorted(shards)[:k]
+    size = len(shards[indexes[0]])
+    chosen = [shards[i] for i in indexes]
+    inverse = _invert([_row(i, k) for i in indexes])
+    return b''.join(_combine(row, chosen, size) for row in inverse)[:length]
+
+
+def split(wrapper: MessageWrapper, k: int, m: int) -> List[MessageWrapper]:
+    """
+    Shard wrappers of prepared (encrypted) wrapper. Shards have own ids and
+    `shard = [wrapper id, index, k, m, payload length]`.
+    """
+    data = wrapper.message.encode()
+    return [MessageWrapper(base64.b64encode(shard).decode(),
+                           wrapper.type,
+                           wrapper.sender,
+                           wrapper.encoding,
+                           sign=wrapper.sign,
+                           trace=wrapper.trace,
+                           deadline=wrapper.deadline,
+                           shard=[wrapper.id, i, k, m, len(data)])
+            for i, shard in enumerate(encode(data, k, m))]
+
+
+class Reassembly:
+    """
+    Bounded buffer of incomplete shard groups. The oldest groups are dropped
+    when the buffer is over `max_groups` or `max_bytes`, or after `timeout`.
+
+    :param int max_groups: Max incomplete messages
+    :param int max_bytes: Max buffered shard bytes
+    :param float timeout: Max time to wait for the rest of shards
+    """
+
+    def __init__(self, max_groups: int = 256, max_bytes: int = 16 * 1024 * 1024, timeout: float = 30):
+        self.max_groups = max_groups
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.groups: Dict[str, tuple] = OrderedDict()  # Group id: (start time, {index: shard})
+        self.size = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self.groups)
+
+    def _pop(self, group: str):
+        _, shards = self.groups.pop(group)
+        self.size -= sum(len(shard) for shard in shards.values())
+
+    def _drop(self):
+        self._pop(next(iter(self.groups)))
+        self.dropped += 1
+
+    def add(self, wrapper: MessageWrapper) -> Optional[MessageWrapper]:
+        """
+        Buffer shard
+
+        :return: Rebuilt wrapper when `k` shards of its group are buffered, None otherwise
+        """
+        group, index, k, m, length = wrapper.shard
+        shard = base64.b64decode(wrapper.message)
+        now = time.time()
+        groups = self.groups
+        while groups and now - next(iter(groups.values()))[0] >= self.timeout:
+            self._drop()
+
+        if group not in groups:
+            groups[group] = (now, {})
+        shards = groups[group][1]
+        if index in shards or shards and len(shard) != len(next(iter(shards.values()))):
+            return
+        shards[index] = shard
+        self.size += len(shard)
+        if len(shards) < k:
+            while len(groups) > self.max_groups or self.size > self.max_bytes:
+                self._drop()
+            return
+        self._pop(group)
+        return MessageWrapper(decode(shards, k, length).decode(),
+                              wrapper.type,
+                              wrapper.sender,
+                              wrapper.encoding,
+                              group,
+                              wrapper.sign,
+                              trace=wrapper.trace,
+                              deadline=wrapper.deadline)
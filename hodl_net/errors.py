@@ -20,6 +20,16 @@ class UnhandledRequest(BaseError):
     code = '002'
 
 
+class UnknownUser(BaseError):
+    message = 'Unknown user'
+    code = '003'
+
+
+class QuorumNotReached(BaseError):
+    message = 'Quorum not reached'
+    code = '004'
+
+
 class CryptogrError(BaseError):
     message = 'Error in cryptography'
     code = '100'
@@ -0,0 +1,149 @@
+"""
+Flight recorder: structured debug events in a fixed-size ring buffer.
+
+Hot paths call `record(name, level, msg, *args)`, which only appends a tuple;
+messages are formatted when the buffer is dumped to a file - on error, on
+SIGUSR1 or on request. Ordinary `logging` records are captured into the
+same buffer by `FlightHandler`, so a dump shows the whole story.
+"""
+
+from collections import deque
+from typing import Dict
+import logging
+import signal
+import time
+
+log = logging.getLogger(__name__)
+
+
+class FlightRecorder:
+    """
+    :param int size: Max events kept in memory
+    :param int level: Default minimal level of recorded events
+    :param dict levels: Minimal level by subsystem (logger name)
+    :param dict sample: Keep every n-th event below WARNING by subsystem
+    :param str path: Dump file
+    """
+
+    def __init__(self,
+                 size: int = 10000,
+                 level: int = logging.DEBUG,
+                 levels: Dict[str, int] = None,
+                 sample: Dict[str, int] = None,
+                 path: str = 'flight.log'):
+        self.events = deque(maxlen=size)
+        self.level = level
+        self.levels = levels or {}
+        self.sample = sample or {}
+        self.path = path
+        self._skipped = {}
+        self.last_dump = 0
+
+    def __len__(self):
+        return len(self.events)
+
+    def enabled(self, name: str, level: int) -> bool:
+        return level >= self.levels.get(name, self.level)
+
+    def record(self, name: str, level: int, msg: str, *args):
+        """
+        Record event. `msg % args` is computed only on dump.
+        """
+        if level < self.levels.get(name, self.level):
+            return
+        every = self.sample.get(name)
+        if every and level < logging.WARNING:
+            skipped = self._skipped.get(name, 0) + 1
+            if skipped < every:
+                self._skipped[name] = skipped
+                return
+            self._skipped[name] = 0
+        self.events.append((time.time(), name, level, msg, args))
+
+    def format(self) -> str:
+        lines = []
+        for created, name, level, msg, args in list(self.events):
+            try:
+                text = msg % args if args else msg
+            except (TypeError, ValueError):
+                text = f'{msg} {args}'
+            stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(created))
+            lines.append(f'{stamp}.{int(created % 1 * 1000):03d} {logging.getLevelName(level):<8} {name}: {text}')
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path: str = None, reason: str = 'request') -> str:
+        """
+        Write buffered events to file
+
+        :return: Dump path
+        """
+        path = path or self.path
+        self.last_dump = time.time()
+        with open(path, 'w') as f:
+            f.write(f'# flight recorder dump ({reason}), {len(self.events)} events\n')
+            f.write(self.format())
+        log.info(f'Flight recorder dumped to {path}')
+        return path
+
+    def dump_on_signal(self, signum=getattr(signal, 'SIGUSR1', None)):
+        if signum is None:
+            return
+        signal.signal(signum, lambda *_: self.dump(reason='signal'))
+
+
+class FlightHandler(logging.Handler):
+    """
+    Logging handler which stores records in `FlightRecorder`
+    and dumps it when error is logged.
+
+    :param float dump_interval: Min time between dumps caused by errors. Dump on error is off if None.
+    """
+
+    def __init__(self, recorder: FlightRecorder, dump_interval: float = 60):
+        super().__init__(logging.DEBUG)
+        self.recorder = recorder
+        self.dump_interval = dump_interval
+
+    def emit(self, record: logging.LogRecord):
+        text = record.getMessage()
+        if record.exc_info:
+            text += '\n' + logging.Formatter().formatException(record.exc_info)
+        self.recorder.events.append((record.created, record.name, record.levelno, text, ()))
+        if self.dump_interval is not None and record.levelno >= logging.ERROR and \
+                time.time() - self.recorder.last_dump >= self.dump_interval:
+            self.recorder.dump(reason=f'error in {record.name}')
+
+
+recorder = FlightRecorder()
+
+
+def record(name: str, level: int, msg: str, *args):
+    recorder.record(name, level, msg, *args)
+
+
+def configure(conf: dict, name: str = None, port: int = None):
+    """
+    Set up logging and flight recorder from `logging` section of config
+    """
+    levels = {key: logging.getLevelName(value) for key, value in conf.get('levels', {}).items()}
+    logging.basicConfig(level=logging.getLevelName(conf.get('level', 'INFO')),
+                        format=f'%(name)s.%(funcName)-20s [LINE:%(lineno)-3s]# [{port}]'
+                        f' %(levelname)-8s [%(asctime)s]  %(message)s')
+    for logger, level in levels.items():
+        logging.getLogger(logger).setLevel(level)
+
+    recorder.events = deque(recorder.events, maxlen=conf.get('flight_size', recorder.events.maxlen))
+    recorder.level = logging.getLevelName(conf.get('flight_level', 'DEBUG'))
+    recorder.levels = levels
+    recorder.sample = conf.get('flight_sample', {})
+    recorder.path = conf.get('flight_path') or f'{name}_flight.log'
+
+    root = logging.getLogger()
+    if not any(isinstance(handler, FlightHandler) for handler in root.handlers):
+        root.addHandler(FlightHandler(recorder, conf.get('dump_interval', 60) if conf.get('dump_on_error', True)
+                                      else None))
+    if conf.get('dump_on_signal', True):
+        try:
+            recorder.dump_on_signal()
+        except ValueError:  # Not in main thread
+            log.warning('Flight recorder dump on signal is unavailable')
@@ -1,7 +1,11 @@
-from sqlalchemy.orm.session import Session
 from werkzeug.local import Local
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from sqlalchemy.orm.session import Session
 
 local = Local()
-session: Session = local('session')
+session: 'Session' = local('session')
 peer = local('peer')
 user = local('user')
+node = local('node')  # Server, which handles current message
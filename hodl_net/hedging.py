@@ -0,0 +1,76 @@
+"""
+Hedged sends
+
+If response to a message does not come within the usual latency of its
+addressee, the same prepared wrapper goes out once more along another
+tunnel. Both copies have the same id, so the addressee and flooding nodes
+drop the later one, and the first response wins. Extra load is capped by a
+token bucket: every send earns `budget` of a duplicate.
+"""
+
+from collections import deque
+
+from .models import TempDict
+
+
+class Hedging:
+    """
+    :param float quantile: Latency quantile of addressee after which duplicate is sent
+    :param float default_delay: Delay for addressees with fewer than `min_samples` samples
+    :param int min_samples: Samples required to use measured latency
+    :param int samples: Latency samples kept per addressee
+    :param float budget: Max share of duplicates among sends
+    :param float burst: Max duplicates sent in a row
+    """
+
+    def __init__(self,
+                 quantile: float = 0.95,
+                 default_delay: float = 1.,
+                 min_samples: int = 8,
+                 samples: int = 32,
+                 budget: float = 0.05,
+                 burst: float = 10):
+        self.quantile = quantile
+        self.default_delay = default_delay
+        self.min_samples = min_samples
+        self.samples = samples
+        self.budget = budget
+        self.burst = burst
+        self.tokens = burst
+        self.latency = TempDict(factory=None)
+        self.latency.expire = 600
+
+    def record(self, name: str, seconds: float):
+        """
+        Record latency of response from `name`
+        """
+        samples = self.latency.get(name)
+        if samples is None:
+            samples = deque(maxlen=self.samples)
+        samples.append(seconds)
+        self.latency[name] = samples
+
+    def delay(self, name: str) -> float:
+        """
+        Time to wait for response from `name` before duplicate is sent
+        """
+        samples = self.latency.get(name)
+        if not samples or len(samples) < self.min_samples:
+            return self.default_delay
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(self.quantile * len(ordered)))]
+
+    def sent(self):
+        """
+        Account a send, which earns `budget` of a duplicate
+        """
+        self.tokens = min(self.burst, self.tokens + self.budget)
+
+    def take(self) -> bool:
+        """
+        :return: True if duplicate is allowed by budget
+        """
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
@@ -0,0 +1,116 @@
+"""
+Node host: many logical nodes in one process.
+
+Every hosted node is a `Server` with its own port, keys, dedup and callback
+tables. Nodes share the reactor, the reactor thread pool, which runs handlers
+and crypto, the DB and the timer wheel. Handlers table is shared too: handlers
+registered on the default `server` serve every node, and `hodl_net.node` is
+the node handling the current message.
+
+Nodes share the DB, so peers and users known to one of them are known to all.
+
+    python -m hodl_net.host --nodes 100 --port 8000 --path fleet
+"""
+
+from typing import Dict
+import functools
+import argparse
+import logging
+import copy
+import os
+
+from .config_loader import default_conf
+from .server import Server, get_server
+from .database import connect
+from .utils.timer_wheel import TimerWheel
+from . import metrics, flight
+
+log = logging.getLogger(__name__)
+
+
+class NodeHost:
+    """
+    :param str path: Directory for keys and shared DB
+    :param dict conf: Configuration of nodes. Subsystems listed in `host.disable` are off.
+    :param handlers: Handlers table of nodes. Table of the default server by default.
+    """
+
+    def __init__(self, path: str = '.', conf: dict = None, handlers: dict = None):
+        from twisted.internet import reactor
+
+        self.path = path
+        self.conf = copy.deepcopy(conf or default_conf())
+        for section in self.conf['host']['disable']:
+            self.conf[section]['enabled'] = False
+        self.reactor = reactor
+        self.wheel = TimerWheel(reactor, self.conf['deadpeer']['tick'])
+        self.handlers = handlers if handlers is not None else get_server()._handlers
+        self.nodes: Dict[str, Server] = {}
+        self.prepared = False
+
+    def prepare(self):
+        """
+        Set up parts shared by nodes: DB, logging, timer wheel
+        """
+        os.makedirs(self.path, exist_ok=True)
+        connect(os.path.join(self.path, 'host'), self.conf)
+        flight.configure(self.conf['logging'], os.path.join(self.path, 'host'))
+        self.reactor.callWhenRunning(self.wheel.start)
+        self.prepared = True
+
+    def _gauge(self, name: str) -> float:
+        """
+        Value of gauge over all nodes
+        """
+        values = [gauges[name][1]() for gauges in (server.gauges() for server in self.nodes.values())
+                  if name in gauges]
+        if name in Server.averaged_gauges:
+            return sum(values) / len(values) if values else 0.
+        return sum(values)
+
+    def add(self, port: int, name: str = None) -> Server:
+        """
+        Start new node. Works before and after the reactor is started.
+
+        :param int port: UDP port of node
+        :param str name: Node name, port by default
+        """
+        if not self.prepared:
+            self.prepare()
+        name = name or str(port)
+        if name in self.nodes:
+            raise ValueError(f'Node {name} already exists')
+
+        server = Server(port, conf=self.conf, wheel=self.wheel, handlers=self.handlers)
+        server.udp.name = name
+        server.udp.prepare_keys(os.path.join(self.path, f'{name}_keys'))
+        server.listen()
+        server.prepared = True
+        self.nodes[name] = server
+        # Every server registers gauges of its own, they are replaced with totals of all nodes
+        for gauge, (help, _) in server.gauges().items():
+            metrics.registry.gauge(gauge, help, fn=functools.partial(self._gauge, gauge))
+        return server
+
+    def run(self):
+        self.reactor.run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run many hodl_net nodes in one process')
+    parser.add_argument('--nodes', type=int, default=10)
+    parser.add_argument('--port', type=int, default=8000, help='Port of the first node')
+    parser.add_argument('--path', default='.', help='Directory for keys and DB')
+    args = parser.parse_args()
+
+    from . import net_protocol  # noqa: F401 Registers handlers
+
+    host = NodeHost(args.path)
+    for i in range(args.nodes):
+        host.add(args.port + i)
+    log.info(f'{args.nodes} nodes started')
+    host.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -3,11 +3,12 @@ Models, required for net full-functioning
 """
 
 from sqlalchemy import Column, String
-from typing import TypeVar, List, Any, Dict
+from typing import TypeVar, List, Any, Dict, Optional, Tuple
 
 from .cryptogr import get_random, verify, sign, encrypt, decrypt
 from .errors import BadRequest, VerificationFailed, CryptogrError
 from .database import Base
+from . import flight
 
 import logging
 import uuid
@@ -50,9 +51,16 @@ class TempDict(dict, TempStructure):
             return value
         return super().__getitem__(key)['value']
 
+    def get(self, key: T, default: Any = None):
+        self.check()
+        if key not in self:
+            return default
+        return super().__getitem__(key)['value']
+
     def check(self):
         if time.time() - self.last_check < self.update_time:
             return
+        self.last_check = time.time()
         for key, value in self.copy().items():
             if time.time() - value['time'] >= self.expire:
                 del self[key]
@@ -129,6 +137,8 @@ class MessageWrapper:
           Encrypted, requires addressee's public_key key
         * 'request' - if you want to send message directly to peer via ip address.
           Not encrypted, not anonymous, not recommended to use.
+        * 'tunnel' - keepalive of tunnel. Follows the tunnel and is dropped at its exit.
+          Not signed and has no sender.
 
     :param sender: Nickname of sender.
     :type sender: str or None
@@ -145,6 +155,19 @@ class MessageWrapper:
         message already left a tunnel.
     :type tunnel_id: str or None
 
+    :param trace: Trace id of sampled message, see `hodl_net.tracing`. Usually None.
+    :type trace: str or None
+
+    :param ttl: Number of hops tunneled message may still be forwarded, see `hodl_net.tunnels`.
+    :type ttl: int or None
+
+    :param deadline: Unix time after which relays drop message.
+    :type deadline: float or None
+
+    :param shard: Erasure-coded part of message: [message id, shard index, k, m, message length],
+        see `hodl_net.erasure`.
+    :type shard: list or None
+
 
     .. UFO Alert!:: If message type is 'request', leave the field 'sender' empty.
         Otherwise you could be deanonymized.
@@ -157,8 +180,14 @@ class MessageWrapper:
     id = attr.ib(type=str)
     sign = attr.ib(type=str, default=None)
     tunnel_id = attr.ib(type=str, default=None)
-
-    acceptable_types = ['message', 'request', 'shout']
+    trace = attr.ib(type=str, default=None)
+    ttl = attr.ib(type=int, default=None)
+    deadline = attr.ib(type=float, default=None)
+    shard = attr.ib(type=list, default=None)
+
+    acceptable_types = ['message', 'request', 'shout', 'tunnel']
+    signed_types = ['message', 'shout']
+    max_shards = 64
     acceptable_encodings = ['json']
 
     @id.default
@@ -182,8 +211,8 @@ class MessageWrapper:
         if not message_type or message_type not in cls.acceptable_types:
             raise BadRequest('Wrong message type')
         sender = wrapper.get('sender')
-        if message_type != 'request' and (not sender or
-                                          not isinstance(sender, str)):
+        if message_type in cls.signed_types and (not sender or
+                                                 not isinstance(sender, str)):
             raise BadRequest('Sender name required')
 
         message = wrapper.get('message')
@@ -198,12 +227,24 @@ class MessageWrapper:
         if not uid or not isinstance(uid, str):
             raise BadRequest('Id required')
         signature = wrapper.get('sign')
-        if message_type != 'request' and (not signature or
-                                          not isinstance(signature, str)):
+        if message_type in cls.signed_types and (not signature or
+                                                 not isinstance(signature, str)):
             raise BadRequest('Sign required')
         tunnel_id = wrapper.get('tunnel_id')
         if tunnel_id and not isinstance(tunnel_id, str):
             raise BadRequest('Wrong metadata')
+        trace = wrapper.get('trace')
+        if trace and not isinstance(trace, str):
+            raise BadRequest('Wrong metadata')
+        ttl = wrapper.get('ttl')
+        if ttl is not None and (not isinstance(ttl, int) or isinstance(ttl, bool)):
+            raise BadRequest('Wrong metadata')
+        deadline = wrapper.get('deadline')
+        if deadline is not None and (not isinstance(deadline, (int, float)) or isinstance(deadline, bool)):
+            raise BadRequest('Wrong metadata')
+        shard = wrapper.get('shard')
+        if shard is not None and not cls._valid_shard(shard, message_type, message):
+            raise BadRequest('Wrong metadata')
 
         wrapper = cls(
             message,
@@ -212,10 +253,25 @@ class MessageWrapper:
             encoding,
             uid,
             signature,
-            tunnel_id
+            tunnel_id,
+            trace,
+            ttl,
+            deadline,
+            shard
         )
         return wrapper
 
+    @classmethod
+    def _valid_shard(cls, shard, message_type: str, message) -> bool:
+        if message_type != 'message' or not isinstance(message, str) or \
+                not isinstance(shard, list) or len(shard) != 5 or not isinstance(shard[0], str):
+            return False
+        if not all(isinstance(x, int) and not isinstance(x, bool) for x in shard[1:]):
+            return False
+        _, index, k, m, length = shard
+        return 0 < k and 0 <= m and k + m <= cls.max_shards and 0 <= index < k + m and \
+            0 <= length <= k * len(message)
+
     def encrypt(self, public_key: str):
         """
         Encrypt message (`self.message` type must be `Message`)
@@ -234,9 +290,9 @@ class MessageWrapper:
 
         :param str private_key: RSA private key
         """
-        if isinstance(self.message, dict):
+        if not isinstance(self.message, str):
             return
-        self.message = json.loads(decrypt(self.message, private_key))
+        self.message = Message(**json.loads(decrypt(self.message, private_key)))
 
     def create_sign(self, private_key: str):
         self.sign = sign(self.message.to_json(), private_key)
@@ -248,7 +304,7 @@ class MessageWrapper:
         :param str public_key: RSA public_key key of sender
         :raises hodl_net.errors.VerificationFailed: if message has bad sign
         """
-        if self.type == 'request':
+        if self.type not in self.signed_types:
             return
         if not verify(self.message.to_json(), self.sign, public_key):
             raise VerificationFailed('Bad signature')
@@ -262,16 +318,18 @@ class MessageWrapper:
         :type public_key: str or None
 
         :param private_key: our RSA private key.
-            None if `MessageWrapper.type` == `'request'` or `'shout'`
+            None if `MessageWrapper.type` == `'request'`. Shouts are signed, but not encrypted.
         :type private_key: str or None
 
         """
         assert self.type != 'request' or not self.sender
-        if self.type == 'request':
+        if self.type not in self.signed_types:
             return
-        if not private_key and self.type != 'shout':
+        if not private_key:
             raise CryptogrError('Private key is None')
         self.sign = sign(self.message.to_json(), private_key)
+        if self.type == 'shout':
+            return
         self.message: Message = self.encrypt(public_key)
 
     def to_json(self):
@@ -314,20 +372,31 @@ class Peer(Base):
             return self.request(wrapper)
         return self.proto._send(wrapper, self.addr)
 
-    def request(self, message: Message):
+    def request(self, message: Message, watch: bool = False):
         """
         Send request to Peer.
 
         .. warning:: Requests are unsafe.
             Don't try to send private information via `Peer.request`
+
+        :param watch: request is answered on the same callback, so missing answer
+            is reported to congestion control as loss
         """
-        log.debug(f'{self}: Send request {message}')
+        flight.record(__name__, logging.DEBUG, '%s: Send request %s (%s)', self.addr, message.name, message.callback)
         wrapper = MessageWrapper(message, 'request')
-        return self.proto._send(wrapper, self.addr)
+        d = self.proto._expect(message.callback)
+        if watch:
+            self.proto._watch(self.addr, message.callback)
+        self.proto._send(wrapper, self.addr)
+        return d
 
     def response(self, to: Message, message: Message):
+        """
+        Answer request `to`. Answer isn't expected, so no callback is registered.
+        """
         message.callback = to.callback
-        return self.request(message)
+        flight.record(__name__, logging.DEBUG, '%s: Send response %s (%s)', self.addr, message.name, message.callback)
+        self.proto._send(MessageWrapper(message, 'request'), self.addr)
 
     def dump(self) -> Dict[str, str]:
         return {
@@ -348,9 +417,12 @@ class User(Base):
         super().__init__(*args, **kwargs)
         self.proto = proto
 
-    def send(self, message: Message):
-        log.debug(f'{self}: Send {message}')
-        return self.proto.send(message, self.name)
+    def send(self, message: Message, hedge: bool = None):
+        """
+        :param bool hedge: Send duplicate along another tunnel if response is late
+        """
+        flight.record(__name__, logging.DEBUG, '%s: Send %s (%s)', self.name, message.name, message.callback)
+        return self.proto.send(message, self.name, hedge)
 
     def set_proto(self, proto):
         self.proto = proto
@@ -368,18 +440,38 @@ class User(Base):
 
 class Tunnels(TempDict):
     """
-    Tunnel class
+    Tunnel routing table: tunnel id -> [backward address, forward address].
+    Backward address is None on the node which built the tunnel,
+    forward address is None on the tunnel's exit.
+    Entries of tunnels without traffic expire.
     """
 
-    expire = 6000
+    expire = 120
 
-    def add(self, tunnel_id: str, backward_peer: Peer, forward_peer: Peer):
-        # TODO: docstring
-        self[tunnel_id] = [backward_peer, forward_peer]
+    def __init__(self, expire: float = None):
+        super().__init__(factory=None)
+        if expire:
+            self.expire = expire
 
-    def send(self, message: MessageWrapper):
-        # TODO: docstring
-        peers = self.get(message.tunnel_id)
-        if not peers:
-            return
-        peers[1]._send(message)
+    def add(self, tunnel_id: str, backward: Optional[str], forward: Optional[str]):
+        """
+        Install tunnel or refresh its entry
+
+        :param str tunnel_id: Tunnel id
+        :param backward: Address of previous hop
+        :param forward: Address of next hop
+        """
+        self[tunnel_id] = [backward, forward]
+
+    def route(self, tunnel_id: str, addr: str) -> Tuple[bool, Optional[str]]:
+        """
+        Next hop of packet, which came from `addr`. Packets from the forward
+        peer go backward, all others go forward. Entry is refreshed.
+
+        :return: (tunnel is known, next hop address or None if packet exits here)
+        """
+        hops = self.get(tunnel_id)
+        if hops is None:
+            return False, None
+        dict.__getitem__(self, tunnel_id)['time'] = time.time()
+        return True, hops[0] if addr == hops[1] else hops[1]
@@ -1,54 +1,101 @@
+from twisted.internet import threads, reactor
 from .models import *
-from .server import peer, protocol, server, session, call_from_thread
+from .server import peer, node, protocol, server, local, call_from_thread
 from .database import db_worker
+from .cache import ResponseCache
+from . import metrics, flight
 
 
-@server.handle('share', 'request')
-@db_worker.with_session
+# The same lists are answered to every new peer, so they are serialized once per 5 seconds while peers
+# or users change: every join adds a peer. Nodes of a host share the handler and DB, but not DHT mode.
+@server.handle('share', 'request', cache=ResponseCache(30, key=lambda _: node.dht is not None, tables=('peers', 'users'),
+                                                       reply=False, refresh=5))
 async def share_peers(_):
-    peers = [_peer.dump() for _peer in session.query(Peer).all()]
-    users = [_user.dump() for _user in session.query(User).all()]
-    peer.request(Message(
+    peers = [Peer(node.udp, addr=addr).dump() for addr in db_worker.storage.peers()]
+    users = [] if node.dht is not None else [User(node.udp, public_key=key, name=name).dump()
+                                 for name, key in db_worker.storage.users()]
+    return Message(
         name='share_info',
         data={
             'users': users,
             'peers': peers
         }
-    ))
+    )
 
 
 @server.handle('new_user', 'shout')
-@db_worker.with_session
 async def record_new_user(message):
     data = message.data
-    new_user = session.query(User).filter_by(name=name).first()
-    if not new_user:
-        new_user = User(protocol, public_key=data['key'], name=data['name'])
-        session.add(new_user)
-        session.commit()
-        protocol.send_all(Message(
-            name='new_user',
-            data=new_user.dump()
-        ))
+    if db_worker.storage.user_key(data['name']) is None:
+        new_user = User(node.udp, public_key=data['key'], name=data['name'])
+        db_worker.storage.add_users([(new_user.name, new_user.public_key)])
+        if node.dht is None:
+            node.udp.send_all(Message(
+                name='new_user',
+                data=new_user.dump()
+            ))
 
 
 @server.handle('share_info', 'request')
-@db_worker.with_session
 async def record_peers(message):
-    for data in message.data['peers']:
-        if not session.query(Peer).filter_by(addr=data['address']).first():
-            new_peer = Peer(protocol, addr=data['address'])
-            session.add(new_peer)  # TODO: test new peers
+    addrs = [data['address'] for data in message.data['peers']]
+    if node.peer_map is not None:
+        call_from_thread(node.peer_map.report, peer.addr, addrs, True)
+    if node.ppx is not None:
+        call_from_thread(node.ppx.apply, addrs, peer.addr)
+    else:
+        db_worker.storage.add_peers(threads.blockingCallFromThread(reactor, node.udp.admit_peers, addrs, peer.addr))
+    db_worker.storage.add_users((data['name'], data['key']) for data in message.data['users'])
 
-    for data in message.data['users']:
-        if not session.query(User).filter_by(name=data['name']):
-            new_user = Peer(protocol, public_key=data['key'], name=data['name'])
-            session.add(new_user)
-    call_from_thread(session.commit)
 
+@server.handle('ping', 'request', in_thread=False)
+async def ping(message):
+    peer.response(message, Message('pong'))
 
-@server.handle('ping', 'request')
-async def ping(_):
+
+@server.handle('ping_req', 'request', in_thread=False)
+async def ping_req(message):
+    requester = local.peer
+    if node.deadpeer is None:
+        return
+    if await node.deadpeer.relay(message.data['address']):
+        requester.response(message, Message('ack', {'address': message.data['address']}))
+
+
+@server.handle(['dht_find_node', 'dht_find_value', 'dht_store'], 'request', in_thread=False)
+async def dht_request(message):
+    if not node.dht or node.dht.table is None:
+        return
+    peer.response(message, node.dht.handle(message, peer.addr))
+
+
+@server.handle('pex', 'request', in_thread=False)
+async def pex(message):
+    if node.ppx is not None:
+        peer.response(message, Message('pex_delta', node.ppx.delta(message.data)))
+
+
+@server.handle('stats', 'request', in_thread=False)
+async def stats(message):
+    if peer.addr.rpartition(':')[0] in ('127.0.0.1', '::1'):
+        peer.response(message, Message('stats_info', metrics.registry.dump()))
+
+
+@server.handle('trace_dump', 'request', in_thread=False)
+async def trace_dump(message):
+    if peer.addr.rpartition(':')[0] in ('127.0.0.1', '::1'):
+        peer.response(message, Message('trace_dumped', {'path': node.dump_trace()}))
+
+
+@server.handle('flight_dump', 'request', in_thread=False)
+async def flight_dump(message):
+    if peer.addr.rpartition(':')[0] in ('127.0.0.1', '::1'):
+        peer.response(message, Message('flight_dumped', {'path': flight.recorder.dump()}))
+
+
+@server.handle(['pong', 'ack', 'pex_delta', 'dht_nodes', 'dht_value', 'dht_stored',
+                'dht_refused'], 'request', in_thread=False)
+async def late_response(_):
     pass
 
 
@@ -0,0 +1,108 @@
+"""
+Collection of many responses to one message
+
+    async for response in protocol.shout(Message('who_has', {...}), first_n=5, deadline=2):
+        print(response.data)
+
+Responses are taken from the callback table of the server as they arrive.
+Once collection is over - `first_n` responses got, deadline passed or
+consumer closed the iterator - the entry becomes a closed tombstone, so late
+responses are dropped without reaching handlers, and it expires with the table.
+"""
+
+from twisted.internet import defer
+from collections import deque
+from typing import List, Optional
+
+from .errors import QuorumNotReached
+from .models import Message
+
+
+class Responses:
+    """
+    Async iterator of responses
+
+    :param proto: `PeerProtocol` which gets responses
+    :param str callback: Callback id of the sent message
+    :param int first_n: Stop after this number of responses
+    :param int quorum: Min number of responses. If collection stops with fewer,
+        iteration ends with `QuorumNotReached`.
+    :param float deadline: Stop after this number of seconds
+    """
+
+    def __init__(self, proto, callback: str, first_n: int = None, quorum: int = None, deadline: float = None):
+        self.proto = proto
+        self.callback = callback
+        self.first_n = first_n
+        self.quorum = quorum
+        self.received = 0
+        self.done = False
+        self._queue = deque()
+        self._waiting: Optional[defer.Deferred] = None
+        self._timer = None
+        if deadline:
+            self._timer = proto.reactor.callLater(deadline, self._finish)
+        proto.server._callbacks[callback] = self
+
+    def put(self, message: Message):
+        if self.done:
+            return
+        self.received += 1
+        if self._waiting:
+            d, self._waiting = self._waiting, None
+            d.callback(message)
+        else:
+            self._queue.append(message)
+        if self.first_n and self.received >= self.first_n:
+            self._finish()
+
+    def _finish(self):
+        """
+        Stop collecting. Already received responses are still iterated.
+        """
+        if self.done:
+            return
+        self.done = True
+        if self._timer and self._timer.active():
+            self._timer.cancel()
+        self._timer = None
+        if self._waiting:
+            d, self._waiting = self._waiting, None
+            d.callback(None)
+
+    def close(self):
+        """
+        Stop collecting and drop received responses, which are not iterated yet
+        """
+        self._queue.clear()
+        self._finish()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Message:
+        if self._queue:
+            return self._queue.popleft()
+        if not self.done:
+            self._waiting = defer.Deferred()
+            message = await self._waiting
+            if message is not None:
+                return message
+        if self.quorum and self.received < self.quorum:
+            raise QuorumNotReached(f'{self.received} of {self.quorum} responses')
+        raise StopAsyncIteration
+
+    async def aclose(self):
+        self.close()
+
+    async def __aenter__(self) -> 'Responses':
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    async def collect(self) -> List[Message]:
+        """
+        All responses
+        """
+        return [message async for message in self]
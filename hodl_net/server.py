@@ -1,19 +1,35 @@
 from twisted.internet.protocol import DatagramProtocol
 from twisted.internet import reactor, defer
+from twisted.python import threadable
 from collections import defaultdict
-from typing import Callable, List
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
 from .models import (
-    TempDict, Peer, User, Message, MessageWrapper, S
+    TempDict, Tunnels, Peer, User, Message, MessageWrapper, S
 )
-from .errors import UnhandledRequest
-from .database import db_worker
+from .errors import UnhandledRequest, UnknownUser
+from .database import db_worker, connect
 from .cryptogr import gen_keys
 from .globals import *
-from .discovery import LPD
-from .utils import NatWorker
-from .config_loader import load_conf
-
-import sqlalchemy.exc
+from .discovery.deadpeer import DeadPeerDetector
+from .discovery.ppx import PeerExchange
+from .discovery.peertable import PeerTable
+from .discovery.peermap import PeerMap
+from .discovery.bootstrap import Bootstrap, SnapshotSource, DBSource, StaticSource, LPDSource, PexSource
+from .discovery.snapshot import Snapshotter
+from .tunnels import TunnelPool, HopPolicy
+from .responses import Responses
+from .hedging import Hedging
+from .congestion import Congestion
+from .cover import Cover
+from .cache import ResponseCache
+from .erasure import Reassembly, split
+from .utils.timer_wheel import TimerWheel
+from .config_loader import default_conf
+from . import metrics
+from .tracing import Tracer, now_ns
+from . import flight
+
+import attr
 
 import logging
 import random
@@ -24,8 +40,7 @@ log = logging.getLogger(__name__)
 
 peer: Peer
 user: User
-
-conf_file = load_conf()  # TODO: Remove hard-coded configuration loading
+node: 'Server'
 
 
 def to_thread(f):
@@ -39,6 +54,13 @@ def call_from_thread(f, *args, **kwargs):
     return reactor.callFromThread(f, *args, **kwargs)
 
 
+def in_reactor_thread() -> bool:
+    """
+    Is current thread the reactor one. Every thread is, until the reactor runs.
+    """
+    return not reactor.running or threadable.isInIOThread()
+
+
 class PeerProtocol(DatagramProtocol):
     """
     Main protocol for all interaction with net stack.
@@ -51,19 +73,26 @@ class PeerProtocol(DatagramProtocol):
         self.server = _server
 
         self.temp = TempDict(factory=None)
-        self.tunnels = TempDict(factory=None)
+        self.forwarded = TempDict(factory=None)
+        self.tunnels = Tunnels(_server.conf['tunnels']['expire'])
         self.public_key, self.private_key = None, None
 
-    def prepare_keys(self):
+    def prepare_keys(self, path: str = None):
+        """
+        Load keys or generate new ones
+
+        :param str path: Keys file, `{name}_keys` by default
+        """
+        path = path or f'{self.name}_keys'
         try:
-            with open(f'{self.name}_keys') as f:
+            with open(path) as f:
                 self.public_key, self.private_key = json.loads(f.read())
         except FileNotFoundError:
-            self._gen_keys()
+            self._gen_keys(path)
 
-    def _gen_keys(self):
+    def _gen_keys(self, path: str):
         self.private_key, self.public_key = gen_keys()
-        with open(f'{self.name}_keys', 'w') as f:
+        with open(path, 'w') as f:
             log.info(f'keys generated {self.name}')
             f.write(json.dumps([self.public_key, self.private_key]))
 
@@ -75,66 +104,150 @@ class PeerProtocol(DatagramProtocol):
         try:
             return self.handle_datagram(datagram, addr)
         except Exception as _:
+            metrics.bad_datagrams.inc()
             log.exception('Exception during handling message.')
 
     def handle_datagram(self, datagram: bytes, addr: tuple):
-        ses = db_worker.get_session()
         addr = ':'.join(map(str, addr))
-        log.debug(f'Datagram received {datagram}')
+        # Ring keeps only the head, full datagrams would take up to size * 64 KB
+        flight.record(__name__, logging.DEBUG, 'Datagram received from %s: %d bytes %r', addr, len(datagram),
+                      datagram[:64])
+        metrics.bytes_in.inc(len(datagram))
+        start = now_ns()
         wrapper = MessageWrapper.from_bytes(datagram)
+        metrics.datagrams_in.labels(wrapper.type).inc()
+        trace = wrapper.trace
+        tracer = self.server.tracer
+        if trace:
+            tracer.record(trace, wrapper.id, 'decode', start)
+        if self.server.deadpeer is not None:
+            self.server.deadpeer.heard_from(addr)
+        if self.server.peer_table is not None:
+            self.server.peer_table.heard(addr)
 
         if wrapper.type != 'request':
+            if wrapper.deadline and wrapper.deadline < self.reactor.seconds():
+                metrics.expired.inc()
+                return
+            # Already flooded messages are dropped before forwarding too, it stops hedged duplicates
+            if wrapper.id in self.temp:
+                metrics.dedup_hits.inc()
+                if trace:
+                    tracer.record(trace, wrapper.id, 'dedup_drop', now_ns())
+                return
             if wrapper.tunnel_id:
-                if random.randint(0, 3) != random.randint(0, 3):  # TODO: safe random func
-                    return self.forward(wrapper)
-                wrapper.type = 'message'
+                start = trace and now_ns()
+                if self.forward(wrapper, addr):
+                    if trace:
+                        tracer.record(trace, wrapper.id, 'forward', start)
+                    return
                 wrapper.tunnel_id = None
-
-            if wrapper.id in self.temp:
+            if wrapper.type == 'tunnel':
                 return
-            else:
+
+            start = trace and now_ns()
+            self.temp[wrapper.id] = wrapper
+            self._send_all(wrapper)
+            if trace:
+                tracer.record(trace, wrapper.id, 'broadcast', start)
+
+            if wrapper.shard:
+                if wrapper.shard[0] in self.temp:
+                    return
+                wrapper = self.server.reassembly.add(wrapper)
+                if not wrapper:
+                    return
                 self.temp[wrapper.id] = wrapper
-                self._send_all(wrapper)
 
         # Decryption message, preparing to process
 
-        _peer = ses.query(Peer).filter_by(addr=addr).first()
-        if not _peer:
-            _peer = Peer(self, addr=addr)
-            ses.add(_peer)
-            ses.commit()
-            log.debug(f'New peer {addr}')
-            _peer.request(Message('share'))
-        _peer.proto = self
+        _peer = self._get_peer(addr)
 
         _user = None
         if wrapper.sender:
-            _user = ses.query(User).filter_by(name=wrapper.sender).first()
-            if not local.user:
-                return db_worker.close_session(ses)
+            _user = self._get_user(wrapper.sender)
+            if not _user:
+                return
 
+            start = trace and now_ns()
             try:
-                wrapper.decrypt(self.private)
+                wrapper.decrypt(self.private_key)
             except ValueError:
-                return db_worker.close_session(ses)
+                return
+            if trace:
+                tracer.record(trace, wrapper.id, 'decrypt', start)
 
-        callbacks = self.server._callbacks[wrapper.message.callback]
+        callbacks = self.server._callbacks.get(wrapper.message.callback)
         if callbacks:
+            if self.server.congestion is not None:
+                self.server.congestion.ack(addr)
+            if isinstance(callbacks, Responses):
+                callbacks.put(wrapper.message)
+                return
             for i in range(len(callbacks)):
                 call = callbacks.pop()
-                if call:
+                if call and not call.called:
                     call.callback(wrapper.message)
-            return db_worker.close_session(ses)
-        session.commit()
-        session.close()
+            return
+        trace = trace and (trace, wrapper.id, now_ns())
         for func in self.server._handlers[wrapper.type][wrapper.message.name]:
             if func:
-                func(wrapper.message, _peer, _user)
+                func(wrapper.message, _peer, _user, trace)
         if not self.server._handlers[wrapper.type][wrapper.message.name]:
             raise UnhandledRequest
 
-    def forward(self, wrapper: MessageWrapper):
-        return self.random_send(wrapper)  # TODO: Check exists tunnels
+    def _get_peer(self, addr: str) -> Peer:
+        """
+        Peer by address. Unknown peer is stored and asked for its peers,
+        if the peer table admits it.
+        """
+        _peer = Peer(self, addr=addr)
+        table = self.server.peer_table
+        if table is not None and addr in table or db_worker.storage.has_peer(addr):
+            return _peer
+        if table is not None:
+            if not self.admit_peers([addr], addr):
+                return _peer
+            table.heard(addr)
+        db_worker.storage.add_peers([addr])
+        log.debug(f'New peer {addr}')
+        if self.server.ppx is not None:
+            self.server.ppx.added(addr)
+            self.server.ppx.sync(addr)
+        else:
+            _peer.request(Message('share'))
+        return _peer
+
+    def _get_user(self, name: str) -> Optional[User]:
+        public_key = db_worker.storage.user_key(name)
+        if public_key is None:
+            return None
+        return User(self, public_key=public_key, name=name)
+
+    def forward(self, wrapper: MessageWrapper, addr: str) -> bool:
+        """
+        Pass tunneled packet to the next hop. Known tunnels are routed by the table,
+        unknown ones get an entry: this node either becomes tunnel's exit
+        or forwards it to random peer other than `addr`. Packet exits when its
+        ttl is over. Ttl above `max_hops` of hop policy is cut, missing one is drawn from it.
+
+        :param addr: Address of previous hop
+        :return: False if packet exits tunnel here
+        """
+        if wrapper.id in self.forwarded:  # Packet made a loop
+            return False
+        policy = self.server.hop_policy
+        ttl = min(policy.ttl() if wrapper.ttl is None else wrapper.ttl, policy.max_hops - 1)
+        known, next_hop = self.tunnels.route(wrapper.tunnel_id, addr)
+        if not known:
+            next_hop = self._random_peer(exclude=addr) if ttl > 0 else None
+            self.tunnels.add(wrapper.tunnel_id, addr, next_hop)
+        if ttl <= 0 or not next_hop or self.server.deadpeer is not None and self.server.deadpeer.is_suspect(next_hop):
+            return False
+        wrapper.ttl = ttl - 1
+        self.forwarded[wrapper.id] = None
+        self._send(wrapper, next_hop)
+        return True
 
     def _send(self, wrapper: MessageWrapper, addr):
         """
@@ -147,66 +260,252 @@ class PeerProtocol(DatagramProtocol):
         """
         if not wrapper:
             return
+        return self._write(wrapper.to_json().encode('utf-8'), addr, wrapper.type)
+
+    def _watch(self, addr, callback: str):
+        """
+        Report loss to congestion control, if request to `addr` isn't answered in time
+        """
+        if not in_reactor_thread():
+            call_from_thread(self._watch, addr, callback)
+            return
+        if self.server.congestion is None or not self.server.wheel.running:
+            return
+        key = addr if isinstance(addr, str) else ':'.join(map(str, addr))
+
+        def check():
+            if any(not d.called for d in self.server._callbacks.get(callback) or ()):
+                self.server.congestion.loss(key)
+
+        self.server.wheel.call_later(self.server.request_timeout, check)
+
+    def _write(self, data: bytes, addr, _type: str) -> bool:
+        """
+        Send serialized wrapper of type `_type`. Anonymous traffic waits for cover traffic slot,
+        see `hodl_net.cover`. Called off the reactor thread, hands datagram over to it.
+
+        :return: False if send queue of peer is full and datagram is dropped.
+            Always True off the reactor thread.
+        """
+        if not in_reactor_thread():
+            # Congestion windows, cover queues and the timer wheel are used by the reactor thread only
+            call_from_thread(self._write, data, addr, _type)
+            return True
         if isinstance(addr, str):
+            key = addr
             addr: list = addr.split(':')
             addr[1] = int(addr[1])
             addr = tuple(addr)
-        self.transport.write(wrapper.to_json().encode('utf-8'), addr)
+        else:
+            key = ':'.join(map(str, addr))
+        cover = self.server.cover
+        if cover is not None and _type in cover.types:
+            return cover.put(key, data, addr, _type)
+        return self._emit(key, data, addr, _type)
+
+    def _emit(self, key: str, data: bytes, addr: tuple, _type: str) -> bool:
+        """
+        Send datagram to peer `key` within its congestion window
+        """
+        congestion = self.server.congestion
+        if congestion is None:
+            self._transmit(data, addr, _type)
+        elif not congestion.send(key, data, addr, _type):
+            metrics.congestion_dropped.inc()
+            return False
+        return True
+
+    def _transmit(self, data: bytes, addr: tuple, _type: str):
+        metrics.bytes_out.inc(len(data))
+        metrics.datagrams_out.labels(_type).inc()
+        self.transport.write(data, addr)
+
+    def _expect(self, callback: str) -> defer.Deferred:
+        """
+        :return: Deferred, which fires with response to message with `callback` id
+        """
         d = defer.Deferred()
-        self.server._callbacks[wrapper.message.callback].append(d)
+        self.server._callbacks[callback].append(d)
         return d
 
-    def send(self, message: Message, name: str):
+    def send(self, message: Message, name: str, hedge: bool = None):
         """
-        High level send
+        High level send. Addressee's public key is taken from DB
+        or looked up in DHT.
+
+        :param bool hedge: Send duplicate along another tunnel if response is late,
+            see `hodl_net.hedging`. `hedging.enabled` from config by default.
         """
-        addressee: User = self.session.query(User).filter_by(name=name).first()
+        return defer.ensureDeferred(self._send_to_user(message, name, hedge))
+
+    async def _send_to_user(self, message: Message, name: str, hedge: bool = None):
+        addressee = self._get_user(name)
+        public_key = addressee and addressee.public_key
+        if not public_key and self.server.dht is not None:
+            record = await self.server.dht.find_user(name)
+            public_key = record and record['key']
+        if not public_key:
+            raise UnknownUser(name)
+
         wrapper = MessageWrapper(
             message,
             type='message',
             sender=self.name,
-            tunnel_id=str(uuid.uuid4()),  # TODO: check exists tunnels
+            trace=self.server.tracer.sample()
         )
-        wrapper.prepare(self.private_key, addressee.public_key)
-        return self.random_send(wrapper)
+        start = wrapper.trace and now_ns()
+        wrapper.prepare(self.private_key, public_key)
+        if wrapper.trace:
+            self.server.tracer.record(wrapper.trace, wrapper.id, 'prepare', start)
+        d = self._expect(message.callback)
+        erasure = self.server.conf['erasure']
+        if erasure['enabled'] and len(wrapper.message) >= erasure['min_size']:
+            self.multipath_send(wrapper, erasure['k'], erasure['m'])
+        else:
+            self.tunnel_send(wrapper)
+        if not (self.server.hedge if hedge is None else hedge):
+            return await d
+
+        hedging = self.server.hedging
+        hedging.sent()
+        start = self.reactor.seconds()
+        timer = self.reactor.callLater(hedging.delay(name), self._hedge, wrapper, d)
+        try:
+            response = await d
+        finally:
+            if timer.active():
+                timer.cancel()
+        hedging.record(name, self.reactor.seconds() - start)
+        return response
+
+    def _hedge(self, wrapper: MessageWrapper, d: defer.Deferred):
+        if d.called or not self.server.hedging.take():
+            return
+        metrics.hedged.inc()
+        self.tunnel_send(attr.evolve(wrapper), exclude=wrapper.tunnel_id)
 
-    def shout(self, message: Message):
+    def shout(self, message: Message, first_n: int = None, quorum: int = None, deadline: float = None) -> Responses:
         """
         High level send_all
+
+        async for response in protocol.shout(Message('who_has', {...}), first_n=5, deadline=2):
+            print(response.data)
+
+        :param int first_n: Stop after this number of responses
+        :param int quorum: Min number of responses, `QuorumNotReached` is raised if fewer came
+        :param float deadline: Stop after this number of seconds. Relays drop the shout after it too.
+        :return: Async iterator of responses, see `hodl_net.responses.Responses`
         """
         wrapper = MessageWrapper(
             message,
             type='shout',
             sender=self.name,
-            tunnel_id=str(uuid.uuid4())
+            trace=self.server.tracer.sample()
         )
-        return self.random_send(wrapper)  # TODO: await generator
+        wrapper.prepare(self.private_key)
+        if deadline:
+            wrapper.deadline = self.reactor.seconds() + deadline
+        responses = Responses(self, message.callback, first_n, quorum, deadline)
+        self.temp[wrapper.id] = None  # Own shout comes back with the flood
+        self.tunnel_send(wrapper)
+        return responses
 
     @property
-    @db_worker.with_session
     def peers(self) -> List[Peer]:
         """
-        All peers in DB
+        All peers of the peer table, all peers in DB if it is off
+        """
+        table = self.server.peer_table
+        if table is None:
+            return self._db_peers()
+        if not table.loaded:
+            self.load_peers()
+        return [Peer(self, addr=addr) for addr in table]
+
+    def _db_peers(self) -> List[Peer]:
+        return [Peer(self, addr=addr) for addr in db_worker.storage.peers()]
+
+    def load_peers(self):
+        """
+        Fill the peer table from storage. Peers, which don't fit, are deleted from storage.
+        """
+        table = self.server.peer_table
+        table.loaded = True
+        addrs = db_worker.storage.peers()
+        self.admit_peers(addrs)
+        rejected = [addr for addr in addrs if addr not in table]
+        if rejected:
+            db_worker.storage.remove_peers(rejected)
+            log.info(f'{len(rejected)} peers did not fit the peer table')
+
+    def admit_peers(self, addrs: Iterable[str], source: str = None) -> List[str]:
         """
-        peers = []
-        for _peer in session.query(Peer).all():
-            _peer.proto = self
-            peers.append(_peer)
-        return peers  # TODO: generator mb
+        Pass peers through the peer table. Evicted peers are removed.
+
+        :param str source: Address of peer, which reported `addrs`
+        :return: Admitted addresses
+        """
+        table = self.server.peer_table
+        if table is None:
+            return list(addrs)
+        admitted = []
+        for addr in addrs:
+            ok, evicted = table.offer(addr, source)
+            if evicted:
+                metrics.peers_evicted.inc()
+                self.remove_peer(evicted)
+            if ok:
+                admitted.append(addr)
+        return admitted
 
     def add_peer(self, _peer: Peer, method=None):
-        ses = db_worker.get_session()
-        ses.add(_peer)
+        self.add_peers([_peer.addr], method)
 
-        try:
-            ses.commit()
-            if method:
-                log.info("Peer {} discovered by {}".format(_peer.addr, method))
-            else:
-                log.info("Peer {} discovered".format(_peer.addr))
-        except sqlalchemy.exc.IntegrityError:
-            pass
-        db_worker.close_session(ses)
+    def add_peers(self, addrs: Iterable[str], method: str = None) -> List[str]:
+        """
+        Store peers admitted by the peer table at once
+
+        :param str method: Discovery method, for logs
+        :return: Admitted addresses
+        """
+        addrs = self.admit_peers(addrs)
+        if not addrs:
+            return addrs
+        db_worker.storage.add_peers(addrs)
+        if len(addrs) == 1:
+            log.info(f'Peer {addrs[0]} discovered' + (f' by {method}' if method else ''))
+        else:
+            log.info(f'{len(addrs)} peers discovered' + (f' by {method}' if method else ''))
+        for addr in addrs:
+            if self.server.deadpeer is not None:
+                self.server.deadpeer.track(addr)
+            if self.server.ppx is not None:
+                self.server.ppx.added(addr)
+        return addrs
+
+    def remove_peer(self, addr: str):
+        """
+        Remove peer from storage, dead peer detector and peer map
+
+        :param str addr: Peer address
+        """
+        db_worker.storage.remove_peers([addr])
+        if self.server.peer_table is not None:
+            self.server.peer_table.discard(addr)
+        if self.server.peer_map is not None:
+            self.server.peer_map.forget(addr)
+        if self.server.deadpeer is not None:
+            self.server.deadpeer.forget(addr)
+        if self.server.congestion is not None:
+            self.server.congestion.forget(addr)
+        if self.server.dht is not None:
+            self.server.dht.remove(addr)
+        if self.server.ppx is not None:
+            self.server.ppx.removed(addr)
+        if self.server.tunnel_pool is not None:
+            self.server.tunnel_pool.removed(addr)
+        if self.server.lpd is not None:
+            self.server.lpd.seen.discard(addr)
 
     def send_all(self, message: Message):
         """
@@ -222,58 +521,296 @@ class PeerProtocol(DatagramProtocol):
         for _peer in self.peers:
             _peer.send(wrapper)
 
+    def multipath_send(self, wrapper: MessageWrapper, k: int, m: int):
+        """
+        Send prepared MessageWrapper as `k` data and `m` parity shards
+        along tunnels with different first hops, see `hodl_net.erasure`
+        """
+        shards = split(wrapper, k, m)
+        routes = self.server.tunnel_pool.spread(len(shards)) if self.server.tunnel_pool is not None else []
+        for i, shard in enumerate(shards):
+            self.tunnel_send(shard, route=routes[i % len(routes)] if routes else None)
+
+    def _random_peer(self, exclude: str = None) -> Optional[str]:
+        """
+        Address of random peer, not suspected dead and not congested if possible
+        """
+        table, deadpeer, congestion = self.server.peer_table, self.server.deadpeer, self.server.congestion
+
+        def alive(addr: str) -> bool:
+            return addr != exclude and not (deadpeer is not None and deadpeer.is_suspect(addr))
+
+        if table is not None:
+            if not table.loaded:
+                self.load_peers()
+            return congestion is not None and table.choice(lambda addr: alive(addr) and congestion.is_open(addr)) or \
+                table.choice(alive) or table.choice(lambda addr: addr != exclude)
+        peers = [_peer.addr for _peer in self.peers if _peer.addr != exclude]
+        if deadpeer is not None:
+            peers = [addr for addr in peers if not deadpeer.is_suspect(addr)] or peers
+        if congestion is not None:
+            peers = [addr for addr in peers if congestion.is_open(addr)] or peers
+        return random.choice(peers) if peers else None
+
     def random_send(self, wrapper: MessageWrapper):
         """
-        Send MessageWrapper to random peer
+        Send MessageWrapper to random peer, to another one if send queue of the first is full
+
         :param wrapper: MessageWrapper Instance
         :return:
         """
-        return random.choice(self.peers).send(wrapper)
+        if not in_reactor_thread():
+            call_from_thread(self.random_send, wrapper)
+            return
+        addr = self._random_peer()
+        if addr is None:
+            return
+        data = wrapper.to_json().encode('utf-8')
+        if not self._write(data, addr, wrapper.type):
+            metrics.congestion_rerouted.inc()
+            addr = self._random_peer(exclude=addr)
+            if addr is not None:
+                self._write(data, addr, wrapper.type)
+
+    def tunnel_send(self, wrapper: MessageWrapper, exclude: str = None, route: tuple = None):
+        """
+        Send MessageWrapper along tunnel of the pool,
+        along new random tunnel if the pool is off
+
+        :param str exclude: Id of tunnel to avoid
+        :param tuple route: Tunnel to use, (tunnel id, first hop, ttl)
+        """
+        self.forwarded[wrapper.id] = None
+        if self.server.deadline and not wrapper.deadline:
+            wrapper.deadline = self.reactor.seconds() + self.server.deadline
+        if not route and self.server.tunnel_pool is not None:
+            route = self.server.tunnel_pool.get(exclude)
+        if route:
+            wrapper.tunnel_id, addr, wrapper.ttl = route
+            return self._send(wrapper, addr)
+        wrapper.tunnel_id = str(uuid.uuid4())
+        wrapper.ttl = self.server.hop_policy.ttl()
+        return self.random_send(wrapper)
 
 
 class Server:
     """
     Main Server Class
     """
-    _handlers = defaultdict(lambda: defaultdict(lambda: []))
-    _callbacks = TempDict()
+    protocol_class = PeerProtocol
+    averaged_gauges = ('hodl_cover_real_ratio',)
     _on_close_func = None
     _on_open_func = None
     ext_addr = (None, None)
 
     def __init__(self,
-                 port: int = conf_file['main']['port'],
+                 port: int = None,
                  white: bool = True,
-                 lpd_port: int = conf_file['lpd']['port'],
-                 lpd_ip: str = conf_file['lpd']['multicast_ip'],
-                 lpd_interval: int = conf_file['lpd']['send_interval']):
+                 lpd_port: int = None,
+                 lpd_ip: str = None,
+                 lpd_interval: int = None,
+                 lpd_max_interval: int = None,
+                 conf: dict = None,
+                 wheel: TimerWheel = None,
+                 handlers: dict = None):
         """
 
         :param port: port to start server
         :param white: is ip white
+        :param conf: Configuration dict. `config/default.toml` by default.
+            Other arguments override values from it.
+        :param wheel: Timer wheel, may be shared by several servers. New one by default.
+        :param handlers: Handlers table, may be shared by several servers. See `Server.handlers_table`.
         """
         from twisted.internet import reactor
 
-        self.port = port
-        self.lpd_port = lpd_port
-        self.lpd_ip = lpd_ip
-        self.lpd_interval = lpd_interval
+        self.conf = conf_file = conf or default_conf()
+        self.port = port if port is not None else conf_file['main']['port']
+        self.lpd_port = lpd_port or conf_file['lpd']['port']
+        self.lpd_ip = lpd_ip or conf_file['lpd']['multicast_ip']
+        self.lpd_interval = lpd_interval or conf_file['lpd']['send_interval']
+        self.lpd_max_interval = lpd_max_interval or conf_file['lpd']['max_interval']
         self.white = white
 
         self.reactor = reactor
-        self.udp = PeerProtocol(self, reactor)
-
+        self.udp = self.protocol_class(self, reactor)
+        self.wheel = wheel if wheel is not None else TimerWheel(reactor, conf_file['deadpeer']['tick'])
+        self._callbacks = TempDict()
+        self._handlers = handlers if handlers is not None else self.handlers_table()
+        self.udp_port = None
+        self.tracer = Tracer(conf_file['tracing']['sample_rate'], conf_file['tracing']['size'])
+
+        self.peer_table = None
+        if conf_file['peers']['enabled']:
+            self.peer_table = PeerTable(self.wheel.clock,
+                                        conf_file['peers']['capacity'],
+                                        conf_file['peers']['bucket_size'],
+                                        conf_file['peers']['untested'])
+
+        self.peer_map = None
+        if conf_file['peermap']['enabled']:
+            self.peer_map = PeerMap(conf_file['peermap']['max_nodes'])
+
+        self.congestion = None
+        self.request_timeout = conf_file['congestion']['request_timeout']
+        if conf_file['congestion']['enabled']:
+            self.congestion = Congestion(self.wheel,
+                                         self.udp._transmit,
+                                         conf_file['congestion']['initial'],
+                                         conf_file['congestion']['min_window'],
+                                         conf_file['congestion']['max_window'],
+                                         conf_file['congestion']['beta'],
+                                         conf_file['congestion']['rtt'],
+                                         conf_file['congestion']['min_flight'],
+                                         conf_file['congestion']['max_flight'],
+                                         conf_file['congestion']['queue_size'],
+                                         conf_file['congestion']['max_peers'])
+
+        self.cover = None
+        if conf_file['cover']['enabled']:
+            self.cover = Cover(self.wheel,
+                               self._cover_peers,
+                               self.udp._emit,
+                               conf_file['cover']['rate'],
+                               conf_file['cover']['size'],
+                               conf_file['cover']['queue_size'])
+
+        self.deadpeer = None
+        if conf_file['deadpeer']['enabled']:
+            timeout = conf_file['deadpeer']['timeout']
+            if conf_file['deadpeer']['max_ping_en']:
+                timeout = conf_file['deadpeer']['max_ping'] / 1000
+            self.deadpeer = DeadPeerDetector(self.udp,
+                                             self.wheel,
+                                             conf_file['deadpeer']['echo_interval'],
+                                             conf_file['deadpeer']['max_echo_interval'],
+                                             timeout,
+                                             conf_file['deadpeer']['indirect_probes'],
+                                             conf_file['deadpeer']['phi_threshold'])
+            self.deadpeer.on_rtt = self._on_rtt
+            if self.congestion is not None:
+                self.deadpeer.on_loss = self.congestion.loss
+
+        self.ppx = None
+        if conf_file['ppx']['enabled']:
+            self.ppx = PeerExchange(self.udp,
+                                    self.wheel,
+                                    conf_file['ppx']['page_size'],
+                                    conf_file['ppx']['interval'],
+                                    conf_file['ppx']['max_pages'])
+
+        self.dht = None
+        if conf_file['dht']['enabled']:
+            from .dht import DHT
+
+            self.dht = DHT(self.udp,
+                           self.wheel,
+                           conf_file['dht']['k'],
+                           conf_file['dht']['alpha'],
+                           conf_file['dht']['timeout'],
+                           conf_file['dht']['expire'],
+                           conf_file['dht']['cache_expire'],
+                           conf_file['dht']['max_records'])
+
+        self.hop_policy = HopPolicy(conf_file['tunnels']['hops'],
+                                    conf_file['tunnels']['mean_hops'],
+                                    conf_file['tunnels']['min_hops'],
+                                    conf_file['tunnels']['max_hops'])
+        self.deadline = conf_file['tunnels']['deadline']
+        self.hedge = conf_file['hedging']['enabled']
+        self.hedging = Hedging(conf_file['hedging']['quantile'],
+                               conf_file['hedging']['default_delay'],
+                               conf_file['hedging']['min_samples'],
+                               conf_file['hedging']['samples'],
+                               conf_file['hedging']['budget'],
+                               conf_file['hedging']['burst'])
+        self.reassembly = Reassembly(conf_file['erasure']['max_groups'],
+                                     conf_file['erasure']['max_bytes'],
+                                     conf_file['erasure']['timeout'])
+        self.tunnel_pool = None
+        if conf_file['tunnels']['enabled']:
+            self.tunnel_pool = TunnelPool(self.udp,
+                                          self.wheel,
+                                          self.hop_policy,
+                                          conf_file['tunnels']['pool_size'],
+                                          conf_file['tunnels']['keepalive'],
+                                          conf_file['tunnels']['lifetime'])
+
+        self.bootstrap = None
+        if conf_file['bootstrap']['enabled']:
+            self.bootstrap = Bootstrap(self.udp,
+                                       self.wheel,
+                                       conf_file['bootstrap']['target'],
+                                       conf_file['bootstrap']['timeout'],
+                                       conf_file['bootstrap']['concurrency'],
+                                       conf_file['bootstrap']['ping_timeout'])
+        self.snapshotter = None
+
+        self.nat = None
+        self.lpd = None
         if conf_file['lpd']['enabled']:
+            from .discovery.lpd import LPD
 
             self.lpd = LPD(self,
                            self.lpd_port,
                            self.port,
                            self.lpd_ip,
-                           self.lpd_interval)
+                           self.lpd_interval,
+                           self.lpd_max_interval,
+                           conf_file['lpd']['redundancy'])
+
+        for name, (help, fn) in self.gauges().items():
+            metrics.registry.gauge(name, help, fn=fn)
 
         self.prepared = False
 
-    def handle(self, event: S, _type: str = 'message', in_thread: bool = True) -> Callable:
+    def gauges(self) -> Dict[str, Tuple[str, Callable]]:
+        """
+        Gauges of node: {name: (help, fn)}. Values of `averaged_gauges` are averaged
+        over nodes of `NodeHost`, other ones are summed.
+        """
+        gauges = {
+            'hodl_callbacks': ('Pending callback ids', lambda: len(self._callbacks)),
+            'hodl_tunnels': ('Known tunnels', lambda: len(self.udp.tunnels)),
+        }
+        if self.peer_table is not None:
+            gauges['hodl_peers'] = ('Peers in the peer table', lambda: len(self.peer_table))
+        if self.peer_map is not None:
+            gauges['hodl_peer_map_nodes'] = ('Nodes in the overlay peer map', lambda: len(self.peer_map))
+            gauges['hodl_peer_map_edges'] = ('Links in the overlay peer map', lambda: self.peer_map.edges)
+        if self.congestion is not None:
+            gauges['hodl_send_backlog'] = ('Datagrams waiting for congestion window', self.congestion.backlog)
+        if self.cover is not None:
+            gauges['hodl_cover_real_ratio'] = ('Share of real datagrams in cover traffic slots', self.cover.ratio)
+        gauges['hodl_seen_messages'] = ('Message ids kept for dedup', lambda: len(self.udp.temp))
+        return gauges
+
+    def _cover_peers(self) -> List[str]:
+        """
+        Peers, which get cover traffic
+        """
+        if self.peer_table is not None:
+            return list(self.peer_table)
+        return [_peer.addr for _peer in self.udp.peers]
+
+    def _on_rtt(self, addr: str, rtt: float):
+        """
+        Round trip time of answered dead peer detector probe
+        """
+        if self.peer_table is not None:
+            self.peer_table.rtt(addr, rtt)
+        if self.congestion is not None:
+            self.congestion.sample(addr, rtt)
+
+    @staticmethod
+    def handlers_table() -> dict:
+        """
+        Empty handlers table: {type: {message name: [handlers]}}
+        """
+        return defaultdict(lambda: defaultdict(lambda: []))
+
+    def handle(self, event: S, _type: str = 'message', in_thread: bool = True,
+               cache: ResponseCache = None) -> Callable:
         """
 
         @server.handle('echo')
@@ -285,6 +822,12 @@ class Server:
         async def echo_request(message):
             peer.request(Message('echo_response', message.data)
 
+        @server.handle('echo', 'request', cache=ResponseCache(10))
+        async def cached_echo_request(message):
+            return Message('echo_response', message.data)
+
+        :param ResponseCache cache: Cache of responses of idempotent request handler.
+            Handler returns response instead of sending it, see `hodl_net.cache`.
 
         """
 
@@ -292,13 +835,37 @@ class Server:
             event = [event]
 
         def decorator(func: Callable):
+            latency = metrics.handler_latency.labels(func.__name__)
+            call = func
+            if cache is not None:
+                cache.hits = metrics.cache_hits.labels(func.__name__)
+
+                def call(message: Message):
+                    return cache.respond(func, message, local.peer)
+
+            def record(result, start):
+                latency.record(metrics.now_ns() - start)
+                return result
+
+            def record_trace(result, tracer, trace, start):
+                tracer.record(trace[0], trace[1], f'handler:{func.__name__}', start)
+                return result
 
             # noinspection PyUnresolvedReferences,PyDunderSlots
-            def wrapper(message: Message, _peer: Peer = None, _user: User = None):
+            def wrapper(message: Message, _peer: Peer = None, _user: User = None, trace: tuple = None):
                 local.peer = _peer
                 local.user = _user
-                d = func(message)
-                return defer.ensureDeferred(d)
+                # Handlers table may be shared, so the receiving server is taken from peer
+                node = local.node = _peer.proto.server if _peer is not None else self
+                start = metrics.now_ns()
+                if trace:
+                    handler_start = now_ns()
+                    node.tracer.record(trace[0], trace[1], 'queue', trace[2], handler_start)
+                    d = defer.ensureDeferred(call(message))
+                    d.addBoth(record_trace, node.tracer, trace, handler_start)
+                else:
+                    d = defer.ensureDeferred(call(message))
+                return d.addBoth(record, start)
 
             if in_thread:
                 wrapper = to_thread(wrapper)
@@ -308,12 +875,13 @@ class Server:
 
         return decorator
 
-    def prepare(self, port: int = None, name: str = None):
+    def prepare(self, port: int = None, name: str = None, nat_gateway=None):
         """
         Server preparing function.
 
         :param port: Port on which we should start server
         :param name: Server name
+        :param nat_gateway: Gateway backend for `NatWorker`. UPnP by default.
         :return:
         """
 
@@ -323,28 +891,120 @@ class Server:
         self.udp.name = name
         self.udp.prepare_keys()
 
-        db_worker.create_connection(f'{self.udp.name}_db.sqlite')
+        connect(self.udp.name, self.conf)
 
-        logging.basicConfig(level=logging.DEBUG,
-                            format=f'%(name)s.%(funcName)-20s [LINE:%(lineno)-3s]# [{self.port}]'
-                            f' %(levelname)-8s [%(asctime)s]  %(message)s')
+        flight.configure(self.conf['logging'], self.udp.name, self.port)
 # print(conf_file)
-        self.reactor.listenUDP(self.port, self.udp)
+        self.reactor.callWhenRunning(self.wheel.start)
+        if self.conf['metrics']['textfile']:
+            self.reactor.callWhenRunning(self._export_metrics)
 
-        if conf_file['lpd']['enabled']:
+        self.listen(nat_gateway)
+
+        log.info("Plugin loading finished.")
+
+        self.prepared = True
+
+    def listen(self, nat_gateway=None):
+        """
+        Listen on `self.port` and start discovery subsystems.
+        Process-wide parts (DB, logging, timer wheel) are set up by `prepare` or `hodl_net.host.NodeHost`.
+
+        :param nat_gateway: Gateway backend for `NatWorker`. UPnP by default.
+        """
+        self.udp_port = self.reactor.listenUDP(self.port, self.udp)
+
+        if self.lpd is not None:
+            self.lpd.main_port = self.port
             self.reactor.listenMulticast(self.lpd_port, self.lpd, listenMultiple=True)
 
         log.info(f'Core started at {self.port}')
 
-        if conf_file['upnp']['enabled']:
-            nat_worker = NatWorker()
+        self.tracer.node = self.udp.name
+        if self.tracer.sample_rate:
+            self.reactor.addSystemEventTrigger('before', 'shutdown', self.dump_trace)
+
+        if self.ppx is not None:
+            self.reactor.callWhenRunning(self.ppx.start)
+        if self.deadpeer is not None:
+            self.reactor.callWhenRunning(self.deadpeer.start)
+        if self.cover is not None:
+            self.reactor.callWhenRunning(self.cover.start)
+        if self.bootstrap is not None:
+            self._start_bootstrap()
+        else:
+            if self.dht is not None:
+                self.reactor.callWhenRunning(self.dht.start)
+            if self.tunnel_pool is not None:
+                self.reactor.callWhenRunning(self.tunnel_pool.start)
+
+        if self.conf['upnp']['enabled']:
+            from .utils.natworks import NatWorker
+
+            self.nat = NatWorker(self.port,
+                                 self.conf['upnp']['search_timeout'],
+                                 nat_gateway,
+                                 f'{self.udp.name}_nat.json',
+                                 self.conf['upnp']['cache_ttl'])
+            self.ext_addr = self.nat.cached()
+            self.reactor.callWhenRunning(self._start_nat)
+
+    def _start_bootstrap(self):
+        """
+        Register built-in discovery sources after the ones added by user and run them
+        when reactor starts. DHT and tunnel pool start on the found peers.
+        """
+        conf = self.conf['bootstrap']
+        snapshot = f'{self.udp.name}_peers.snapshot'
+        if conf['snapshot']:
+            self.bootstrap.register(SnapshotSource(snapshot))
+            self.snapshotter = Snapshotter(self.udp, self.wheel, snapshot, conf['snapshot_interval'],
+                                           conf['snapshot_peers'], conf['snapshot_users'])
+            self.reactor.callWhenRunning(self.snapshotter.start)
+            self.reactor.addSystemEventTrigger('before', 'shutdown', self.snapshotter.save)
+        self.bootstrap.register(DBSource(self.udp))
+        if conf['seeds']:
+            self.bootstrap.register(StaticSource(conf['seeds'], self.reactor))
+        if self.lpd is not None:
+            self.bootstrap.register(LPDSource(self.lpd))
+        self.bootstrap.register(PexSource(self.udp, conf['pex_fanout']))
+
+        def ready(connected: int):
+            if self.dht is not None:
+                self.dht.start()
+            if self.tunnel_pool is not None:
+                self.tunnel_pool.start()
+            return connected
+
+        self.bootstrap.ready.addCallback(ready)
+        self.reactor.callWhenRunning(self.bootstrap.start)
+
+    def dump_trace(self) -> str:
+        """
+        Write recorded trace spans to `{name}_trace.jsonl`
 
-            if nat_worker:
-                self.ext_addr = nat_worker.get_addrs()
+        :return: Dump path
+        """
+        path = f'{self.udp.name}_trace.jsonl'
+        self.tracer.dump(path)
+        log.info(f'{len(self.tracer)} trace spans dumped to {path}')
+        return path
 
-        log.info("Plugin loading finished.")
+    def _export_metrics(self):
+        try:
+            metrics.registry.write_textfile(self.conf['metrics']['textfile'])
+        except OSError as ex:
+            log.error(f'Metrics export failed: {ex}')
+        self.wheel.call_later(self.conf['metrics']['interval'], self._export_metrics)
 
-        self.prepared = True
+    def _start_nat(self):
+        d = self.nat.start()
+        d.addCallback(self._set_ext_addr)
+        d.addErrback(lambda f: log.error(f'NAT discovery failed: {f.getErrorMessage()}'))
+
+    def _set_ext_addr(self, addr):
+        if addr[0]:
+            self.ext_addr = addr
 
     def run(self, *args, **kwargs):
         if not self.prepared:
@@ -359,5 +1019,22 @@ class Server:
         self.udp.name = name
 
 
-server = Server()
-protocol = server.udp
+_server: Server = None
+
+
+def get_server() -> Server:
+    """
+    Default server, created on first use
+    """
+    global _server
+    if _server is None:
+        _server = Server()
+    return _server
+
+
+def __getattr__(name):
+    if name == 'server':
+        return get_server()
+    if name == 'protocol':
+        return get_server().udp
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -0,0 +1,464 @@
+"""
+Deterministic in-process network simulator.
+
+Thousands of `PeerProtocol` instances run in one process on a virtual clock
+(heap-based `twisted.internet.task.Clock`) and exchange datagrams through an in-memory
+transport with per-link latency, jitter, bandwidth and loss. Randomness is
+seeded, so a run with the same arguments gives the same numbers.
+
+Nodes run the real datagram handling code. Peer and user tables are kept in
+memory instead of the DB, and RSA is replaced by a cheap stand-in, as CPU time
+does not exist on the virtual clock anyway.
+
+    python -m hodl_net.sim --nodes 1000 --degree 8 --loss 0.01 --messages 20
+"""
+
+from twisted.internet.base import DelayedCall
+from twisted.internet import task
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+import argparse
+import random
+import heapq
+import copy
+
+from .config_loader import default_conf
+from .metrics import Histogram
+from .models import Message, MessageWrapper, Peer, User
+from .server import PeerProtocol, Server, peer
+from .tunnels import HopPolicy
+from .utils.timer_wheel import TimerWheel
+from . import models
+
+KINDS = ('shout', 'send', 'request')
+
+
+# Cheap crypto stand-in: ciphertext carries addressee name, decryption with other key fails
+
+
+def _sign(plaintext: str, private_key: str) -> str:
+    return 'sim'
+
+
+def _verify(plaintext: str, s: str, public_key: str) -> bool:
+    return True
+
+
+def _encrypt(plaintext: str, public_key: str) -> str:
+    return public_key.partition(':')[2] + '\n' + plaintext
+
+
+def _decrypt(text: str, private_key: str) -> str:
+    name, _, plaintext = text.partition('\n')
+    if name != private_key.partition(':')[2]:
+        raise ValueError('Wrong key')
+    return plaintext
+
+
+@contextmanager
+def fast_crypto():
+    """
+    Replace RSA in `hodl_net.models` with the stand-in
+    """
+    saved = models.sign, models.verify, models.encrypt, models.decrypt
+    models.sign, models.verify, models.encrypt, models.decrypt = _sign, _verify, _encrypt, _decrypt
+    try:
+        yield
+    finally:
+        models.sign, models.verify, models.encrypt, models.decrypt = saved
+
+
+class SimClock(task.Clock):
+    """
+    `task.Clock` with pending calls in a heap. `task.Clock` sorts all pending
+    calls on every `callLater` and `advance`, which is too slow for flooding
+    thousands of nodes. Cancelled and reset calls are skipped lazily.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._heap = []
+        self._seq = 0
+
+    def callLater(self, delay, callable, *args, **kw) -> DelayedCall:
+        dc = DelayedCall(self.seconds() + delay, callable, args, kw, self._cancelled, self._push, self.seconds)
+        self._push(dc)
+        return dc
+
+    def _push(self, dc: DelayedCall):
+        self._seq += 1
+        heapq.heappush(self._heap, (dc.getTime(), self._seq, dc))
+
+    def _cancelled(self, dc: DelayedCall):
+        pass
+
+    def _pop_stale(self):
+        heap = self._heap
+        while heap and (heap[0][2].cancelled or heap[0][2].called or heap[0][0] != heap[0][2].getTime()):
+            heapq.heappop(heap)
+
+    def next_time(self) -> Optional[float]:
+        """
+        Time of the earliest pending call or None
+        """
+        self._pop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def getDelayedCalls(self) -> List[DelayedCall]:
+        return [dc for _, _, dc in self._heap if dc.active()]
+
+    def advance(self, amount: float):
+        self.rightNow += amount
+        heap = self._heap
+        while True:
+            self._pop_stale()
+            if not heap or heap[0][0] > self.rightNow:
+                return
+            dc = heapq.heappop(heap)[2]
+            dc.called = 1
+            dc.func(*dc.args, **dc.kw)
+
+
+class Link:
+    """
+    :param float latency: One-way delay in seconds
+    :param float jitter: Max random extra delay in seconds
+    :param float bandwidth: Bytes per second, unlimited if 0
+    :param float loss: Probability of datagram loss
+    """
+
+    __slots__ = ('latency', 'jitter', 'bandwidth', 'loss')
+
+    def __init__(self, latency: float = 0.02, jitter: float = 0.005, bandwidth: float = 0., loss: float = 0.):
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.loss = loss
+
+
+class SimTransport:
+    def __init__(self, network: 'Simulation', addr: str):
+        self.network = network
+        self.addr = addr
+
+    def write(self, data: bytes, addr: tuple):
+        self.network.transmit(self.addr, f'{addr[0]}:{addr[1]}', data)
+
+
+class SimProtocol(PeerProtocol):
+    """
+    `PeerProtocol` with peers and users in memory
+    """
+
+    def __init__(self, _server: Server, r):
+        super().__init__(_server, r)
+        self.neighbours: Dict[str, Peer] = {}
+        self.directory: Dict[str, str] = {}
+        self.addr: str = None
+
+    @property
+    def peers(self) -> List[Peer]:
+        return list(self.neighbours.values())
+
+    def add_peer(self, _peer: Peer, method=None):
+        _peer.proto = self
+        self.neighbours[_peer.addr] = _peer
+
+    def remove_peer(self, addr: str):
+        self.neighbours.pop(addr, None)
+
+    def _get_peer(self, addr: str) -> Peer:
+        _peer = self.neighbours.get(addr)
+        if _peer is None:
+            _peer = self.neighbours[addr] = Peer(self, addr=addr)
+        return _peer
+
+    def _get_user(self, name: str) -> Optional[User]:
+        key = self.directory.get(name)
+        return key and User(self, public_key=key, name=name)
+
+    def forward(self, wrapper: MessageWrapper, addr: str) -> bool:
+        forwarded = super().forward(wrapper, addr)
+        self.transport.network.hop(wrapper, forwarded)
+        return forwarded
+
+
+class SimServer(Server):
+    protocol_class = SimProtocol
+
+
+class Stats:
+    def __init__(self):
+        self.originated = 0
+        self.expected = 0
+        self.delivered = set()
+        self.latency = Histogram('latency')
+        self.rtt = Histogram('rtt')
+        self.hops = Histogram('hops', scale=1)
+        self.exposed = 0
+        self.datagrams = 0
+        self.bytes = 0
+
+    def dump(self) -> dict:
+        result = {
+            'originated': self.originated,
+            'delivered': len(self.delivered),
+            'delivery_ratio': len(self.delivered) / self.expected if self.expected else 0.,
+            'datagrams': self.datagrams,
+            'bytes': self.bytes
+        }
+        for q in (0.5, 0.9, 0.99):
+            result[f'p{q * 100:g}'] = self.latency.percentile(q)
+        result['max'] = self.latency.max * self.latency.scale
+        if self.rtt.count:
+            result['rtt_p50'] = self.rtt.percentile(0.5)
+            result['rtt_p99'] = self.rtt.percentile(0.99)
+        if self.hops.count:
+            result['hops_mean'] = self.hops.sum / self.hops.count
+            result['hops_max'] = self.hops.max
+            # Exit got message straight from origin
+            result['exposed'] = self.exposed / self.hops.count
+        return result
+
+
+def sim_conf() -> dict:
+    """
+    Node configuration with background subsystems off
+    """
+    conf = copy.deepcopy(default_conf())
+    for section in ('deadpeer', 'ppx', 'peers', 'peermap', 'bootstrap', 'dht', 'lpd', 'upnp'):
+        conf[section]['enabled'] = False
+    return conf
+
+
+class Simulation:
+    """
+    :param int nodes: Number of nodes
+    :param int degree: Average number of neighbours. Nodes form a ring with random chords.
+    :param Link link: Default link parameters
+    :param int seed: Random seed
+    :param dict conf: Node configuration, `sim_conf()` by default
+    """
+
+    def __init__(self, nodes: int = 100, degree: int = 8, link: Link = None, seed: int = 0, conf: dict = None):
+        self.clock = SimClock()
+        self.random = random.Random(seed)
+        random.seed(seed)  # Protocol uses module-level random
+        self.link = link or Link()
+        self.links: Dict[tuple, Link] = {}
+        self._busy: Dict[tuple, float] = {}
+        self.datagrams = 0
+        self.bytes = 0
+        self.lost = 0
+        self.current: SimProtocol = None
+        self.stats: Dict[str, Stats] = {}
+        self._seq = 0
+
+        self._hops: Dict[str, int] = {}
+
+        conf = conf or sim_conf()
+        self.wheel = TimerWheel(self.clock, conf['deadpeer']['tick'])
+        self.handlers = Server.handlers_table()
+
+        directory = {}
+        self.nodes: Dict[str, SimProtocol] = {}
+        for i in range(nodes):
+            addr = f'10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}:8000'
+            server = SimServer(conf=conf, wheel=self.wheel, handlers=self.handlers)
+            proto = server.udp
+            proto.reactor = self.clock
+            proto.name = f'node{i}'
+            proto.public_key, proto.private_key = f'public:{proto.name}', f'private:{proto.name}'
+            proto.transport = SimTransport(self, addr)
+            proto.directory = directory
+            proto.addr = addr
+            directory[proto.name] = proto.public_key
+            self.nodes[addr] = proto
+
+        addrs = self.addrs = list(self.nodes)
+        for i, addr in enumerate(addrs):
+            self.connect(addr, addrs[(i + 1) % nodes])
+            for _ in range(degree // 2 - 1):
+                self.connect(addr, self.random.choice(addrs))
+
+        async def sim_probe(message):
+            self.delivered(message)
+
+        if nodes:
+            for _type in ('request', 'message', 'shout'):
+                server.handle('sim_probe', _type, in_thread=False)(sim_probe)
+
+    def connect(self, a: str, b: str):
+        if a != b:
+            self.nodes[a].add_peer(Peer(self.nodes[a], addr=b))
+            self.nodes[b].add_peer(Peer(self.nodes[b], addr=a))
+
+    def set_link(self, src: str, dst: str, link: Link):
+        """
+        Override parameters of directed link
+        """
+        self.links[src, dst] = link
+
+    def transmit(self, src: str, dst: str, data: bytes):
+        self.datagrams += 1
+        self.bytes += len(data)
+        link = self.links.get((src, dst), self.link)
+        if dst not in self.nodes or link.loss and self.random.random() < link.loss:
+            self.lost += 1
+            return
+        now = self.clock.seconds()
+        done = max(now, self._busy.get((src, dst), 0.))
+        if link.bandwidth:
+            done += len(data) / link.bandwidth
+            self._busy[src, dst] = done
+        delay = done - now + link.latency + self.random.uniform(0, link.jitter)
+        self.clock.callLater(delay, self.deliver, src, dst, data)
+
+    def deliver(self, src: str, dst: str, data: bytes):
+        self.current = self.nodes[dst]
+        host, _, port = src.rpartition(':')
+        self.current.datagramReceived(data, (host, int(port)))
+
+    def hop(self, wrapper: MessageWrapper, forwarded: bool):
+        """
+        Count relays of tunneled probes
+        """
+        if wrapper.type == 'tunnel':
+            return
+        if forwarded:
+            self._hops[wrapper.id] = self._hops.get(wrapper.id, 0) + 1
+            return
+        hops = self._hops.pop(wrapper.id, 0) + 1
+        stats = self.stats.get('send' if wrapper.type == 'message' else wrapper.type)
+        if stats:
+            stats.hops.record(hops)
+            stats.exposed += hops == 1
+
+    def delivered(self, message: Message):
+        data = message.data
+        stats = self.stats.get(data.get('kind'))
+        if not stats or self.current.addr == data['origin']:
+            return
+        key = data['seq'], self.current.addr
+        if key in stats.delivered:
+            return
+        stats.delivered.add(key)
+        stats.latency.record(int((self.clock.seconds() - data['sent']) * 1e9))
+        if data['kind'] == 'request':
+            peer.response(message, Message('sim_ack'))
+
+    def _probe(self, kind: str, origin: SimProtocol) -> Message:
+        self._seq += 1
+        stats = self.stats.setdefault(kind, Stats())
+        stats.originated += 1
+        return Message('sim_probe', {'kind': kind, 'seq': self._seq, 'origin': origin.addr,
+                                     'sent': self.clock.seconds()})
+
+    def _node(self, addr: str = None) -> SimProtocol:
+        return self.nodes[addr or self.random.choice(self.addrs)]
+
+    def shout(self, origin: str = None):
+        node = self._node(origin)
+        self.stats.setdefault('shout', Stats()).expected += len(self.nodes) - 1
+        with fast_crypto():
+            node.shout(self._probe('shout', node))
+
+    def send(self, origin: str = None, to: str = None):
+        node = self._node(origin)
+        addressee = self._node(to)
+        while addressee is node:
+            addressee = self._node()
+        self.stats.setdefault('send', Stats()).expected += 1
+        with fast_crypto():
+            node.send(self._probe('send', node), addressee.name)
+
+    def request(self, origin: str = None):
+        node = self._node(origin)
+        stats = self.stats.setdefault('request', Stats())
+        stats.expected += 1
+        message = self._probe('request', node)
+        sent = self.clock.seconds()
+
+        def record_rtt(_):
+            stats.rtt.record(int((self.clock.seconds() - sent) * 1e9))
+
+        with fast_crypto():
+            self.random.choice(node.peers).request(message, watch=True).addCallback(record_rtt)
+
+    def run(self, until: float = None):
+        """
+        Advance virtual clock until no events are pending or till `until`
+        """
+        clock = self.clock
+        with fast_crypto():
+            while True:
+                next_time = clock.next_time()
+                if next_time is None or until is not None and next_time > until:
+                    break
+                clock.advance(max(0., next_time - clock.seconds()))
+            if until is not None and until > self.clock.seconds():
+                self.clock.advance(until - self.clock.seconds())
+
+    def measure(self, kind: str, count: int = 10, interval: float = 0.1) -> dict:
+        """
+        Originate `count` messages of `kind` from random nodes and run until quiet
+
+        :param str kind: 'shout', 'send' or 'request'
+        :return: Stats of this phase
+        """
+        self.stats[kind] = stats = Stats()
+        datagrams, size = self.datagrams, self.bytes
+        start = self.clock.seconds()
+        for i in range(count):
+            self.clock.callLater(i * interval, getattr(self, kind))
+        self.run()
+        stats.datagrams = self.datagrams - datagrams
+        stats.bytes = self.bytes - size
+        result = stats.dump()
+        result['duration'] = self.clock.seconds() - start
+        return result
+
+
+def format_report(reports: Dict[str, dict]) -> str:
+    lines = [f'{"kind":<8} {"sent":>6} {"deliv":>8} {"ratio":>7} {"datagrams":>10} {"bytes":>12} '
+             f'{"p50 ms":>8} {"p90 ms":>8} {"p99 ms":>8} {"max ms":>8} {"hops":>5} {"max":>4} {"expos":>6}']
+    for kind, r in reports.items():
+        lines.append(f'{kind:<8} {r["originated"]:>6} {r["delivered"]:>8} {r["delivery_ratio"]:>7.3f} '
+                     f'{r["datagrams"]:>10} {r["bytes"]:>12} {r["p50"] * 1e3:>8.1f} {r["p90"] * 1e3:>8.1f} '
+                     f'{r["p99"] * 1e3:>8.1f} {r["max"] * 1e3:>8.1f} {r.get("hops_mean", 0):>5.2f} '
+                     f'{r.get("hops_max", 0):>4} {r.get("exposed", 0):>6.3f}')
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate hodl_net overlay in one process')
+    parser.add_argument('--nodes', type=int, default=1000)
+    parser.add_argument('--degree', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.02, help='One-way link delay, s')
+    parser.add_argument('--jitter', type=float, default=0.005, help='Max extra link delay, s')
+    parser.add_argument('--bandwidth', type=float, default=0., help='Link bandwidth, bytes/s. 0 is unlimited')
+    parser.add_argument('--loss', type=float, default=0., help='Datagram loss probability')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--messages', type=int, default=10, help='Messages of each kind')
+    parser.add_argument('--interval', type=float, default=0.1, help='Interval between messages, s')
+    parser.add_argument('--kinds', nargs='+', choices=KINDS, default=list(KINDS))
+    parser.add_argument('--hops', choices=sorted(HopPolicy.distributions), default='geometric',
+                        help='Distribution of tunnel relays number')
+    parser.add_argument('--mean-hops', type=float, default=4)
+    parser.add_argument('--min-hops', type=int, default=1)
+    parser.add_argument('--max-hops', type=int, default=8)
+    parser.add_argument('--pool', type=int, default=4, help='Pre-built tunnels per node, 0 for new tunnel per message')
+    args = parser.parse_args()
+
+    conf = sim_conf()
+    conf['tunnels'].update(hops=args.hops, mean_hops=args.mean_hops, min_hops=args.min_hops,
+                           max_hops=args.max_hops, enabled=bool(args.pool), pool_size=args.pool)
+    sim = Simulation(args.nodes, args.degree, Link(args.latency, args.jitter, args.bandwidth, args.loss), args.seed,
+                     conf)
+    reports = {kind: sim.measure(kind, args.messages, args.interval) for kind in args.kinds}
+    print(format_report(reports))
+    print(f'\nlost datagrams: {sim.lost}')
+
+
+if __name__ == '__main__':
+    main()
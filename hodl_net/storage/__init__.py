@@ -0,0 +1,27 @@
+"""
+Storage backends of peers and users, selected by `DBWorker.create_connection`:
+
+* 'sqlite' - SQLite through SQLAlchemy, `SQLStorage`. ORM sessions work with it.
+* 'log' - dicts in memory persisted through append-only log, `LogStorage`.
+"""
+
+import importlib
+
+_lazy = {
+    'Storage': 'base',
+    'SQLStorage': 'sql',
+    'LogStorage': 'log',
+}
+
+backends = {
+    'sqlite': 'SQLStorage',
+    'log': 'LogStorage',
+}
+
+__all__ = list(_lazy) + ['backends']
+
+
+def __getattr__(name):
+    if name not in _lazy:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    return getattr(importlib.import_module(f'.{_lazy[name]}', __name__), name)
@@ -0,0 +1,70 @@
+from typing import Callable, Iterable, List, Optional, Tuple
+
+
+class Storage:
+    """
+    Peers and users of node. Methods may be called from handler threads.
+
+    :param str path: File of storage, in memory only if None
+    :param notify: Callable(table name), called after 'peers' or 'users' changed
+    """
+
+    def __init__(self, path: str = None, notify: Callable[[str], None] = None):
+        self.path = path
+        self.notify = notify
+
+    def _changed(self, table: str):
+        if self.notify:
+            self.notify(table)
+
+    def create(self):
+        """
+        Prepare storage for use, keeping stored data
+        """
+
+    def drop(self):
+        """
+        Delete all stored data
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def peers(self) -> List[str]:
+        """
+        Addresses of all peers
+        """
+        raise NotImplementedError
+
+    def has_peer(self, addr: str) -> bool:
+        raise NotImplementedError
+
+    def add_peers(self, addrs: Iterable[str]):
+        """
+        Store peers, known ones are skipped
+        """
+        raise NotImplementedError
+
+    def remove_peers(self, addrs: Iterable[str]):
+        raise NotImplementedError
+
+    def user_key(self, name: str) -> Optional[str]:
+        """
+        Public key of user, None if user is unknown
+        """
+        raise NotImplementedError
+
+    def users(self, limit: int = None) -> List[Tuple[str, str]]:
+        """
+        (name, public key) of users
+        """
+        raise NotImplementedError
+
+    def add_users(self, users: Iterable[Tuple[str, str]], replace: bool = False):
+        """
+        Store (name, public key) of users
+
+        :param bool replace: Replace keys of known users, otherwise they are skipped
+        """
+        raise NotImplementedError
@@ -0,0 +1,234 @@
+"""
+In-memory Storage with Append-only Log
+
+Peers and users live in dicts, so lookups cost a dict access and nothing is
+hydrated. Every change is appended to the log file; on open the log is
+mapped with `mmap` and replayed. When the log holds `compact_ratio` times
+more records than there are live entries, it is rewritten with live
+entries only and atomically replaces the old one. Without a path the
+storage is memory only, which makes test fleets start instantly.
+
+Format, all numbers in network order::
+
+    header   '!4sB'      magic, version
+    record   '!IBHI'     CRC32 of the rest of record, operation, key length, value length
+             key, value  UTF-8
+
+Replay stops at the first torn or broken record, and the tail is cut off.
+"""
+
+from typing import Dict, Iterable, List, Optional, Tuple
+import threading
+import logging
+import struct
+import mmap
+import zlib
+import os
+
+from .base import Storage
+
+log = logging.getLogger(__name__)
+
+magic = b'HLOG'
+version = 1
+_header = struct.Struct('!4sB')
+_record = struct.Struct('!IBHI')
+_body = struct.Struct('!BHI')
+_crc = struct.Struct('!I')
+
+ADD_PEER = 1
+REMOVE_PEER = 2
+PUT_USER = 3
+
+
+def encode(op: int, key: str, value: str = '') -> bytes:
+    key, value = key.encode(), value.encode()
+    body = _body.pack(op, len(key), len(value)) + key + value
+    return _crc.pack(zlib.crc32(body)) + body
+
+
+def replay(data, peers: Dict[str, None], users: Dict[str, str]) -> Tuple[int, int]:
+    """
+    Apply records of log to `peers` and `users`
+
+    :param data: Log contents, bytes or mmap
+    :return: (end of the last good record, number of records)
+    """
+    if len(data) < _header.size or _header.unpack_from(data) != (magic, version):
+        raise ValueError('Not a storage log of supported version')
+    offset = _header.size
+    count = 0
+    size = len(data)
+    while offset + _record.size <= size:
+        crc, op, key_len, value_len = _record.unpack_from(data, offset)
+        end = offset + _record.size + key_len + value_len
+        if end > size or zlib.crc32(data[offset + 4:end]) != crc:
+            break
+        key_end = offset + _record.size + key_len
+        key = data[offset + _record.size:key_end].decode()
+        if op == ADD_PEER:
+            peers[key] = None
+        elif op == REMOVE_PEER:
+            peers.pop(key, None)
+        elif op == PUT_USER:
+            users[key] = data[key_end:end].decode()
+        else:
+            break
+        offset = end
+        count += 1
+    return offset, count
+
+
+class LogStorage(Storage):
+    """
+    :param int compact_min: Min number of records in log before compaction
+    :param float compact_ratio: Log is compacted when it has this many records per live entry
+    :param bool sync: fsync log after every change
+    """
+
+    def __init__(self, path: str = None, notify=None, compact_min: int = 1024, compact_ratio: float = 2.,
+                 sync: bool = False):
+        super().__init__(path, notify)
+        self.compact_min = compact_min
+        self.compact_ratio = compact_ratio
+        self.sync = sync
+        self._peers: Dict[str, None] = {}
+        self._users: Dict[str, str] = {}
+        self._records = 0
+        self._file = None
+        self._loaded = False
+        self._lock = threading.RLock()
+
+    def create(self):
+        with self._lock:
+            if not self._loaded:
+                self.load()
+
+    def load(self):
+        """
+        Replay log file into memory
+        """
+        with self._lock:
+            self.close()
+            self._peers.clear()
+            self._users.clear()
+            self._records = 0
+            self._loaded = True
+            if self.path is None:
+                return
+            end = 0
+            try:
+                with open(self.path, 'rb') as f:
+                    if os.fstat(f.fileno()).st_size:
+                        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                            end, self._records = replay(data, self._peers, self._users)
+                            size = len(data)
+                        if end < size:
+                            log.warning(f'Storage log {self.path}: {size - end} bytes of broken tail cut off')
+                            os.truncate(self.path, end)
+            except FileNotFoundError:
+                pass
+            self._file = open(self.path, 'ab')
+            if not end:
+                self._file.write(_header.pack(magic, version))
+                self._flush()
+            log.debug(f'Storage log {self.path} loaded: {len(self._peers)} peers, {len(self._users)} users, '
+                      f'{self._records} records')
+
+    def drop(self):
+        with self._lock:
+            self.close()
+            self._peers.clear()
+            self._users.clear()
+            self._records = 0
+            self._loaded = False
+            if self.path is not None:
+                try:
+                    os.remove(self.path)
+                except FileNotFoundError:
+                    pass
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _flush(self):
+        self._file.flush()
+        if self.sync:
+            os.fsync(self._file.fileno())
+
+    def _append(self, records: List[bytes]):
+        if self._file is None or not records:
+            return
+        self._file.write(b''.join(records))
+        self._flush()
+        self._records += len(records)
+        if self._records > max(self.compact_min, self.compact_ratio * (len(self._peers) + len(self._users))):
+            self.compact()
+
+    def compact(self):
+        """
+        Rewrite log with live entries only
+        """
+        with self._lock:
+            if self._file is None:
+                return
+            records = [encode(ADD_PEER, addr) for addr in self._peers]
+            records += [encode(PUT_USER, name, key) for name, key in self._users.items()]
+            tmp = f'{self.path}.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(_header.pack(magic, version))
+                f.write(b''.join(records))
+                f.flush()
+                os.fsync(f.fileno())
+            self._file.close()
+            os.replace(tmp, self.path)
+            self._file = open(self.path, 'ab')
+            log.debug(f'Storage log {self.path} compacted from {self._records} to {len(records)} records')
+            self._records = len(records)
+
+    def peers(self) -> List[str]:
+        with self._lock:
+            return list(self._peers)
+
+    def has_peer(self, addr: str) -> bool:
+        return addr in self._peers
+
+    def add_peers(self, addrs: Iterable[str]):
+        with self._lock:
+            new = [addr for addr in dict.fromkeys(addrs) if addr not in self._peers]
+            self._peers.update(dict.fromkeys(new))
+            self._append([encode(ADD_PEER, addr) for addr in new])
+        if new:
+            self._changed('peers')
+
+    def remove_peers(self, addrs: Iterable[str]):
+        with self._lock:
+            gone = [addr for addr in dict.fromkeys(addrs) if addr in self._peers]
+            for addr in gone:
+                del self._peers[addr]
+            self._append([encode(REMOVE_PEER, addr) for addr in gone])
+        if gone:
+            self._changed('peers')
+
+    def user_key(self, name: str) -> Optional[str]:
+        return self._users.get(name)
+
+    def users(self, limit: int = None) -> List[Tuple[str, str]]:
+        with self._lock:
+            users = list(self._users.items())
+        return users if limit is None else users[:limit]
+
+    def add_users(self, users: Iterable[Tuple[str, str]], replace: bool = False):
+        with self._lock:
+            changed = {}
+            for name, key in users:
+                known = self._users.get(name)
+                if known is None and name not in changed or replace and known != key:
+                    changed[name] = key
+            self._users.update(changed)
+            self._append([encode(PUT_USER, name, key) for name, key in changed.items()])
+        if changed:
+            self._changed('users')
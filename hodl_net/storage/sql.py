@@ -0,0 +1,77 @@
+"""
+SQLite Storage
+
+Queries go through SQLAlchemy Core, so lookups on the hot path return plain
+strings instead of hydrated ORM objects. Changes are reported by engine
+events of `DBWorker`, the same way as changes made by ORM sessions of handlers.
+"""
+
+from sqlalchemy import select
+from typing import Iterable, List, Optional, Tuple
+import os
+
+from ..models import Peer, User
+from ..database import Base
+from .base import Storage
+
+_peers = Peer.__table__
+_users = User.__table__
+
+
+class SQLStorage(Storage):
+    """
+    :param engine: SQLAlchemy engine
+    """
+
+    def __init__(self, engine, path: str = None, notify=None):
+        super().__init__(path, notify)
+        self.engine = engine
+
+    def create(self):
+        Base.metadata.create_all(self.engine)
+
+    def drop(self):
+        self.engine.dispose()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        self.engine.dispose()
+
+    def peers(self) -> List[str]:
+        with self.engine.connect() as conn:
+            return [addr for addr, in conn.execute(select(_peers.c.addr))]
+
+    def has_peer(self, addr: str) -> bool:
+        with self.engine.connect() as conn:
+            return conn.execute(select(_peers.c.addr).where(_peers.c.addr == addr)).first() is not None
+
+    def add_peers(self, addrs: Iterable[str]):
+        rows = [{'addr': addr} for addr in addrs]
+        if rows:
+            with self.engine.begin() as conn:
+                conn.execute(_peers.insert().prefix_with('OR IGNORE'), rows)
+
+    def remove_peers(self, addrs: Iterable[str]):
+        addrs = list(addrs)
+        if addrs:
+            with self.engine.begin() as conn:
+                conn.execute(_peers.delete().where(_peers.c.addr.in_(addrs)))
+
+    def user_key(self, name: str) -> Optional[str]:
+        with self.engine.connect() as conn:
+            row = conn.execute(select(_users.c.public_key).where(_users.c.name == name)).first()
+        return row and row[0]
+
+    def users(self, limit: int = None) -> List[Tuple[str, str]]:
+        with self.engine.connect() as conn:
+            return [(name, key) for name, key in conn.execute(
+                select(_users.c.name, _users.c.public_key).limit(limit))]
+
+    def add_users(self, users: Iterable[Tuple[str, str]], replace: bool = False):
+        rows = [{'name': name, 'public_key': key} for name, key in users]
+        if rows:
+            with self.engine.begin() as conn:
+                conn.execute(_users.insert().prefix_with('OR REPLACE' if replace else 'OR IGNORE'), rows)
@@ -0,0 +1,111 @@
+"""
+Opt-in per-message tracing.
+
+A sampled message carries trace id in `MessageWrapper.trace`. Every node it
+passes records spans of its stages (decode, dedup, forward, decrypt, thread
+queue wait, handler) into a bounded ring buffer. Spans use wall clock, so
+dumps of several nodes can be stitched into one timeline:
+
+    python -m hodl_net.tracing 8001_trace.jsonl 8002_trace.jsonl ...
+"""
+
+from collections import deque, defaultdict
+from typing import Optional
+import argparse
+import random
+import json
+import time
+import uuid
+
+now_ns = time.time_ns
+
+
+class Tracer:
+    """
+    :param float sample_rate: Share of locally originated messages to trace
+    :param int size: Max spans kept in memory
+    :param str node: Node name written to dumps
+    """
+
+    def __init__(self, sample_rate: float = 0., size: int = 10000, node: str = None):
+        self.sample_rate = sample_rate
+        self.node = node
+        self.spans = deque(maxlen=size)
+
+    def __len__(self):
+        return len(self.spans)
+
+    def sample(self) -> Optional[str]:
+        """
+        :return: New trace id or None, if message is not sampled
+        """
+        if self.sample_rate and random.random() < self.sample_rate:
+            return uuid.uuid4().hex[:16]
+        return None
+
+    def record(self, trace: str, message_id: str, stage: str, start: int, end: int = None):
+        """
+        Record span. Times are `time.time_ns()` values.
+        """
+        self.spans.append((trace, message_id, stage, start, (end or now_ns()) - start))
+
+    def dump(self, path: str):
+        with open(path, 'w') as f:
+            for trace, message_id, stage, start, duration in self.spans:
+                f.write(json.dumps({
+                    'trace': trace,
+                    'id': message_id,
+                    'node': self.node,
+                    'stage': stage,
+                    'start': start,
+                    'duration': duration
+                }) + '\n')
+
+
+def load(paths):
+    traces = defaultdict(list)
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                span = json.loads(line)
+                traces[span['trace']].append(span)
+    for spans in traces.values():
+        spans.sort(key=lambda span: span['start'])
+    return traces
+
+
+def timeline(spans) -> str:
+    origin = spans[0]['start']
+    lines = []
+    for span in spans:
+        lines.append(f"  {(span['start'] - origin) / 1e6:>10.3f} ms  {span['duration'] / 1e6:>9.3f} ms  "
+                     f"{span['node'] or '?':<12} {span['stage']}")
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stitch trace dumps of several nodes into timelines')
+    parser.add_argument('dumps', nargs='+')
+    parser.add_argument('--top', type=int, default=10, help='Number of slowest traces to show')
+    args = parser.parse_args()
+
+    traces = load(args.dumps)
+    total = {trace: spans[-1]['start'] + spans[-1]['duration'] - spans[0]['start']
+             for trace, spans in traces.items()}
+    for trace in sorted(total, key=total.get, reverse=True)[:args.top]:
+        print(f'trace {trace}: {total[trace] / 1e6:.3f} ms, {len(traces[trace])} spans')
+        print(timeline(traces[trace]))
+
+    stages = defaultdict(list)
+    for spans in traces.values():
+        for span in spans:
+            stages[span['stage']].append(span['duration'])
+    print('\nstage            count    total ms     p50 ms     max ms')
+    for stage, durations in sorted(stages.items(), key=lambda item: -sum(item[1])):
+        durations.sort()
+        print(f'{stage:<14} {len(durations):>7} {sum(durations) / 1e6:>11.3f} '
+              f'{durations[len(durations) // 2] / 1e6:>10.3f} {durations[-1] / 1e6:>10.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+"""
+Pool of pre-built tunnels
+
+Node keeps a few tunnels ready: tunnel id and the first hop. Relays install
+a routing entry (see `models.Tunnels`) when a packet of unknown tunnel
+passes them, and later packets of this tunnel follow the same path.
+Keepalive packets walk every tunnel of the pool periodically, so relays do
+not forget them and the first message does not wait for path discovery.
+Tunnels are rebuilt after `lifetime` or when their first hop is gone.
+
+Tunnel length is drawn from `HopPolicy` by the node, which builds the
+tunnel, and travels in `MessageWrapper.ttl`: number of hops the packet may
+still be forwarded. Relays decrement it and cap it by their `max_hops`.
+"""
+
+from typing import Callable, Dict, List, Optional, Tuple, Union
+import logging
+import random
+import uuid
+
+from .models import Message, MessageWrapper
+
+log = logging.getLogger(__name__)
+
+
+def geometric(rnd: random.Random, policy: 'HopPolicy') -> int:
+    """
+    Every relay continues with the same probability. Distribution is memoryless,
+    so remaining ttl tells relay nothing about its distance from the origin.
+    """
+    hops = policy.min_hops
+    if policy.mean_hops > policy.min_hops:
+        proceed = 1 - 1 / (policy.mean_hops - policy.min_hops + 1)
+        while rnd.random() < proceed and hops < policy.max_hops:
+            hops += 1
+    return hops
+
+
+def uniform(rnd: random.Random, policy: 'HopPolicy') -> int:
+    return rnd.randint(policy.min_hops, policy.max_hops)
+
+
+def fixed(rnd: random.Random, policy: 'HopPolicy') -> int:
+    return round(policy.mean_hops)
+
+
+class HopPolicy:
+    """
+    Number of relays of new tunnels
+
+    :param distribution: Name from `HopPolicy.distributions` or function `(random, policy) -> hops`
+    :param float mean_hops: Mean number of relays for 'geometric', number of relays for 'fixed'
+    :param int min_hops: Min number of relays
+    :param int max_hops: Max number of relays. Relays do not forward packets further.
+    :param rnd: `random.Random` instance, module `random` by default
+    """
+
+    distributions: Dict[str, Callable[[random.Random, 'HopPolicy'], int]] = {
+        'geometric': geometric,
+        'uniform': uniform,
+        'fixed': fixed
+    }
+
+    def __init__(self,
+                 distribution: Union[str, Callable] = 'geometric',
+                 mean_hops: float = 4,
+                 min_hops: int = 1,
+                 max_hops: int = 8,
+                 rnd: random.Random = None):
+        if isinstance(distribution, str):
+            distribution = self.distributions[distribution]
+        self.distribution = distribution
+        self.mean_hops = mean_hops
+        self.min_hops = max(1, min_hops)
+        self.max_hops = max(self.min_hops, max_hops)
+        self.random = rnd or random
+
+    def hops(self) -> int:
+        return min(max(self.distribution(self.random, self), self.min_hops), self.max_hops)
+
+    def ttl(self) -> int:
+        """
+        Initial `MessageWrapper.ttl`: forwards left after the first relay
+        """
+        return self.hops() - 1
+
+
+class TunnelPool:
+    """
+    :param proto: `PeerProtocol` instance
+    :param wheel: `TimerWheel` for keepalive
+    :param HopPolicy policy: Length of new tunnels
+    :param int size: Number of tunnels kept ready
+    :param float keepalive: Keepalive interval, must be below `tunnels.expire` of relays
+    :param float lifetime: Tunnels are replaced by new ones after 3/4 to all of this time
+    """
+
+    def __init__(self, proto, wheel, policy: HopPolicy = None, size: int = 4, keepalive: float = 30,
+                 lifetime: float = 600):
+        self.proto = proto
+        self.wheel = wheel
+        self.policy = policy or HopPolicy()
+        self.size = size
+        self.keepalive = keepalive
+        self.lifetime = lifetime
+        self.tunnels: Dict[str, Tuple[str, float, int]] = {}  # Tunnel id: (first hop, rotation time, ttl)
+        self.timer = None
+
+    def start(self):
+        self._refresh()
+        log.info(f'Tunnel pool started with {len(self.tunnels)} tunnels')
+
+    def stop(self):
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+
+    def _now(self) -> float:
+        return self.wheel.clock.seconds()
+
+    def _first_hops(self):
+        peers = [_peer.addr for _peer in self.proto.peers]
+        deadpeer = self.proto.server.deadpeer
+        if deadpeer is not None:
+            peers = [addr for addr in peers if not deadpeer.is_suspect(addr)] or peers
+        return peers
+
+    def build(self, avoid: str = None, first_hop: str = None) -> Optional[str]:
+        """
+        Build new tunnel through `first_hop` or random peer
+
+        :param str avoid: Address of peer not to use as the first hop if possible
+        :return: Tunnel id, None if there are no peers
+        """
+        if not first_hop:
+            peers = self._first_hops()
+            if not peers:
+                return
+            first_hop = random.choice([addr for addr in peers if addr != avoid] or peers)
+        tunnel_id = str(uuid.uuid4())
+        # Rotation time is spread over the last quarter of lifetime, so tunnels are not rebuilt at once
+        self.tunnels[tunnel_id] = (first_hop, self._now() + self.lifetime * random.uniform(0.75, 1.),
+                                   self.policy.ttl())
+        self.ping(tunnel_id)
+        return tunnel_id
+
+    def ping(self, tunnel_id: str):
+        """
+        Send keepalive along tunnel
+        """
+        first_hop, _, ttl = self.tunnels[tunnel_id]
+        self.proto.tunnels.add(tunnel_id, None, first_hop)
+        self.proto._send(MessageWrapper(Message('keepalive'), 'tunnel', tunnel_id=tunnel_id, ttl=ttl), first_hop)
+
+    def drop(self, tunnel_id: str):
+        self.tunnels.pop(tunnel_id, None)
+        self.proto.tunnels.pop(tunnel_id, None)
+
+    def get(self, exclude: str = None) -> Optional[Tuple[str, str, int]]:
+        """
+        Random tunnel of the pool. Tunnel is built if the pool is empty.
+
+        :param str exclude: Id of tunnel to avoid. Tunnel with another first hop is
+            preferred, it is built if the pool has none.
+        :return: (tunnel id, first hop address, ttl), None if there are no peers
+        """
+        candidates = list(self.tunnels)
+        if exclude:
+            avoid = self.tunnels.get(exclude, (None,))[0]
+            others = [tunnel_id for tunnel_id in candidates if self.tunnels[tunnel_id][0] != avoid]
+            if not others and any(addr != avoid for addr in self._first_hops()):
+                others = [self.build(avoid)]
+            candidates = others or [tunnel_id for tunnel_id in candidates if tunnel_id != exclude] or candidates
+        if not candidates:
+            tunnel_id = self.build()
+            if not tunnel_id:
+                return
+            candidates = [tunnel_id]
+        tunnel_id = random.choice(candidates)
+        first_hop, _, ttl = self.tunnels[tunnel_id]
+        return tunnel_id, first_hop, ttl
+
+    def spread(self, n: int) -> List[Tuple[str, str, int]]:
+        """
+        Up to `n` tunnels with different first hops. Missing ones are built.
+
+        :return: List of (tunnel id, first hop address, ttl)
+        """
+        routes = {}
+        for tunnel_id, (first_hop, _, ttl) in self.tunnels.items():
+            if len(routes) >= n:
+                break
+            routes.setdefault(first_hop, (tunnel_id, first_hop, ttl))
+        for addr in self._first_hops():
+            if len(routes) >= n:
+                break
+            if addr not in routes:
+                tunnel_id = self.build(first_hop=addr)
+                routes[addr] = (tunnel_id, addr, self.tunnels[tunnel_id][2])
+        return list(routes.values())
+
+    def removed(self, addr: str):
+        """
+        Drop tunnels through removed peer
+        """
+        for tunnel_id, (first_hop, _, _) in list(self.tunnels.items()):
+            if first_hop == addr:
+                self.drop(tunnel_id)
+
+    def _refresh(self):
+        now = self._now()
+        deadpeer = self.proto.server.deadpeer
+        for tunnel_id, (first_hop, rotate, _) in list(self.tunnels.items()):
+            if now >= rotate or deadpeer is not None and deadpeer.is_suspect(first_hop):
+                self.drop(tunnel_id)
+            else:
+                self.ping(tunnel_id)
+        for _ in range(self.size - len(self.tunnels)):
+            if not self.build():
+                break
+        self.timer = self.wheel.call_later(self.keepalive, self._refresh)
@@ -1 +1,15 @@
-from .natworks import NatWorker
+import importlib
+
+_lazy = {
+    'NatWorker': 'natworks',
+    'TimerWheel': 'timer_wheel',
+    'Timer': 'timer_wheel',
+}
+
+__all__ = list(_lazy)
+
+
+def __getattr__(name):
+    if name not in _lazy:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    return getattr(importlib.import_module(f'.{_lazy[name]}', __name__), name)
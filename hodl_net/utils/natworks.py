@@ -1,26 +1,212 @@
-import upnpclient
+"""
+UPnP NAT passthrough.
+
+Discovery runs in a thread and never blocks server start. Gateway location
+and external address are cached on disk, so a restart within `ttl` seconds
+publishes external address at once without SSDP discovery.
+"""
+
+from twisted.internet import threads, defer
+from typing import Optional, Tuple
 import logging
+import socket
+import json
+import time
+import os
 
 log = logging.getLogger(__name__)
 
+Addr = Tuple[Optional[str], Optional[int]]
+
+
+def local_ip() -> str:
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        s.connect(('10.255.255.255', 1))
+        return s.getsockname()[0]
+    except OSError:
+        return '127.0.0.1'
+    finally:
+        s.close()
+
+
+def valid_cache(cache: dict) -> bool:
+    """
+    Check field types of NAT cache
+    """
+    ext_addr = cache.get('ext_addr')
+    if ext_addr is not None:
+        if not isinstance(ext_addr, list) or len(ext_addr) != 2:
+            return False
+        ip, port = ext_addr
+        if not isinstance(ip, (str, type(None))) or isinstance(port, bool) or not isinstance(port, (int, type(None))):
+            return False
+    return isinstance(cache.get('time'), (int, float)) and not isinstance(cache['time'], bool) and \
+        isinstance(cache.get('location'), (str, type(None)))
+
+
+class UPnPGateway:
+    """
+    Internet gateway over `upnpclient`.
+
+    Any object with the same methods can be passed to `NatWorker`,
+    e.g. a fake gateway in tests.
+    """
+
+    service_types = ('WANIPConnection', 'WANPPPConnection')
+
+    def __init__(self):
+        self.location = None
+        self.service = None
+
+    def _find_service(self, device) -> bool:
+        for service in device.services:
+            if any(t in service.service_type for t in self.service_types):
+                self.location = device.location
+                self.service = service
+                return True
+        return False
+
+    def discover(self, timeout: float, location: str = None) -> bool:
+        """
+        Find gateway. If `location` of known gateway is given, SSDP discovery is skipped.
+
+        :return: True if gateway found
+        """
+        import upnpclient
+
+        if location:
+            try:
+                return self._find_service(upnpclient.Device(location))
+            except Exception as _:
+                log.debug(f'Cached gateway {location} is unavailable')
+        for device in upnpclient.discover(timeout):
+            if self._find_service(device):
+                return True
+        return False
+
+    def external_ip(self) -> str:
+        return self.service.GetExternalIPAddress()['NewExternalIPAddress']
+
+    def add_port_mapping(self, port: int, protocol: str = 'UDP') -> int:
+        """
+        :return: External port
+        """
+        self.service.AddPortMapping(
+            NewRemoteHost='',
+            NewExternalPort=port,
+            NewProtocol=protocol,
+            NewInternalPort=port,
+            NewInternalClient=local_ip(),
+            NewEnabled='1',
+            NewPortMappingDescription='hodl_net',
+            NewLeaseDuration=0
+        )
+        return port
+
 
 class NatWorker:
+    """
+    :param int main_port: Port to map
+    :param float timeout: SSDP discovery timeout
+    :param gateway: Gateway backend. `UPnPGateway` by default.
+    :param str cache_path: File for discovery results. No cache if None.
+    :param float ttl: Lifetime of cached results
+    """
 
-    def __init__(self, main_port=8000, timeout=2):
+    def __init__(self, main_port=8000, timeout=2, gateway=None, cache_path: str = None, ttl: float = 3600):
+        self.main_port = main_port
+        self.timeout = timeout
+        self.gateway = gateway if gateway is not None else UPnPGateway()
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.ext_addr: Addr = (None, None)
+
+    def load_cache(self) -> dict:
+        """
+        :return: Cache of `main_port`. Empty, if it is missing or broken.
+        """
+        if not self.cache_path:
+            return {}
+        try:
+            with open(self.cache_path) as f:
+                cache = json.loads(f.read())
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError):
+            log.warning(f'NAT cache {self.cache_path} is unreadable, ignored')
+            return {}
+        if not isinstance(cache, dict) or cache.get('port') != self.main_port:
+            return {}
+        if not valid_cache(cache):
+            log.warning(f'NAT cache {self.cache_path} is broken, ignored')
+            return {}
+        return cache
+
+    def save_cache(self):
+        """
+        Replace cache atomically, so a crash never leaves it half-written
+        """
+        if not self.cache_path:
+            return
+        tmp = f'{self.cache_path}.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                f.write(json.dumps({
+                    'time': time.time(),
+                    'port': self.main_port,
+                    'location': self.gateway.location,
+                    'ext_addr': self.ext_addr
+                }))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.cache_path)
+        except OSError:
+            log.warning(f'NAT cache {self.cache_path} is not saved', exc_info=True)
+
+    def cached(self) -> Addr:
+        """
+        External address from fresh cache or (None, None)
+        """
+        cache = self.load_cache()
+        if cache and time.time() - cache['time'] < self.ttl and cache.get('ext_addr'):
+            return tuple(cache['ext_addr'])
+        return None, None
+
+    def discover(self) -> Addr:
+        """
+        Blocking gateway discovery and port mapping
+        """
         log.info("UPnP Passthrough Service Started.")
-        log.debug("Fetching a device list...")
-        self.dev_list = upnpclient.discover(timeout)
-        log.debug(f"Fetch finished in {timeout}s")
-        log.debug(f"Devices detected: {self.dev_list}")
-        if not self.dev_list:
-            log.warning("No UPnP Devices was found. Stopping NatWorker...")
-            del self
+        if not self.gateway.discover(self.timeout, self.load_cache().get('location')):
+            log.warning("No UPnP Devices was found.")
+            return None, None
+        try:
+            self.ext_addr = self.gateway.external_ip(), self.gateway.add_port_mapping(self.main_port)
+        except Exception as _:
+            log.exception('Port mapping failed.')
+            return None, None
+        log.info(f'External address {self.ext_addr[0]}:{self.ext_addr[1]}')
+        self.save_cache()
+        return self.ext_addr
+
+    def start(self) -> defer.Deferred:
+        """
+        Discover gateway in thread, unless cached result is fresh
+
+        :return: Deferred, which fires with external address
+        """
+        cached = self.cached()
+        if cached[0]:
+            self.ext_addr = cached
+            return defer.succeed(cached)
+        return threads.deferToThread(self.discover)
 
-    def get_addrs(self):
-        return None, None  # TODO: Return real ext IP and port
+    def get_addrs(self) -> Addr:
+        return self.ext_addr
 
 
 if __name__ == '__main__':
     logging.basicConfig(format=logging.BASIC_FORMAT)
     log.setLevel(logging.DEBUG)
-    nw = NatWorker()
+    print(NatWorker().discover())
@@ -0,0 +1,131 @@
+"""
+Hierarchical timing wheel.
+
+One reactor timer drives every scheduled call, so scheduling, cancelling
+and firing a timer costs O(1) regardless of how many timers are pending.
+"""
+
+from twisted.internet import task
+
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class Timer:
+    """
+    Handle of a call scheduled on `TimerWheel`
+    """
+
+    __slots__ = ('expire', 'func', 'args', 'kwargs', 'bucket')
+
+    def __init__(self, expire: int, func, args, kwargs):
+        self.expire = expire
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.bucket = None
+
+    @property
+    def active(self) -> bool:
+        return self.bucket is not None
+
+    def cancel(self):
+        if self.bucket is not None:
+            self.bucket.discard(self)
+            self.bucket = None
+
+
+class TimerWheel:
+    """
+    Hashed hierarchical timing wheel.
+
+    :param clock: `IReactorTime` provider. Reactor by default.
+    :param float tick: Wheel resolution in seconds
+    :param int slots: Slots per level
+    :param int levels: Number of levels. Timers beyond
+        `tick * slots ** levels` seconds are cascaded until they fit.
+    """
+
+    def __init__(self, clock=None, tick: float = 0.1, slots: int = 256, levels: int = 4):
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.clock = clock
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self.now = 0
+        self._wheels = [[set() for _ in range(slots)] for _ in range(levels)]
+        self._spans = [slots ** level for level in range(levels + 1)]
+        self._loop = None
+
+    def __len__(self):
+        return sum(len(bucket) for wheel in self._wheels for bucket in wheel)
+
+    @property
+    def running(self) -> bool:
+        return self._loop is not None and self._loop.running
+
+    def start(self):
+        if self.running:
+            return
+        self._loop = task.LoopingCall.withCount(self.advance)
+        self._loop.clock = self.clock
+        self._loop.start(self.tick, now=False)
+
+    def stop(self):
+        if self.running:
+            self._loop.stop()
+        self._loop = None
+
+    def call_later(self, delay: float, func, *args, **kwargs) -> Timer:
+        """
+        Schedule `func(*args, **kwargs)` after `delay` seconds.
+        Precision is one tick.
+
+        :rtype: Timer
+        """
+        ticks = max(1, int(-(-delay // self.tick)))
+        timer = Timer(self.now + ticks, func, args, kwargs)
+        self._insert(timer)
+        return timer
+
+    def _insert(self, timer: Timer):
+        diff = timer.expire - self.now
+        level = 0
+        while level < self.levels - 1 and diff >= self._spans[level + 1]:
+            level += 1
+        bucket = self._wheels[level][(timer.expire // self._spans[level]) % self.slots]
+        bucket.add(timer)
+        timer.bucket = bucket
+
+    def _cascade(self, level: int):
+        bucket = self._wheels[level][(self.now // self._spans[level]) % self.slots]
+        timers = list(bucket)
+        bucket.clear()
+        for timer in timers:
+            self._insert(timer)
+
+    def advance(self, ticks: int = 1):
+        """
+        Move the wheel `ticks` ticks forward, firing expired timers
+        """
+        for _ in range(ticks):
+            self.now += 1
+            level = 1
+            while level < self.levels and self.now % self._spans[level] == 0:
+                level += 1
+            for upper in range(level - 1, 0, -1):
+                self._cascade(upper)
+
+            bucket = self._wheels[0][self.now % self.slots]
+            if not bucket:
+                continue
+            expired = [timer for timer in bucket if timer.expire <= self.now]
+            for timer in expired:
+                timer.cancel()
+            for timer in expired:
+                try:
+                    timer.func(*timer.args, **timer.kwargs)
+                except Exception as _:
+                    log.exception('Exception in timer callback.')
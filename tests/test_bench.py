@@ -0,0 +1,74 @@
+import unittest
+from twisted.internet import task, defer
+
+from hodl_net.bench import LoadClient, merge, parse_mix
+
+
+class FakeProtocol:
+    name = 'client'
+
+    def __init__(self, clock, delay, stall=0.):
+        self.clock = clock
+        self.delay = delay
+        self.stall = stall
+        self.pending = {}
+
+    def _expect(self, callback):
+        d = self.pending[callback] = defer.Deferred()
+        return d
+
+    def _watch(self, addr, callback):
+        pass
+
+    def _send(self, wrapper, addr):
+        d = self.pending.pop(wrapper.message.callback)
+        # Node is stalled till `stall`, then answers everything after `delay`
+        at = max(self.clock.seconds(), self.stall) + self.delay
+        self.clock.callLater(at - self.clock.seconds(), d.callback, wrapper.message)
+
+
+class FakeServer:
+    def __init__(self, stall=0.):
+        self.reactor = task.Clock()
+        self.udp = FakeProtocol(self.reactor, 0.05, stall)
+
+
+def load(server, **kwargs):
+    client = LoadClient(server, '127.0.0.1:8000', rate=10, duration=1, mix={'request': 1}, **kwargs)
+    d = client.load()
+    server.reactor.pump([0.01] * 1000)
+    return d.result
+
+
+class BenchTest(unittest.TestCase):
+    def test_open_loop(self):
+        result = load(FakeServer())
+        stats = result['kinds']['request']
+        self.assertEqual((stats['sent'], stats['ok'], stats['dropped']), (10, 10, 0))
+        self.assertAlmostEqual(merge([result])['request']['p50'], 0.05, delta=0.005)
+
+    def test_stall_is_latency(self):
+        report = merge([load(FakeServer(stall=0.5))])['request']
+        self.assertEqual(report['sent'], 10)
+        # First message was due at 0 and answered at 0.55
+        self.assertAlmostEqual(report['max'], 0.55, delta=0.01)
+        self.assertAlmostEqual(report['p90'], 0.45, delta=0.03)
+
+    def test_timeout_is_drop(self):
+        report = merge([load(FakeServer(stall=10), timeout=1)])['request']
+        self.assertEqual((report['ok'], report['dropped'], report['drop_rate']), (0, 10, 1.))
+
+    def test_merge(self):
+        results = [load(FakeServer()), load(FakeServer(stall=0.5))]
+        report = merge(results)['request']
+        self.assertEqual(report['sent'], 20)
+        self.assertAlmostEqual(report['max'], 0.55, delta=0.01)
+
+    def test_mix(self):
+        self.assertEqual(parse_mix(['request=8', 'shout']), {'request': 8., 'shout': 1.})
+        with self.assertRaises(Exception):
+            parse_mix(['ping=1'])
+
+
+if __name__ == '__main__':
+    unittest.main()
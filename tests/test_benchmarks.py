@@ -0,0 +1,31 @@
+import unittest
+import subprocess
+import sys
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SMOKE = '''
+import micro
+for key, func, param in micro.cases(quick=True):
+    if param in (None, 64, 1000):
+        case = func(param)
+        if case.setup:
+            case.setup()
+        case.run()
+        print(key)
+'''
+
+
+class BenchmarkTest(unittest.TestCase):
+    def test_cases_run(self):
+        out = subprocess.run([sys.executable, '-c', SMOKE], cwd=os.path.join(ROOT, 'benchmarks'),
+                             stdout=subprocess.PIPE, universal_newlines=True, check=True).stdout.split()
+        self.assertIn('wrapper_from_bytes[64]', out)
+        self.assertIn('tempdict_expire[1000]', out)
+        self.assertIn('handle_datagram', out)
+        self.assertIn('dispatch', out)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+import unittest
+import tempfile
+import os
+from twisted.internet import defer, task
+
+from hodl_net.utils import TimerWheel
+from hodl_net.discovery import snapshot
+from hodl_net.discovery.bootstrap import Bootstrap, DiscoverySource, StaticSource
+
+
+class FakeProtocol:
+    """
+    Peers in `alive` answer ping after `rtt`
+    """
+
+    def __init__(self, clock, alive, rtt=0.05):
+        self.clock = clock
+        self.alive = set(alive)
+        self.rtt = rtt
+        self.stored = []
+        self.pings = 0
+        self.inflight = 0
+        self.max_inflight = 0
+        self._waiting = {}
+        self.server = type('S', (), {'ppx': None})
+
+    def add_peers(self, addrs, method=None):
+        addrs = list(addrs)
+        self.stored += addrs
+        return addrs
+
+    def _expect(self, callback):
+        d = self._waiting[callback] = defer.Deferred()
+        return d
+
+    def _watch(self, addr, callback):
+        pass
+
+    def _send(self, wrapper, addr):
+        self.pings += 1
+        self.inflight += 1
+        self.max_inflight = max(self.max_inflight, self.inflight)
+        self.clock.callLater(self.rtt, self._answer, wrapper.message.callback, addr)
+
+    def _answer(self, callback, addr):
+        self.inflight -= 1
+        if addr in self.alive:
+            self._waiting.pop(callback).callback(None)
+
+
+class ListSource(DiscoverySource):
+    def __init__(self, name, addrs, delay=None, clock=None):
+        self.name = name
+        self.addrs = addrs
+        self.delay = delay
+        self.clock = clock
+        self.answered = []
+
+    def start(self, found):
+        if self.delay is None:
+            found(self.addrs)
+            return
+        return task.deferLater(self.clock, self.delay, found, self.addrs)
+
+    def connected(self, addr):
+        self.answered.append(addr)
+
+
+class Resolver:
+    def resolve(self, name):
+        if name == 'seed.example':
+            return defer.succeed('8.8.8.8')
+        if name == 'bad.example':
+            return defer.fail(OSError('no such host'))
+        return defer.succeed(name)
+
+
+class SnapshotTest(unittest.TestCase):
+    def test_roundtrip(self):
+        peers = ['1.2.3.4:8000', '[2001:db8::1]:9000', 'host.example:8000']
+        users = [('alice', 'KEY' * 100), ('боб', 'key')]
+        data = snapshot.dump(peers, users, now=100.)
+        self.assertEqual(snapshot.load(data),
+                         snapshot.Snapshot(100., ['1.2.3.4:8000', '2001:db8::1:9000'], users))
+        self.assertIsNone(snapshot.load(data[:-1]))
+        self.assertIsNone(snapshot.load(data[:10] + b'x' + data[11:]))
+        self.assertIsNone(snapshot.load(b''))
+
+    def test_file(self):
+        path = os.path.join(tempfile.mkdtemp(), 'node_peers.snapshot')
+        self.assertIsNone(snapshot.read(path))
+        snapshot.write(path, snapshot.dump(['1.2.3.4:8000'], []))
+        with open(path, 'ab') as f:
+            f.write(b'torn')
+        self.assertIsNone(snapshot.read(path))
+        snapshot.write(path, snapshot.dump(['1.2.3.4:8000'], []))
+        self.assertEqual(snapshot.read(path).peers, ['1.2.3.4:8000'])
+        self.assertEqual(os.listdir(os.path.dirname(path)), ['node_peers.snapshot'])
+
+
+class BootstrapTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.wheel = TimerWheel(self.clock, tick=0.01)
+        self.wheel.start()
+
+    def test_target(self):
+        dead = [f'10.0.0.{i}:8000' for i in range(100)]
+        alive = [f'10.0.1.{i}:8000' for i in range(20)]
+        proto = FakeProtocol(self.clock, alive)
+        bootstrap = Bootstrap(proto, self.wheel, target=8, timeout=10, concurrency=16, ping_timeout=1)
+        snapshot_source = ListSource('snapshot', alive[:10] + dead[:10])
+        bootstrap.register(snapshot_source)
+        bootstrap.register(ListSource('db', dead))
+        bootstrap.register(ListSource('static', alive[10:], delay=0.02, clock=self.clock))
+        ready = []
+        bootstrap.start().addCallback(ready.append)
+
+        self.clock.pump([0.01] * 20)
+        self.assertEqual(ready, [8])
+        self.assertLessEqual(proto.max_inflight, 16)
+        self.assertEqual(len(proto.stored), len(set(proto.stored)))
+        self.assertEqual(len(snapshot_source.answered), bootstrap.connected)
+
+    def test_exhausted(self):
+        proto = FakeProtocol(self.clock, ['10.0.1.1:8000'])
+        bootstrap = Bootstrap(proto, self.wheel, target=8, timeout=10, ping_timeout=1)
+        bootstrap.register(ListSource('db', ['10.0.1.1:8000', '10.0.0.1:8000']))
+        bootstrap.register(StaticSource(['seed.example:49390', 'bad.example:1'], Resolver()))
+        ready = []
+        bootstrap.start().addCallback(ready.append)
+        self.assertIn('8.8.8.8:49390', proto.stored)
+        self.clock.pump([0.1] * 15)
+        self.assertEqual(ready, [1])
+
+    def test_timeout(self):
+        proto = FakeProtocol(self.clock, [])
+        bootstrap = Bootstrap(proto, self.wheel, target=1, timeout=3)
+        bootstrap.register(ListSource('slow', [], delay=100, clock=self.clock))
+        ready = []
+        bootstrap.start().addCallback(ready.append)
+        self.clock.pump([0.5] * 5)
+        self.assertEqual(ready, [])
+        self.clock.pump([0.5] * 2)
+        self.assertEqual(ready, [0])
+
+
+if __name__ == '__main__':
+    unittest.main()
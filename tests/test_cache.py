@@ -0,0 +1,162 @@
+import unittest
+import tempfile
+import os
+from unittest import mock
+
+from hodl_net.cache import ResponseCache
+from hodl_net.database import DBWorker, Base, db_worker
+from hodl_net.models import Message, MessageWrapper, Peer
+from hodl_net.server import Server
+
+
+class FakeProtocol:
+    def __init__(self):
+        self.sent = []
+
+    def _write(self, data, addr, _type):
+        self.sent.append((MessageWrapper.from_bytes(data), addr))
+
+
+class FakePeer:
+    def __init__(self, addr):
+        self.addr = addr
+        self.proto = FakeProtocol()
+
+
+class ResponseCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.calls = 0
+
+    async def handler(self, message):
+        self.calls += 1
+        return Message('answer', {'echo': message.data, 'calls': self.calls})
+
+    def test_burst(self):
+        cache = ResponseCache(30)
+        peers = [FakePeer(f'10.0.0.{i}:8000') for i in range(5)]
+        requests = [Message('ask', {'x': 1}) for _ in peers]
+        for request, _peer in zip(requests, peers):
+            cache.respond(self.handler, request, _peer)
+        self.assertEqual(self.calls, 1)
+
+        ids = set()
+        for request, _peer in zip(requests, peers):
+            (wrapper, addr), = _peer.proto.sent
+            self.assertEqual(addr, _peer.addr)
+            self.assertEqual(wrapper.type, 'request')
+            self.assertEqual(wrapper.message.name, 'answer')
+            self.assertEqual(wrapper.message.data, {'echo': {'x': 1}, 'calls': 1})
+            self.assertEqual(wrapper.message.callback, request.callback)
+            ids.add(wrapper.id)
+        self.assertEqual(len(ids), len(peers))
+
+        cache.respond(self.handler, Message('ask', {'x': 2}), peers[0])
+        self.assertEqual(self.calls, 2)
+
+    def test_no_reply(self):
+        cache = ResponseCache(30, reply=False)
+        _peer = FakePeer('10.0.0.1:8000')
+        request = Message('ask')
+        cache.respond(self.handler, request, _peer)
+        cache.respond(self.handler, request, _peer)
+        callbacks = {wrapper.message.callback for wrapper, _ in _peer.proto.sent}
+        self.assertEqual(len(callbacks), 2)
+        self.assertNotIn(request.callback, callbacks)
+
+    def test_ttl(self):
+        cache = ResponseCache(30)
+        _peer = FakePeer('10.0.0.1:8000')
+        with mock.patch('hodl_net.cache.time.monotonic', return_value=100.):
+            cache.respond(self.handler, Message('ask'), _peer)
+        with mock.patch('hodl_net.cache.time.monotonic', return_value=129.):
+            cache.respond(self.handler, Message('ask'), _peer)
+        self.assertEqual(self.calls, 1)
+        with mock.patch('hodl_net.cache.time.monotonic', return_value=131.):
+            cache.respond(self.handler, Message('ask'), _peer)
+        self.assertEqual(self.calls, 2)
+
+    def test_invalidate(self):
+        worker = DBWorker()
+        path = os.path.join(tempfile.mkdtemp(), 'cache.sqlite')
+        worker.create_connection(path)
+        Base.metadata.create_all(worker.engine)
+        cache = ResponseCache(30, tables=['peers'])
+        worker.on_change(cache.invalidate)
+        _peer = FakePeer('10.0.0.1:8000')
+
+        cache.respond(self.handler, Message('ask'), _peer)
+        ses = worker.get_session()
+        ses.add(Peer(None, addr='10.0.0.2:8000'))
+        ses.rollback()
+        cache.respond(self.handler, Message('ask'), _peer)
+        self.assertEqual(self.calls, 1)
+
+        ses.add(Peer(None, addr='10.0.0.2:8000'))
+        ses.commit()
+        cache.respond(self.handler, Message('ask'), _peer)
+        self.assertEqual(self.calls, 2)
+
+        ses.query(Peer).all()
+        ses.commit()
+        cache.respond(self.handler, Message('ask'), _peer)
+        self.assertEqual(self.calls, 2)
+        # Known peer is ignored by INSERT OR IGNORE, nothing changed
+        worker.storage.add_peers(['10.0.0.2:8000'])
+        cache.respond(self.handler, Message('ask'), _peer)
+        self.assertEqual(self.calls, 2)
+        worker.storage.add_peers(['10.0.0.3:8000'])
+        cache.respond(self.handler, Message('ask'), _peer)
+        self.assertEqual(self.calls, 3)
+        ses.close()
+        worker.engine.dispose()
+        os.remove(path)
+
+    def test_joins(self):
+        cache = ResponseCache(30, tables=['peers'], refresh=5)
+        _peer = FakePeer('10.0.0.1:8000')
+
+        def respond_at(now):
+            with mock.patch('hodl_net.cache.time.monotonic', return_value=now):
+                cache.respond(self.handler, Message('ask'), _peer)
+                return self.calls
+
+        respond_at(100.)
+        # Every join adds a peer
+        for _ in range(10):
+            cache.invalidate('peers')
+        self.assertEqual(respond_at(104.), 1)
+        self.assertEqual(respond_at(106.), 2)
+        cache.invalidate('users')
+        cache.invalidate('peers')
+        self.assertEqual(respond_at(110.), 2)
+        self.assertEqual(respond_at(112.), 3)
+        self.assertEqual(respond_at(130.), 3)
+
+    def test_server(self):
+        class MemoryTransport:
+            def __init__(self):
+                self.written = []
+
+            def write(self, data, addr):
+                self.written.append(addr)
+
+        db_worker.create_connection(None, 'log')
+        server = Server()
+        server.udp.transport = MemoryTransport()
+        server.handle('ask', 'request', in_thread=False, cache=ResponseCache(30))(self.handler)
+
+        data = MessageWrapper(Message('ask', {'x': 1}), 'request').to_json().encode()
+        for _ in range(3):
+            server.udp.handle_datagram(data, ('10.0.0.1', 8000))
+        self.assertEqual(self.calls, 1)
+
+        handed = []
+        with mock.patch('hodl_net.server.in_reactor_thread', return_value=False), \
+                mock.patch('hodl_net.server.call_from_thread', lambda f, *args: handed.append(f.__name__)):
+            ResponseCache(30).respond(self.handler, Message('ask'), Peer(server.udp, addr='10.0.0.2:8000'))
+        self.assertEqual(handed, ['_write'])
+        self.assertNotIn(('10.0.0.2', 8000), server.udp.transport.written)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+import unittest
+import copy
+from unittest import mock
+from twisted.internet import task
+
+from hodl_net.congestion import Congestion
+from hodl_net.config_loader import default_conf
+from hodl_net.database import db_worker
+from hodl_net.models import Message, MessageWrapper, Peer
+from hodl_net.server import Server
+from hodl_net.utils import TimerWheel
+
+
+class CongestionTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.wheel = TimerWheel(self.clock, tick=0.01)
+        self.wheel.start()
+        self.written = []
+        self.congestion = Congestion(self.wheel, lambda data, addr, _type: self.written.append(data),
+                                     initial=4, min_window=2, max_window=8, rtt=0.1, queue_size=3)
+
+    def test_window(self):
+        c = self.congestion
+        for i in range(7):
+            self.assertTrue(c.send('peer', i, None, 'request'))
+        self.assertFalse(c.send('peer', 7, None, 'request'))
+        self.assertEqual(self.written, [0, 1, 2, 3])
+        self.assertFalse(c.is_open('peer'))
+        self.assertTrue(c.is_open('other'))
+        self.assertEqual((c.backlog(), c.overflowed), (3, 1))
+
+        # Ack frees a slot and grows window, others leave flight after two round trips
+        c.ack('peer')
+        self.assertEqual(self.written, [0, 1, 2, 3, 4, 5])
+        self.clock.pump([0.01] * 25)
+        self.assertEqual(self.written, list(range(7)))
+        self.assertEqual(c.backlog(), 0)
+
+    def test_aimd(self):
+        c = self.congestion
+        c.send('peer', 0, None, 'request')
+        for _ in range(8):
+            c.ack('peer')
+        cwnd = c.windows['peer'].cwnd
+        self.assertTrue(5.5 < cwnd < 6)
+
+        # Window is halved once per round trip
+        c.loss('peer')
+        c.loss('peer')
+        self.assertEqual(c.windows['peer'].cwnd, cwnd / 2)
+        self.clock.advance(0.2)
+        c.loss('peer')
+        self.assertEqual(c.windows['peer'].cwnd, 2)
+        for _ in range(100):
+            c.ack('peer')
+        self.assertEqual(c.windows['peer'].cwnd, 8)
+
+    def test_rtt(self):
+        c = self.congestion
+        c.send('peer', 0, None, 'request')
+        for _ in range(50):
+            c.sample('peer', 0.4)
+        self.assertAlmostEqual(c.flight(c.windows['peer']), 0.8, places=2)
+
+    def test_idle(self):
+        c = Congestion(self.wheel, lambda *args: None, max_peers=10)
+        for i in range(30):
+            c.send(f'peer{i}', b'', None, 'request')
+            self.clock.advance(1)
+        self.assertLessEqual(len(c.windows), 10)
+        c.forget('peer29')
+        self.assertNotIn('peer29', c.windows)
+
+        self.wheel.stop()
+        c = Congestion(self.wheel, lambda data, addr, _type: self.written.append(data), initial=1)
+        for i in range(5):
+            c.send('peer', i, None, 'request')
+        self.assertEqual(self.written, list(range(5)))
+
+
+class ServerTest(unittest.TestCase):
+    def setUp(self):
+        class MemoryTransport:
+            def __init__(self):
+                self.written = []
+
+            def write(self, data, addr):
+                self.written.append((data, addr))
+
+        db_worker.create_connection(None, 'log')
+        # Known peer, so it gets no discovery requests
+        db_worker.storage.add_peers(['1.1.1.1:8000'])
+        conf = copy.deepcopy(default_conf())
+        conf['deadpeer']['enabled'] = False
+        self.clock = task.Clock()
+        self.server = Server(conf=conf, wheel=TimerWheel(self.clock, tick=0.1))
+        self.server.wheel.start()
+        self.server.udp.transport = MemoryTransport()
+
+    def test_request_timeout(self):
+        ping = Message('ping')
+        Peer(self.server.udp, addr='1.1.1.1:8000').request(ping, watch=True)
+        Peer(self.server.udp, addr='2.2.2.2:8000').request(Message('ping'), watch=True)
+        # Responses expect no answer, so they aren't watched
+        Peer(self.server.udp, addr='3.3.3.3:8000').response(Message('ping'), Message('pong'))
+        windows = self.server.congestion.windows
+        initial = windows['1.1.1.1:8000'].cwnd
+
+        pong = Message('pong')
+        pong.callback = ping.callback
+        self.server.udp.handle_datagram(MessageWrapper(pong, 'request').to_json().encode(), ('1.1.1.1', 8000))
+        self.clock.pump([0.1] * 25)
+        self.assertGreater(windows['1.1.1.1:8000'].cwnd, initial)
+        self.assertLess(windows['2.2.2.2:8000'].cwnd, initial)
+        self.assertEqual(windows['3.3.3.3:8000'].cwnd, initial)
+
+    def test_send_all_unwatched(self):
+        # Nobody answers broadcasts on their callback, silence isn't loss
+        self.server.udp.send_all(Message('new_user'))
+        self.clock.pump([0.1] * 25)
+        windows = self.server.congestion.windows
+        self.assertIn('1.1.1.1:8000', windows)
+        self.assertEqual(windows['1.1.1.1:8000'].cwnd, self.server.congestion.initial)
+
+    def test_off_reactor_thread(self):
+        handed = []
+        with mock.patch('hodl_net.server.in_reactor_thread', return_value=False), \
+                mock.patch('hodl_net.server.call_from_thread', lambda f, *args: handed.append(f.__name__)):
+            self.assertTrue(self.server.udp._write(b'{}', '1.1.1.1:8000', 'request'))
+            self.server.udp.random_send(MessageWrapper(Message('ping'), 'message'))
+        self.assertEqual(handed, ['_write', 'random_send'])
+        self.assertEqual(self.server.udp.transport.written, [])
+        self.assertEqual(self.server.congestion.windows, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
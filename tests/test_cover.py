@@ -0,0 +1,105 @@
+import unittest
+import json
+import uuid
+from twisted.internet import task
+
+from hodl_net.cover import Cover, cover_datagram
+from hodl_net.database import db_worker
+from hodl_net.server import Server
+from hodl_net.models import Message, MessageWrapper
+from hodl_net.utils import TimerWheel
+
+
+class CoverTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.wheel = TimerWheel(self.clock, tick=0.01)
+        self.wheel.start()
+        self.sent = []
+        self.peers = ['1.1.1.1:8000', '2.2.2.2:8000']
+        self.cover = Cover(self.wheel, lambda: self.peers, self.emit, rate=10, size=512, queue_size=2)
+
+    def emit(self, key, data, addr, _type):
+        self.sent.append((key, data, addr, _type))
+        return True
+
+    def test_datagram(self):
+        data = cover_datagram(512)
+        self.assertEqual(len(data), 512)
+        wrapper = MessageWrapper.from_bytes(data)
+        self.assertEqual((wrapper.type, wrapper.ttl, wrapper.message.name), ('tunnel', 0, 'keepalive'))
+
+        # Same layout and size as real last-hop keepalive, fresh random fields
+        real = MessageWrapper(Message('keepalive'), 'tunnel', tunnel_id=str(uuid.uuid4()), ttl=0)
+        real = self.cover.pad(real.to_json().encode())
+        self.assertEqual(len(real), len(data))
+        self.assertEqual(self.layout(real), self.layout(data))
+        other = MessageWrapper.from_bytes(cover_datagram(512))
+        for field in ('id', 'tunnel_id'):
+            self.assertNotEqual(getattr(other, field), getattr(wrapper, field))
+        self.assertNotEqual(other.message.callback, wrapper.message.callback)
+        self.assertEqual(MessageWrapper.from_bytes(cover_datagram(10)).type, 'tunnel')
+
+        real = MessageWrapper(Message('hi', {'a': 1}), 'tunnel', tunnel_id='t').to_json().encode()
+        padded = self.cover.pad(real)
+        self.assertEqual(len(padded), 512)
+        self.assertEqual(MessageWrapper.from_bytes(padded).message.data, {'a': 1})
+        self.assertEqual(self.cover.pad(b'x' * 600), b'x' * 600)
+
+    @staticmethod
+    def layout(data: bytes):
+        """
+        Keys, lengths of values and positions of fields
+        """
+        def shape(value):
+            if isinstance(value, dict):
+                return [(key, shape(item)) for key, item in value.items()]
+            return len(json.dumps(value))
+        return shape(json.loads(data)), data.index(b'"ttl"'), len(data.rstrip())
+
+    def test_slots(self):
+        self.cover.start()
+        self.cover.put('1.1.1.1:8000', b'{}', ('1.1.1.1', 8000), 'message')
+        self.cover.put('3.3.3.3:8000', b'{}', ('3.3.3.3', 8000), 'shout')
+        self.assertEqual(self.sent, [])
+
+        self.clock.pump([0.05] * 3)
+        self.assertEqual(len(self.sent), 3)
+        self.assertTrue(all(len(data) == 512 for _, data, _, _ in self.sent))
+        kinds = {key: _type for key, _, _, _type in self.sent}
+        self.assertEqual(kinds, {'1.1.1.1:8000': 'message', '2.2.2.2:8000': 'cover', '3.3.3.3:8000': 'shout'})
+        self.assertIn(('2.2.2.2:8000', ('2.2.2.2', 8000)), [(key, addr) for key, _, addr, _ in self.sent])
+
+        # Bandwidth stays flat: one datagram per peer per slot
+        self.sent.clear()
+        self.clock.pump([0.05] * 2)
+        self.assertEqual(sorted(key for key, _, _, _ in self.sent), self.peers)
+        self.assertEqual({_type for _, _, _, _type in self.sent}, {'cover'})
+        self.assertEqual((self.cover.real, self.cover.cover), (2, 3))
+        self.assertAlmostEqual(self.cover.ratio(), 0.4)
+
+    def test_overflow(self):
+        for i in range(3):
+            self.cover.put('1.1.1.1:8000', b'{}', ('1.1.1.1', 8000), 'message')
+        self.assertEqual(len(self.sent), 1)
+        self.assertEqual(len(self.cover.queues['1.1.1.1:8000']), 2)
+        self.cover.stop()
+
+    def test_receiver_drops(self):
+        class MemoryTransport:
+            def __init__(self):
+                self.written = []
+
+            def write(self, data, addr):
+                self.written.append(MessageWrapper.from_bytes(data).type)
+
+        db_worker.create_connection(None, 'log')
+        db_worker.storage.add_peers(['1.1.1.1:8000', '2.2.2.2:8000'])
+        server = Server()
+        server.udp.transport = MemoryTransport()
+        server.udp.handle_datagram(cover_datagram(512), ('1.1.1.1', 8000))
+        self.assertNotIn('tunnel', server.udp.transport.written)
+
+
+if __name__ == '__main__':
+    unittest.main()
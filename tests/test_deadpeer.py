@@ -0,0 +1,105 @@
+import unittest
+from twisted.internet import task, defer
+
+from hodl_net.utils import TimerWheel
+from hodl_net.discovery.deadpeer import DeadPeerDetector, PhiAccrual
+from hodl_net.models import Message, MessageWrapper
+from hodl_net.database import db_worker
+from hodl_net.server import Server
+
+
+class FakeProtocol:
+    def __init__(self, addrs):
+        self.addrs = set(addrs)
+        self.sent = []
+        self.removed = []
+
+    @property
+    def peers(self):
+        return [type('P', (), {'addr': addr}) for addr in self.addrs]
+
+    def _expect(self, callback):
+        return defer.Deferred()
+
+    def _send(self, wrapper, addr):
+        self.sent.append((wrapper.message.name, addr))
+
+    def remove_peer(self, addr):
+        self.removed.append(addr)
+        self.addrs.discard(addr)
+
+
+class TimerWheelTest(unittest.TestCase):
+    def test_fire_order(self):
+        clock = task.Clock()
+        wheel = TimerWheel(clock, tick=0.1, slots=8, levels=3)
+        fired = []
+        for delay in [0.1, 0.5, 1.7, 6.3, 30, 100]:
+            wheel.call_later(delay, fired.append, delay)
+        cancelled = wheel.call_later(2, fired.append, 'cancelled')
+        cancelled.cancel()
+        wheel.start()
+        for _ in range(1100):
+            clock.advance(0.1)
+            for delay in fired:
+                self.assertLessEqual(delay, wheel.now * wheel.tick + 1e-9)
+        self.assertEqual(fired, [0.1, 0.5, 1.7, 6.3, 30, 100])
+        self.assertEqual(len(wheel), 0)
+
+
+class DeadPeerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.wheel = TimerWheel(self.clock, tick=0.1)
+        self.proto = FakeProtocol(['1.1.1.1:8000', '2.2.2.2:8000', '3.3.3.3:8000'])
+        self.detector = DeadPeerDetector(self.proto, self.wheel, interval=1, max_interval=8,
+                                         timeout=0.5, indirect_probes=2, phi_threshold=3)
+        self.detector.start()
+
+    def run_for(self, seconds, alive=()):
+        for _ in range(int(seconds * 10)):
+            for addr in alive:
+                self.detector.heard_from(addr)
+            self.clock.advance(0.1)
+
+    def test_silent_peer_evicted(self):
+        alive = ['1.1.1.1:8000', '2.2.2.2:8000']
+        self.run_for(30, alive)
+        self.assertEqual(self.proto.removed, ['3.3.3.3:8000'])
+        self.assertNotIn('3.3.3.3:8000', self.detector)
+        self.assertIn(('ping_req', '1.1.1.1:8000'), self.proto.sent)
+
+    def test_busy_peers_not_probed(self):
+        self.run_for(10, list(self.proto.addrs))
+        self.assertEqual(self.proto.sent, [])
+        self.assertEqual(self.proto.removed, [])
+
+    def test_phi_grows_with_silence(self):
+        detector = PhiAccrual(0, 1)
+        for now in range(1, 10):
+            detector.heartbeat(now)
+        self.assertLess(detector.phi(10), detector.phi(20))
+
+
+class ServerTest(unittest.TestCase):
+    def test_sender_tracked(self):
+        class MemoryTransport:
+            def write(self, data, addr):
+                pass
+
+        db_worker.create_connection(None, 'log')
+        server = Server(wheel=TimerWheel(task.Clock(), tick=0.1))
+        server.udp.transport = MemoryTransport()
+
+        @server.handle('noop', 'request', in_thread=False)
+        async def noop(_):
+            pass
+
+        self.assertEqual(len(server.deadpeer), 0)
+        data = MessageWrapper(Message('noop'), 'request').to_json().encode()
+        server.udp.handle_datagram(data, ('1.1.1.1', 8000))
+        self.assertIn('1.1.1.1:8000', server.deadpeer)
+
+
+if __name__ == '__main__':
+    unittest.main()
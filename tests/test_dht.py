@@ -0,0 +1,139 @@
+import unittest
+from unittest import mock
+from twisted.internet import task, defer
+
+from hodl_net.utils import TimerWheel
+from hodl_net.dht import DHT, RoutingTable, Contact, ValueStore, digest, user_record
+from hodl_net.cryptogr import gen_keys
+from hodl_net.models import Message
+
+
+# Fake keys are equal strings, signature is key with signed text
+
+
+def _sign(plaintext, private_key):
+    return f'{private_key}\n{plaintext}'
+
+
+def _verify(plaintext, s, public_key):
+    return s == f'{public_key}\n{plaintext}'
+
+
+class FakeServer:
+    deadpeer = None
+
+
+class FakeProtocol:
+    server = FakeServer()
+
+    def __init__(self, network, addr):
+        self.network = network
+        self.addr = addr
+        self.name = addr
+        self.public_key = self.private_key = f'key of {addr}'
+        self.requests = 0
+        self.pending = {}
+
+    @property
+    def peers(self):
+        return []
+
+    def _expect(self, callback):
+        d = self.pending[callback] = defer.Deferred()
+        return d
+
+    def _watch(self, addr, callback):
+        pass
+
+    def _send(self, wrapper, addr):
+        self.requests += 1
+        d = self.pending.pop(wrapper.message.callback)
+        target = self.network.get(addr)
+        if target:
+            d.callback(target.handle(wrapper.message, self.addr))
+
+
+class DHTTest(unittest.TestCase):
+    nodes_count = 200
+
+    @classmethod
+    def setUpClass(cls):
+        cls.crypto = mock.patch.multiple('hodl_net.dht', sign=_sign, verify=_verify)
+        cls.crypto.start()
+        cls.network = {}
+        wheel = TimerWheel(task.Clock())
+        for i in range(cls.nodes_count):
+            addr = f'10.0.{i // 256}.{i % 256}:8000'
+            node = DHT(FakeProtocol(cls.network, addr), wheel, k=8, alpha=3)
+            cls.network[addr] = node
+            seeds = [addr] if not i else list(cls.network)[:1]
+            node.start(seeds)
+        for node in cls.network.values():
+            defer.ensureDeferred(node.republish())
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.crypto.stop()
+
+    def test_routing_table_size(self):
+        for node in self.network.values():
+            self.assertLess(len(node.table), self.nodes_count // 2)
+
+    def test_find_user(self):
+        for node in list(self.network.values())[::17]:
+            for target in list(self.network)[::23]:
+                record = defer.ensureDeferred(node.find_user(target)).result
+                self.assertEqual((record['name'], record['key']), (target, f'key of {target}'))
+
+    def test_storage_is_partial(self):
+        stored = [len(node.storage) for node in self.network.values()]
+        self.assertLess(max(stored), self.nodes_count // 4)
+
+    def test_unknown_user(self):
+        node = next(iter(self.network.values()))
+        self.assertIsNone(defer.ensureDeferred(node.find_user('nobody')).result)
+
+    def test_bucket_replacement(self):
+        table = RoutingTable(0, k=2)
+        contacts = [Contact(2 ** 255 + i, f'addr{i}') for i in range(3)]
+        for contact in contacts:
+            table.add(contact)
+        self.assertEqual(len(table), 2)
+        table.add(Contact(digest('x') | 2 ** 255, 'addr3'), is_dead=lambda addr: addr == 'addr0')
+        self.assertNotIn('addr0', table.addrs)
+        self.assertIn('addr3', table.addrs)
+
+
+class RecordTest(unittest.TestCase):
+    def setUp(self):
+        self.node = DHT(FakeProtocol({}, '10.0.0.1:8000'), TimerWheel(task.Clock()))
+        self.node.table = RoutingTable(digest('10.0.0.1:8000'), 20)
+
+    def store(self, key, value):
+        return self.node.handle(Message('dht_store', {'key': format(key, 'x'), 'value': value}), 'attacker').name
+
+    def test_forged_record(self):
+        private_key, public_key = gen_keys()
+        other_private_key, other_public_key = gen_keys()
+        key = digest('alice')
+
+        forged = dict(user_record('alice', public_key, private_key), key=other_public_key)
+        self.assertEqual(self.store(key, forged), 'dht_refused')
+        self.assertEqual(self.store(key, user_record('bob', public_key, private_key)), 'dht_refused')
+        self.assertEqual(self.store(key, {'name': 'alice', 'key': public_key}), 'dht_refused')
+
+        self.assertEqual(self.store(key, user_record('alice', public_key, private_key)), 'dht_stored')
+        self.assertEqual(self.store(key, user_record('alice', other_public_key, other_private_key)), 'dht_refused')
+        self.assertEqual(self.node.get(key)['key'], public_key)
+        self.assertEqual(self.store(key, user_record('alice', public_key, private_key)), 'dht_stored')
+
+    def test_store_limit(self):
+        store = ValueStore(60, max_records=3)
+        for i in range(5):
+            store[i] = i
+        store[2] = 'again'
+        self.assertEqual(list(store), [3, 4, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+import itertools
+import random
+
+from hodl_net.erasure import encode, decode, split, Reassembly
+from hodl_net.models import Message, MessageWrapper
+from hodl_net.server import user
+from hodl_net.sim import Simulation, Link, sim_conf, fast_crypto
+
+
+class ErasureTest(unittest.TestCase):
+    def test_codec(self):
+        data = bytes(random.Random(1).getrandbits(8) for _ in range(1001))
+        shards = encode(data, 4, 3)
+        self.assertEqual(len(shards), 7)
+        self.assertEqual({len(shard) for shard in shards}, {251})
+        for indexes in itertools.combinations(range(7), 4):
+            self.assertEqual(decode({i: shards[i] for i in indexes}, 4, len(data)), data)
+        with self.assertRaises(ValueError):
+            decode({i: shards[i] for i in range(3)}, 4, len(data))
+
+    def test_reassembly(self):
+        wrapper = MessageWrapper('x' * 1000, sender='alice', sign='sign', id='message')
+        shards = split(wrapper, 3, 2)
+        wire = [MessageWrapper.from_bytes(shard.to_json().encode()) for shard in shards]
+        reassembly = Reassembly()
+        self.assertIsNone(reassembly.add(wire[4]))
+        self.assertIsNone(reassembly.add(wire[4]))
+        self.assertIsNone(reassembly.add(wire[1]))
+        rebuilt = reassembly.add(wire[3])
+        self.assertEqual((rebuilt.id, rebuilt.message, rebuilt.sender, rebuilt.sign),
+                         ('message', wrapper.message, 'alice', 'sign'))
+        self.assertEqual((len(reassembly), reassembly.size), (0, 0))
+
+    def test_bounds(self):
+        reassembly = Reassembly(max_groups=3, max_bytes=2000)
+        for i in range(5):
+            reassembly.add(split(MessageWrapper('x' * 900, sender='a', id=str(i)), 3, 1)[0])
+        self.assertEqual(len(reassembly), 3)
+        self.assertEqual(list(reassembly.groups), ['2', '3', '4'])
+        reassembly.add(split(MessageWrapper('x' * 6000, sender='a', id='big'), 3, 1)[0])
+        self.assertLessEqual(reassembly.size, 2000)
+        self.assertEqual(reassembly.dropped, 5)
+
+        reassembly.timeout = 0
+        reassembly.add(split(MessageWrapper('x' * 90, sender='a', id='new'), 3, 1)[0])
+        self.assertEqual(list(reassembly.groups), ['new'])
+
+    def test_lossy_hop(self):
+        conf = sim_conf()
+        conf['erasure'].update(enabled=True, min_size=0, k=3, m=2)
+        sim = Simulation(30, seed=4, conf=conf)
+        origin = sim.nodes[sim.addrs[0]]
+        target = sim.nodes[sim.addrs[15]]
+        received = []
+
+        @origin.server.handle('big', 'message', in_thread=False)
+        async def big(message):
+            received.append(message.data)
+            user.response(message, Message('ok'))
+
+        hops = [first_hop for _, first_hop, _ in origin.server.tunnel_pool.spread(5)]
+        self.assertEqual(len(set(hops)), 5)
+        for first_hop in hops[:2]:
+            sim.set_link(origin.addr, first_hop, Link(loss=1.))
+
+        responses = []
+        with fast_crypto():
+            origin.send(Message('big', {'pad': 'x' * 5000}), target.name).addCallback(responses.append)
+        sim.run()
+        self.assertEqual(received, [{'pad': 'x' * 5000}])
+        self.assertEqual(len(responses), 1)
+        self.assertEqual(len(target.server.reassembly), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import unittest
+import tempfile
+import logging
+import os
+from unittest import mock
+
+from hodl_net import flight
+from hodl_net.flight import FlightRecorder, FlightHandler
+from hodl_net.database import db_worker
+from hodl_net.models import Message, MessageWrapper
+from hodl_net.server import Server
+
+
+class Unprintable:
+    formatted = 0
+
+    def __repr__(self):
+        Unprintable.formatted += 1
+        return 'unprintable'
+
+
+class FlightRecorderTest(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'flight.log')
+
+    def test_ring_and_lazy_format(self):
+        recorder = FlightRecorder(size=10, path=self.path)
+        for i in range(100):
+            recorder.record('hodl_net.server', logging.DEBUG, 'event %d %r', i, Unprintable())
+        self.assertEqual(len(recorder), 10)
+        self.assertEqual(Unprintable.formatted, 0)
+
+        recorder.dump()
+        with open(self.path) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(len(lines), 11)
+        self.assertTrue(lines[1].endswith('event 90 unprintable'))
+
+    def test_levels_and_sampling(self):
+        recorder = FlightRecorder(levels={'hodl_net.discovery.lpd': logging.INFO},
+                                  sample={'hodl_net.server': 10})
+        for _ in range(100):
+            recorder.record('hodl_net.discovery.lpd', logging.DEBUG, 'dropped')
+            recorder.record('hodl_net.server', logging.DEBUG, 'sampled')
+        recorder.record('hodl_net.server', logging.WARNING, 'not sampled')
+        self.assertEqual(len(recorder), 11)
+
+    def test_dump_on_error(self):
+        recorder = FlightRecorder(path=self.path)
+        logger = logging.getLogger('hodl_net.test_flight')
+        logger.propagate = False
+        logger.addHandler(FlightHandler(recorder, dump_interval=60))
+        logger.warning('warning')
+        self.assertFalse(os.path.exists(self.path))
+        recorder.record('hodl_net.server', logging.DEBUG, 'before error')
+        logger.error('error')
+        with open(self.path) as f:
+            text = f.read()
+        self.assertIn('before error', text)
+        self.assertIn('ERROR', text)
+
+    def test_datagram_head(self):
+        class MemoryTransport:
+            def write(self, data, addr):
+                pass
+
+        db_worker.create_connection(None, 'log')
+        server = Server()
+        server.udp.transport = MemoryTransport()
+
+        @server.handle('padded', 'request', in_thread=False)
+        async def padded(_):
+            pass
+
+        datagram = MessageWrapper(Message('padded', {'pad': 'x' * 10000}), 'request').to_json().encode()
+        recorder = FlightRecorder()
+        with mock.patch.object(flight, 'recorder', recorder):
+            server.udp.handle_datagram(datagram, ('1.1.1.1', 8000))
+        args = [args for _, _, _, msg, args in recorder.events if msg.startswith('Datagram received')]
+        self.assertEqual(args, [('1.1.1.1:8000', len(datagram), datagram[:64])])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+
+from hodl_net.hedging import Hedging
+from hodl_net.models import Message
+from hodl_net.server import user
+from hodl_net.sim import Simulation, Link, fast_crypto
+from hodl_net import metrics
+
+
+class HedgingTest(unittest.TestCase):
+    def test_delay(self):
+        hedging = Hedging(quantile=0.9, default_delay=2, min_samples=5, samples=10)
+        for i in range(4):
+            hedging.record('bob', i / 10)
+        self.assertEqual(hedging.delay('bob'), 2)
+        self.assertEqual(hedging.delay('alice'), 2)
+        for i in range(4, 30):
+            hedging.record('bob', i / 10)
+        self.assertEqual(len(hedging.latency.get('bob')), 10)
+        self.assertAlmostEqual(hedging.delay('bob'), 2.9)
+
+    def test_budget(self):
+        hedging = Hedging(budget=0.25, burst=2)
+        self.assertTrue(hedging.take())
+        self.assertTrue(hedging.take())
+        self.assertFalse(hedging.take())
+        for _ in range(3):
+            hedging.sent()
+        self.assertFalse(hedging.take())
+        hedging.sent()
+        self.assertTrue(hedging.take())
+        for _ in range(100):
+            hedging.sent()
+        self.assertEqual(hedging.tokens, 2)
+
+    def test_slow_tunnel(self):
+        sim = Simulation(30, seed=2)
+        origin = sim.nodes[sim.addrs[0]]
+        target = sim.nodes[sim.addrs[15]].name
+        answered = []
+
+        @origin.server.handle('ping', 'message', in_thread=False)
+        async def ping(message):
+            answered.append(message)
+            user.response(message, Message('pong'))
+
+        def send(hedge: bool) -> float:
+            result = []
+            start = sim.clock.seconds()
+            with fast_crypto():
+                origin.send(Message('ping'), target, hedge).addCallback(
+                    lambda _: result.append(sim.clock.seconds() - start))
+            sim.run()
+            return result[0]
+
+        self.assertLess(send(False), 1)
+        pool = origin.server.tunnel_pool
+        (first_hop, _, _), = pool.tunnels.values()
+        sim.set_link(origin.addr, first_hop, Link(latency=5))
+        self.assertGreater(send(False), 5)
+
+        origin.server.hedging.default_delay = 0.2
+        hedged = metrics.hedged.value
+        self.assertLess(send(True), 1)
+        self.assertEqual(metrics.hedged.value, hedged + 1)
+        self.assertEqual(len(answered), 3)
+        self.assertEqual(len({first_hop for first_hop, _, _ in pool.tunnels.values()}), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+import tempfile
+import os
+
+from hodl_net.host import NodeHost
+from hodl_net.server import Server, node
+from hodl_net.models import Message, MessageWrapper
+from hodl_net import metrics
+from hodl_net.tracing import load
+
+
+class NodeHostTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.host = NodeHost(tempfile.mkdtemp(), handlers=Server.handlers_table())
+        cls.a = cls.host.add(0, 'a')
+        cls.b = cls.host.add(0, 'b')
+
+    @classmethod
+    def tearDownClass(cls):
+        for server in cls.host.nodes.values():
+            server.udp_port.stopListening()
+
+    def test_separate_identities(self):
+        a, b = self.a, self.b
+        self.assertNotEqual(a.udp.public_key, b.udp.public_key)
+        self.assertIsNot(a._callbacks, b._callbacks)
+        self.assertIsNot(a.udp.temp, b.udp.temp)
+        self.assertNotEqual(a.udp_port.getHost().port, b.udp_port.getHost().port)
+        self.assertIs(a.wheel, b.wheel)
+        self.assertIs(a._handlers, b._handlers)
+        self.assertIsNone(a.lpd)
+        with self.assertRaises(ValueError):
+            self.host.add(0, 'a')
+
+    def test_handler_gets_receiving_node(self):
+        received = []
+
+        @self.a.handle('whoami', 'request', in_thread=False)
+        async def whoami(_):
+            received.append(node.udp)
+
+        data = MessageWrapper(Message('whoami'), 'request').to_json().encode()
+        self.b.udp.handle_datagram(data, ('127.0.0.1', 5555))
+        self.a.udp.handle_datagram(data, ('127.0.0.1', 5555))
+        self.assertEqual(received, [self.b.udp, self.a.udp])
+
+    def test_handler_span_in_receiving_trace(self):
+        @self.a.handle('traced', 'request', in_thread=False)
+        async def traced(_):
+            pass
+
+        data = MessageWrapper(Message('traced'), 'request', trace='t1').to_json().encode()
+        self.b.udp.handle_datagram(data, ('127.0.0.1', 5555))
+        cwd = os.getcwd()
+        os.chdir(tempfile.mkdtemp())
+        try:
+            spans = load([self.b.dump_trace()])['t1']
+        finally:
+            os.chdir(cwd)
+        self.assertIn('handler:traced', [span['stage'] for span in spans])
+        self.assertNotIn('handler:traced', [stage for _, _, stage, _, _ in self.a.tracer.spans])
+
+    def test_gauges_summed(self):
+        self.a._callbacks['a'] = []
+        self.b._callbacks['b'] = []
+        self.a.peer_map.report('1.1.1.1:8000', ['2.2.2.2:8000'])
+        self.b.peer_map.report('3.3.3.3:8000', ['4.4.4.4:8000', '5.5.5.5:8000'])
+        value = lambda name: metrics.registry.metrics[name].value
+        self.assertEqual(value('hodl_callbacks'), len(self.a._callbacks) + len(self.b._callbacks))
+        self.assertEqual(value('hodl_peer_map_nodes'), len(self.a.peer_map) + len(self.b.peer_map))
+        self.assertEqual(value('hodl_peer_map_edges'), 3)
+        self.host.add(0, 'c')
+        self.assertEqual(value('hodl_peer_map_edges'), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,31 @@
+import unittest
+import subprocess
+import sys
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def imported_after(statement, modules):
+    code = f'import sys\n{statement}\nprint(" ".join(m for m in {modules!r} if m in sys.modules))'
+    out = subprocess.run([sys.executable, '-c', code], cwd=ROOT, stdout=subprocess.PIPE,
+                         universal_newlines=True, check=True).stdout
+    return out.split()
+
+
+class ImportTest(unittest.TestCase):
+    heavy = ['twisted', 'sqlalchemy', 'Crypto', 'upnpclient', 'toml', 'werkzeug']
+
+    def test_package_is_lazy(self):
+        self.assertEqual(imported_after('import hodl_net', self.heavy), [])
+
+    def test_models_without_optional_subsystems(self):
+        self.assertEqual(imported_after('import hodl_net.models', ['twisted.internet.reactor', 'Crypto',
+                                                                   'upnpclient', 'toml']), [])
+
+    def test_upnp_on_demand(self):
+        self.assertEqual(imported_after('from hodl_net import server', ['upnpclient', 'Crypto']), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
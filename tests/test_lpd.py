@@ -0,0 +1,54 @@
+import unittest
+from twisted.internet import task
+
+from hodl_net.discovery.lpd import LPD
+from hodl_net.discovery.core_emul import Core
+
+
+class FakeTransport:
+    def __init__(self):
+        self.written = []
+
+    def write(self, data, addr):
+        self.written.append(data)
+
+    def joinGroup(self, ip):
+        pass
+
+
+class LPDTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.core = Core()
+        self.lpd = LPD(self.core, lpd_interval=2, max_interval=64, clock=self.clock)
+        self.lpd.transport = FakeTransport()
+        self.lpd.startProtocol()
+
+    def run_for(self, seconds):
+        for _ in range(seconds):
+            self.clock.advance(1)
+
+    def test_backoff(self):
+        self.run_for(1000)
+        self.assertLess(len(self.lpd.transport.written), 25)
+        self.assertEqual(self.lpd.interval, 64)
+
+    def test_reset_on_new_peer(self):
+        self.run_for(300)
+        other = LPD(Core(), main_port=8001)
+        announce = other.packet.pack(other.magic, other.version, 8001, other.nonce)
+        self.lpd.datagramReceived(announce, ('192.168.0.2', 9999))
+        self.lpd.datagramReceived(announce, ('192.168.0.2', 9999))
+        self.assertEqual(self.lpd.interval, 2)
+        self.assertEqual([p.addr for p in self.core.udp.peers], ['192.168.0.2:8001'])
+
+    def test_own_and_legacy_announcements(self):
+        self.lpd.datagramReceived(self.lpd.data, ('192.168.0.1', 9999))
+        self.lpd.datagramReceived(b'{"prt": {"nm": "HDN-NetStack", "v": "2.0"}, "gl": "LPD", "dt": {"prt": 8002}}',
+                                  ('192.168.0.3', 9999))
+        self.lpd.datagramReceived(b'garbage', ('192.168.0.4', 9999))
+        self.assertEqual([p.addr for p in self.core.udp.peers], ['192.168.0.3:8002'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import unittest
+import random
+
+from hodl_net.metrics import Registry, Histogram
+
+
+class MetricsTest(unittest.TestCase):
+    def test_histogram_precision(self):
+        histogram = Histogram('latency', scale=1)
+        values = [random.randint(1, 10 ** 9) for _ in range(10000)]
+        for value in values:
+            histogram.record(value)
+        values.sort()
+        for q in (0.5, 0.9, 0.99):
+            exact = values[int(q * len(values)) - 1]
+            self.assertAlmostEqual(histogram.percentile(q) / exact, 1, delta=1 / 16)
+        self.assertEqual(histogram.count, len(values))
+        self.assertEqual(histogram.percentile(1), max(values))
+
+    def test_bucket_bounds(self):
+        for value in list(range(100)) + [2 ** 40 + 12345, 2 ** 63]:
+            middle = Histogram.bucket_value(Histogram.index(value))
+            self.assertLessEqual(abs(middle - value), value / 32 + 1)
+
+    def test_expose(self):
+        registry = Registry()
+        registry.counter('datagrams_total', 'Datagrams', ['type']).labels('shout').inc(3)
+        registry.gauge('peers', 'Peers', fn=lambda: 42)
+        registry.histogram('handler_seconds', 'Handlers').record(2 * 10 ** 6)
+        text = registry.expose()
+        self.assertIn('# TYPE datagrams_total counter\ndatagrams_total{type="shout"} 3\n', text)
+        self.assertIn('peers 42\n', text)
+        self.assertIn('handler_seconds_count 1\n', text)
+        self.assertIn('handler_seconds{quantile="0.99"} 0.002', text)
+        self.assertEqual(registry.dump()['datagrams_total{type="shout"}'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
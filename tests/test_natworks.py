@@ -0,0 +1,68 @@
+import unittest
+import tempfile
+import os
+
+from hodl_net.utils import NatWorker
+
+
+class FakeGateway:
+    def __init__(self, found=True):
+        self.found = found
+        self.location = None
+        self.discovered = 0
+
+    def discover(self, timeout, location=None):
+        self.discovered += 1
+        self.location = 'http://192.168.0.1:1900/igd.xml'
+        return self.found
+
+    def external_ip(self):
+        return '1.2.3.4'
+
+    def add_port_mapping(self, port, protocol='UDP'):
+        return port + 1
+
+
+class NatWorkerTest(unittest.TestCase):
+    def setUp(self):
+        self.cache_path = os.path.join(tempfile.mkdtemp(), 'nat.json')
+
+    def test_warm_start(self):
+        gateway = FakeGateway()
+        self.assertEqual(NatWorker(8000, gateway=gateway, cache_path=self.cache_path).discover(), ('1.2.3.4', 8001))
+
+        gateway = FakeGateway()
+        worker = NatWorker(8000, gateway=gateway, cache_path=self.cache_path)
+        self.assertEqual(worker.start().result, ('1.2.3.4', 8001))
+        self.assertEqual(gateway.discovered, 0)
+
+    def test_expired_or_foreign_cache(self):
+        NatWorker(8000, gateway=FakeGateway(), cache_path=self.cache_path).discover()
+        self.assertEqual(NatWorker(8000, cache_path=self.cache_path, ttl=0).cached(), (None, None))
+        self.assertEqual(NatWorker(8002, cache_path=self.cache_path).cached(), (None, None))
+
+    def test_broken_cache(self):
+        NatWorker(8000, gateway=FakeGateway(), cache_path=self.cache_path).discover()
+        self.assertFalse(os.path.exists(f'{self.cache_path}.tmp'))
+        for data in ['{"port": 8000, "ext_addr": ["1.2.3.4", 8001]}',
+                     '{"port": 8000, "time": "now", "ext_addr": ["1.2.3.4", 8001]}',
+                     '{"port": 8000, "time": 1e18, "ext_addr": "1.2.3.4:8001"}',
+                     '{"port": 8000, "time": 1e18, "ext_addr": ["1.2.3.4", 8001], "location": 5}',
+                     '{"port": 8000, "time": 1e18, "ext_a',
+                     b'\xff\xfe']:
+            with open(self.cache_path, 'wb' if isinstance(data, bytes) else 'w') as f:
+                f.write(data)
+            gateway = FakeGateway()
+            worker = NatWorker(8000, gateway=gateway, cache_path=self.cache_path)
+            self.assertEqual(worker.cached(), (None, None))
+            self.assertEqual(worker.discover(), ('1.2.3.4', 8001))
+            self.assertEqual(worker.cached(), ('1.2.3.4', 8001))
+
+    def test_no_gateway(self):
+        worker = NatWorker(8000, gateway=FakeGateway(found=False), cache_path=self.cache_path)
+        self.assertEqual(worker.discover(), (None, None))
+        self.assertFalse(os.path.exists(self.cache_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
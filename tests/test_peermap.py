@@ -0,0 +1,89 @@
+import unittest
+
+from hodl_net.discovery.peermap import PeerMap
+
+
+def addr(i):
+    return f'10.0.0.{i}:8000'
+
+
+class PeerMapTest(unittest.TestCase):
+    def test_report(self):
+        m = PeerMap()
+        m.report(addr(1), [addr(2), addr(3), addr(1)], full=True)
+        m.report(addr(2), [addr(1)], full=True)
+        self.assertEqual(m.edges, 2)
+        self.assertEqual(m.degree(addr(1)), 2)
+        self.assertEqual(m.neighbours(addr(3)), [addr(1)])
+
+        # Edge reported by both ends stays while one of them reports it
+        m.report(addr(1), [addr(3)], full=True)
+        self.assertEqual(m.neighbours(addr(2)), [addr(1)])
+        m.report(addr(2), [], full=True)
+        self.assertEqual(m.neighbours(addr(2)), [])
+
+        # Delta adds to known peers
+        m.report(addr(1), [addr(4)])
+        self.assertCountEqual(m.neighbours(addr(1)), [addr(3), addr(4)])
+        m.forget(addr(1))
+        self.assertEqual(m.edges, 0)
+        self.assertEqual(m.degree(addr(9)), 0)
+
+    def test_max_nodes(self):
+        m = PeerMap(max_nodes=3)
+        m.report(addr(1), [addr(i) for i in range(2, 10)], full=True)
+        self.assertEqual(len(m), 3)
+        self.assertEqual(m.degree(addr(1)), 2)
+        m.report(addr(9), [addr(1)])
+        self.assertNotIn(addr(9), m)
+
+    def test_ids_reused(self):
+        m = PeerMap(max_nodes=4)
+        m.report(addr(1), [addr(2), addr(3)], full=True)
+        m.report(addr(2), [addr(1)], full=True)
+        m.forget(addr(1))
+        # Node 1 keeps the edge reported by node 2, node 3 is gone
+        self.assertEqual((len(m), m.edges), (2, 1))
+        self.assertNotIn(addr(3), m)
+        m.forget(addr(2))
+        self.assertEqual(len(m), 0)
+
+        for i in range(10, 20):
+            m.report(addr(i), [addr(i + 100)], full=True)
+            m.forget(addr(i))
+        m.report(addr(5), [addr(6), addr(7), addr(8)], full=True)
+        self.assertCountEqual(m.neighbours(addr(5)), [addr(6), addr(7), addr(8)])
+        self.assertEqual(len(m.addrs), 4)
+        self.assertEqual(m.component_sizes(), [4])
+        m.report(addr(5), [], full=True)
+        self.assertEqual(m.component_sizes(), [])
+
+    def test_components(self):
+        m = PeerMap()
+        for i in range(1, 5):
+            m.report(addr(i), [addr(i + 1)])
+        m.report(addr(10), [addr(11)])
+        self.assertEqual(m.component_sizes(), [5, 2])
+        self.assertTrue(m.connected(addr(1), addr(5)))
+        self.assertFalse(m.connected(addr(1), addr(10)))
+
+        m.report(addr(5), [addr(10)])
+        self.assertEqual(m.component_sizes(), [7])
+        self.assertEqual(m.k_hop(addr(1), 2), {addr(2), addr(3)})
+        self.assertEqual(len(m.k_hop(addr(1), 10)), 6)
+
+    def test_disjoint_paths(self):
+        m = PeerMap()
+        # 1 - 2 - 9, 1 - 3 - 4 - 9, 1 - 9 and 1 - 5 - 2 sharing node 2
+        for a, b in [(1, 2), (2, 9), (1, 3), (3, 4), (4, 9), (1, 9), (1, 5), (5, 2)]:
+            m.report(addr(a), [addr(b)])
+        paths = m.disjoint_paths(addr(1), addr(9), n=5)
+        self.assertEqual(paths, [[addr(1), addr(9)],
+                                 [addr(1), addr(2), addr(9)],
+                                 [addr(1), addr(3), addr(4), addr(9)]])
+        self.assertEqual(m.disjoint_paths(addr(1), addr(9), n=5, max_len=2), paths[:2])
+        self.assertEqual(m.disjoint_paths(addr(1), addr(99)), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
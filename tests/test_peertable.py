@@ -0,0 +1,83 @@
+import unittest
+from twisted.internet import task
+
+from hodl_net.discovery.peertable import PeerTable, prefix
+
+
+class PeerTableTest(unittest.TestCase):
+    def test_prefix(self):
+        self.assertEqual(prefix('8.8.4.4:8000'), '8.8.0.0/16')
+        self.assertEqual(prefix('[2001:4860::8888]:8000'), '2001:4860::/32')
+        self.assertEqual(prefix('::ffff:8.8.8.8:8000'), '8.8.0.0/16')
+        self.assertEqual(prefix('127.0.0.1:8000'), '127.0.0.1:8000')
+        self.assertEqual(prefix('startnode.hodleum.org:49390'), 'startnode.hodleum.org')
+
+    def test_capacity(self):
+        clock = task.Clock()
+        table = PeerTable(clock, capacity=10, bucket_size=100)
+        for i in range(10):
+            self.assertEqual(table.offer(f'1.{i}.0.1:8000'), (True, None))
+            clock.advance(1)
+        for i in range(1, 10):
+            table.heard(f'1.{i}.0.1:8000')
+
+        # Untested newcomer replaces older untested peer, but not one of the same age
+        self.assertEqual(table.offer('2.0.0.1:8000'), (True, '1.0.0.1:8000'))
+        self.assertEqual(table.offer('2.0.0.2:8000'), (False, None))
+        self.assertEqual(len(table), 10)
+        self.assertEqual(table.rejected, 1)
+
+        # Peers silent for long are replaced, the one reported by many networks is the last
+        for i in range(5):
+            table.offer('1.5.0.1:8000', f'{i + 10}.0.0.1:8000')
+        clock.advance(2000)
+        evicted = [table.offer(f'3.0.0.{i}:8000')[1] for i in range(9)]
+        self.assertEqual(evicted[0], '2.0.0.1:8000')
+        self.assertNotIn('1.5.0.1:8000', evicted)
+        self.assertEqual([addr for addr in table if addr.startswith('1.')], ['1.5.0.1:8000'])
+
+    def test_buckets(self):
+        clock = task.Clock()
+        table = PeerTable(clock, capacity=100, bucket_size=3)
+        for i in range(3):
+            table.offer(f'5.5.0.{i}:8000')
+            clock.advance(1)
+        table.heard('5.5.0.1:8000')
+        table.heard('5.5.0.2:8000')
+        table.rtt('5.5.0.2:8000', 0.01)
+        admitted, evicted = table.offer('5.5.9.9:8000')
+        self.assertEqual((admitted, evicted), (True, '5.5.0.0:8000'))
+        self.assertFalse(table.offer('5.5.9.10:8000')[0])
+        self.assertEqual(table.offer('6.6.0.1:8000'), (True, None))
+        self.assertEqual(len(table), 4)
+
+    def test_bounded(self):
+        clock = task.Clock()
+        table = PeerTable(clock, capacity=50, bucket_size=50)
+        for i in range(5000):
+            clock.advance(1)
+            table.offer(f'{i % 200}.{i // 200}.0.1:8000')
+            table.heard(f'{i % 200}.{i // 200}.0.1:8000')
+            for addr in table.sample(3):
+                table.rtt(addr, 0.05)
+        self.assertEqual(len(table), 50)
+        self.assertLessEqual(len(table._heap), 2 * 50 + 64)
+        self.assertLessEqual(len(table._buckets), 50)
+        self.assertEqual(set(table), set(table.records))
+
+        addr = table.choice()
+        table.discard(addr)
+        self.assertNotIn(addr, set(table))
+        self.assertEqual(len(table._order), 49)
+
+    def test_choice(self):
+        table = PeerTable(task.Clock())
+        self.assertIsNone(table.choice())
+        for i in range(20):
+            table.offer(f'9.{i}.0.1:8000')
+        self.assertEqual(table.choice(lambda addr: addr == '9.7.0.1:8000'), '9.7.0.1:8000')
+        self.assertIsNone(table.choice(lambda addr: False))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+from unittest import mock
+
+from hodl_net.discovery.ppx import PeerIndex, PeerExchange, pack_addrs, unpack_addrs
+from hodl_net.models import Message
+
+
+class PPXTest(unittest.TestCase):
+    def test_compact_addrs(self):
+        addrs = ['127.0.0.1:8000', '10.20.30.40:65535', '::1:8001', 'fe80::1:9000']
+        packed = pack_addrs(addrs + ['startnode.hodleum.org:49390'])
+        self.assertEqual(unpack_addrs(packed), addrs)
+        self.assertLessEqual(len(pack_addrs(addrs[:2])), 20)
+
+    def test_pages(self):
+        index = PeerIndex()
+        index.update(f'10.0.0.{i}:8000' for i in range(250))
+        index.discard('10.0.0.7:8000')
+
+        received, cursor, more = [], 0, True
+        while more:
+            page, cursor, more = index.since(cursor, 100)
+            self.assertLessEqual(len(page), 100)
+            received += page
+        self.assertEqual(set(received), set(index))
+
+        index.add('10.0.1.1:8000')
+        self.assertEqual(index.since(cursor, 100), (['10.0.1.1:8000'], cursor + 1, False))
+
+    def test_epoch_reset(self):
+        ppx = PeerExchange(None, None, page_size=10)
+        ppx.index.update(f'10.0.0.{i}:8000' for i in range(5))
+        delta = ppx.delta({'epoch': 'old epoch', 'since': 5, 'limit': 1000})
+        self.assertEqual(len(unpack_addrs(delta['added'])), 5)
+        self.assertEqual(delta['epoch'], ppx.index.epoch)
+        delta = ppx.delta({'epoch': delta['epoch'], 'since': delta['version']})
+        self.assertEqual(unpack_addrs(delta['added']), [])
+
+    def test_bad_request(self):
+        ppx = PeerExchange(None, None, page_size=10)
+        ppx.index.update(f'10.0.0.{i}:8000' for i in range(5))
+        for since, limit in [('x', None), (None, 'x'), (-5, 0), ({}, [])]:
+            delta = ppx.delta({'epoch': ppx.index.epoch, 'since': since, 'limit': limit})
+            self.assertEqual(len(unpack_addrs(delta['added'])), 5)
+            self.assertFalse(delta['more'])
+        delta = ppx.delta({'epoch': ppx.index.epoch, 'since': 0, 'limit': -1})
+        self.assertEqual((len(unpack_addrs(delta['added'])), delta['more']), (1, True))
+        delta = ppx.delta({'epoch': ppx.index.epoch, 'since': 0, 'limit': 2})
+        self.assertEqual((len(unpack_addrs(delta['added'])), delta['more']), (2, True))
+
+    def test_follow_up_pages(self):
+        proto = mock.Mock()
+        proto.server.peer_map = None
+        ppx = PeerExchange(proto, None, max_pages=3)
+        with mock.patch.object(ppx, 'sync') as sync, mock.patch.object(ppx, 'apply', return_value=set()):
+            for data in [{'version': 1}, {'epoch': 'e', 'version': 'x'}, {'epoch': 'e', 'version': 1, 'added': 5}]:
+                self.assertEqual(ppx._on_delta(Message('pex_delta', data), 'a', (None, 0), 3), set())
+            self.assertNotIn('a', ppx.cursors)
+
+            # Cursor must advance
+            stuck = Message('pex_delta', {'epoch': 'e', 'version': 5, 'added': '', 'more': True})
+            ppx._on_delta(stuck, 'a', ('e', 5), 3)
+            sync.assert_not_called()
+            ppx._on_delta(stuck, 'a', ('e', 4), 3)
+            sync.assert_called_once_with('a', 2)
+            ppx._on_delta(stuck, 'a', ('old', 7), 2)
+            sync.assert_called_with('a', 1)
+            # Page limit
+            sync.reset_mock()
+            ppx._on_delta(stuck, 'a', ('e', 4), 1)
+            sync.assert_not_called()
+        self.assertEqual(ppx.cursors['a'], ('e', 5))
+
+
+if __name__ == '__main__':
+    unittest.main()
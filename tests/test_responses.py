@@ -0,0 +1,85 @@
+import unittest
+from twisted.internet import defer, task
+
+from hodl_net.errors import QuorumNotReached
+from hodl_net.models import Message
+from hodl_net.responses import Responses
+from hodl_net.server import user
+from hodl_net.sim import Simulation, fast_crypto
+
+
+class ResponsesTest(unittest.TestCase):
+    def setUp(self):
+        self.sim = Simulation(30, seed=5)
+        self.answered = 0
+        self.origin = self.sim.nodes[self.sim.addrs[0]]
+        server = self.origin.server
+
+        @server.handle('who', 'shout', in_thread=False)
+        async def who(message):
+            if message.data.get('answer'):
+                self.answered += 1
+                user.response(message, Message('me', {'name': user.name}))
+
+    def shout(self, data: dict, **kwargs):
+        with fast_crypto():
+            responses = self.origin.shout(Message('who', data), **kwargs)
+        result = []
+        defer.ensureDeferred(responses.collect()).addBoth(result.append)
+        self.sim.run()
+        return responses, result[0]
+
+    def test_first_n(self):
+        responses, result = self.shout({'answer': True}, first_n=5)
+        self.assertEqual(len(result), 5)
+        self.assertEqual(self.answered, 29)
+        self.assertEqual(responses.received, 5)
+        self.assertIs(self.origin.server._callbacks.get(responses.callback), responses)
+
+    def test_deadline(self):
+        responses, result = self.shout({'answer': True}, deadline=0.1)
+        self.assertLess(len(result), 29)
+        self.assertTrue(responses.done)
+
+        responses, result = self.shout({'answer': True}, deadline=10)
+        self.assertEqual(len(result), 29)
+
+    def test_deadline_keeps_received(self):
+        clock = task.Clock()
+        proto = type('Proto', (), {'reactor': clock, 'server': type('Server', (), {'_callbacks': {}})})
+        responses = Responses(proto, 'c1', deadline=1)
+        for i in range(3):
+            responses.put(Message('me', {'i': i}))
+        clock.advance(2)
+        self.assertTrue(responses.done)
+        result = defer.ensureDeferred(responses.collect()).result
+        self.assertEqual([message.data['i'] for message in result], [0, 1, 2])
+
+    def test_quorum(self):
+        _, result = self.shout({'answer': True}, quorum=10, deadline=10)
+        self.assertEqual(len(result), 29)
+
+        _, result = self.shout({}, quorum=1, deadline=1)
+        self.assertIsInstance(result.value, QuorumNotReached)
+
+    def test_close(self):
+        with fast_crypto():
+            responses = self.origin.shout(Message('who', {'answer': True}))
+        received = []
+
+        async def consume():
+            async with responses:
+                async for message in responses:
+                    received.append(message)
+                    if len(received) == 2:
+                        break
+
+        defer.ensureDeferred(consume())
+        self.sim.run()
+        self.assertEqual(len(received), 2)
+        self.assertTrue(responses.done)
+        self.assertFalse(responses._queue)
+
+
+if __name__ == '__main__':
+    unittest.main()
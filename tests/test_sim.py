@@ -0,0 +1,42 @@
+import unittest
+
+from hodl_net.sim import Simulation, SimClock, Link
+
+
+class SimTest(unittest.TestCase):
+    def test_clock(self):
+        clock = SimClock()
+        fired = []
+        clock.callLater(2, fired.append, 2)
+        clock.callLater(1, fired.append, 1)
+        clock.callLater(1.5, fired.append, 'cancelled').cancel()
+        clock.callLater(3, fired.append, 3).reset(0.5)
+        clock.advance(5)
+        self.assertEqual(fired, [3, 1, 2])
+        self.assertIsNone(clock.next_time())
+
+    def test_delivery(self):
+        sim = Simulation(100, seed=1)
+        shout = sim.measure('shout', 3)
+        self.assertEqual(shout['delivered'], 3 * 99)
+        self.assertGreater(shout['p50'], 0.02)
+
+        send = sim.measure('send', 3)
+        self.assertEqual(send['delivery_ratio'], 1.)
+
+        request = sim.measure('request', 3)
+        self.assertEqual(request['datagrams'], 6)
+        self.assertLess(request['p99'], 0.03)
+        self.assertGreater(request['rtt_p50'], request['p50'])
+
+    def test_deterministic(self):
+        runs = []
+        for _ in range(2):
+            sim = Simulation(50, link=Link(loss=0.05), seed=7)
+            runs.append((sim.measure('shout', 3), sim.lost))
+        self.assertEqual(runs[0], runs[1])
+        self.assertGreater(runs[0][1], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
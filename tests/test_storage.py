@@ -0,0 +1,123 @@
+import unittest
+import tempfile
+import os
+
+from hodl_net.database import DBWorker
+from hodl_net.storage import LogStorage
+from hodl_net.storage.log import encode, PUT_USER
+
+
+class StorageMixin:
+    backend = None
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), f'test_db.{self.backend}')
+        self.changes = []
+        self.worker = DBWorker()
+        self.worker.on_change(self.changes.append)
+        self.worker.create_connection(self.path, self.backend)
+        self.storage = self.worker.storage
+
+    def tearDown(self):
+        self.storage.drop()
+
+    def test_peers(self):
+        self.storage.add_peers(['1.1.1.1:8000', '2.2.2.2:8000', '1.1.1.1:8000'])
+        self.storage.add_peers(['2.2.2.2:8000'])
+        self.assertEqual(sorted(self.storage.peers()), ['1.1.1.1:8000', '2.2.2.2:8000'])
+        self.assertTrue(self.storage.has_peer('1.1.1.1:8000'))
+        self.assertFalse(self.storage.has_peer('3.3.3.3:8000'))
+
+        self.storage.remove_peers(['1.1.1.1:8000', '3.3.3.3:8000'])
+        self.assertEqual(self.storage.peers(), ['2.2.2.2:8000'])
+        self.assertIn('peers', self.changes)
+
+    def test_users(self):
+        self.storage.add_users([('alice', 'key1'), ('bob', 'key2')])
+        self.storage.add_users([('alice', 'other')])
+        self.assertEqual(self.storage.user_key('alice'), 'key1')
+        self.assertIsNone(self.storage.user_key('carol'))
+        self.assertEqual(sorted(self.storage.users()), [('alice', 'key1'), ('bob', 'key2')])
+        self.assertEqual(len(self.storage.users(1)), 1)
+
+        self.storage.add_users([('alice', 'other')], replace=True)
+        self.assertEqual(self.storage.user_key('alice'), 'other')
+        self.assertIn('users', self.changes)
+
+    def test_drop(self):
+        self.storage.add_peers(['1.1.1.1:8000'])
+        self.storage.drop()
+        self.storage.create()
+        self.assertEqual(self.storage.peers(), [])
+
+
+class SQLStorageTest(StorageMixin, unittest.TestCase):
+    backend = 'sqlite'
+
+    def tearDown(self):
+        self.worker.engine.dispose()
+        super().tearDown()
+
+
+class LogStorageTest(StorageMixin, unittest.TestCase):
+    backend = 'log'
+
+    def test_reload(self):
+        self.storage.add_peers(['1.1.1.1:8000', '2.2.2.2:8000'])
+        self.storage.remove_peers(['1.1.1.1:8000'])
+        self.storage.add_users([('alice', 'key1')])
+        self.storage.add_users([('alice', 'key2')], replace=True)
+        self.storage.close()
+
+        storage = LogStorage(self.path)
+        storage.create()
+        self.assertEqual(storage.peers(), ['2.2.2.2:8000'])
+        self.assertEqual(storage.user_key('alice'), 'key2')
+        storage.close()
+
+    def test_torn_tail(self):
+        self.storage.add_users([('alice', 'key1')])
+        self.storage.close()
+        size = os.path.getsize(self.path)
+        with open(self.path, 'ab') as f:
+            f.write(encode(PUT_USER, 'bob', 'key2')[:-1])
+
+        self.storage.load()
+        self.assertEqual(self.storage.users(), [('alice', 'key1')])
+        self.assertEqual(os.path.getsize(self.path), size)
+        self.storage.add_users([('bob', 'key2')])
+        self.storage.load()
+        self.assertEqual(self.storage.user_key('bob'), 'key2')
+
+    def test_foreign_file(self):
+        self.storage.close()
+        with open(self.path, 'wb') as f:
+            f.write(b'SQLite format 3\0')
+        with self.assertRaises(ValueError):
+            self.storage.load()
+
+    def test_compact(self):
+        storage = LogStorage(self.path, compact_min=10, compact_ratio=2.)
+        storage.create()
+        for i in range(20):
+            storage.add_peers([f'10.0.0.{i}:8000'])
+            storage.remove_peers([f'10.0.0.{i}:8000'])
+        storage.add_peers(['1.1.1.1:8000'])
+        self.assertLessEqual(storage._records, 10)
+        self.assertFalse(os.path.exists(f'{self.path}.tmp'))
+
+        storage.load()
+        self.assertEqual(storage.peers(), ['1.1.1.1:8000'])
+        storage.close()
+
+    def test_memory(self):
+        storage = LogStorage()
+        storage.create()
+        storage.add_users([('alice', 'key1')])
+        self.assertEqual(storage.user_key('alice'), 'key1')
+        storage.drop()
+        self.assertIsNone(storage.user_key('alice'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+import tempfile
+import time
+import os
+
+from hodl_net.tracing import Tracer, load
+from hodl_net.models import Message, MessageWrapper
+from hodl_net.database import db_worker
+from hodl_net.server import Server
+
+
+class TracingTest(unittest.TestCase):
+    def test_header(self):
+        wrapper = MessageWrapper(Message('ping'), 'request', trace='abc')
+        self.assertEqual(MessageWrapper.from_bytes(wrapper.to_json().encode()).trace, 'abc')
+
+    def test_sampling(self):
+        self.assertIsNone(Tracer(0).sample())
+        self.assertIsNotNone(Tracer(1).sample())
+
+    def test_stitch(self):
+        directory = tempfile.mkdtemp()
+        paths = []
+        for node, start in (('8001', 100), ('8002', 50)):
+            tracer = Tracer(1, size=2, node=node)
+            for i in range(3):
+                tracer.record('t1', 'm1', f'stage{i}', start + i, start + i + 1)
+            self.assertEqual(len(tracer), 2)
+            paths.append(os.path.join(directory, node))
+            tracer.dump(paths[-1])
+        spans = load(paths)['t1']
+        self.assertEqual([(s['node'], s['start']) for s in spans],
+                         [('8002', 51), ('8002', 52), ('8001', 101), ('8001', 102)])
+
+    def test_handler_span(self):
+        class MemoryTransport:
+            def write(self, data, addr):
+                pass
+
+        db_worker.create_connection(None, 'log')
+        server = Server()
+        server.udp.transport = MemoryTransport()
+
+        @server.handle('slow', 'request', in_thread=False)
+        async def slow(_):
+            time.sleep(0.02)
+
+        wrapper = MessageWrapper(Message('slow'), 'request', trace='t1')
+        server.udp.handle_datagram(wrapper.to_json().encode(), ('1.1.1.1', 8000))
+        spans = {stage: duration for _, _, stage, _, duration in server.tracer.spans}
+        self.assertGreaterEqual(spans['handler:slow'], 20 * 10 ** 6)
+        self.assertLess(spans['queue'], 20 * 10 ** 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
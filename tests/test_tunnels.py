@@ -0,0 +1,134 @@
+import unittest
+import random
+from twisted.internet import task
+
+from hodl_net.utils import TimerWheel
+from hodl_net.models import Tunnels, MessageWrapper, Message
+from hodl_net.tunnels import TunnelPool, HopPolicy
+from hodl_net.sim import Simulation
+from hodl_net import metrics
+
+
+class FakeProtocol:
+    def __init__(self, addrs):
+        self.addrs = list(addrs)
+        self.sent = []
+        self.tunnels = Tunnels()
+        self.server = type('S', (), {'deadpeer': None})
+
+    @property
+    def peers(self):
+        return [type('P', (), {'addr': addr}) for addr in self.addrs]
+
+    def _send(self, wrapper, addr):
+        self.sent.append((wrapper.type, wrapper.tunnel_id, addr))
+
+
+class TunnelsTest(unittest.TestCase):
+    def test_route(self):
+        tunnels = Tunnels()
+        tunnels.add('t', 'a', 'b')
+        tunnels.add('exit', 'a', None)
+        self.assertEqual(tunnels.route('t', 'a'), (True, 'b'))
+        self.assertEqual(tunnels.route('t', 'b'), (True, 'a'))
+        self.assertEqual(tunnels.route('t', 'c'), (True, 'b'))
+        self.assertEqual(tunnels.route('exit', 'a'), (True, None))
+        self.assertEqual(tunnels.route('unknown', 'a'), (False, None))
+
+    def test_pool(self):
+        clock = task.Clock()
+        wheel = TimerWheel(clock, tick=1)
+        proto = FakeProtocol(['a', 'b', 'c'])
+        pool = TunnelPool(proto, wheel, size=3, keepalive=10, lifetime=100)
+        wheel.start()
+        pool.start()
+        first = set(pool.tunnels)
+        self.assertEqual(len(first), 3)
+        self.assertEqual({tunnel_id for _, tunnel_id, _ in proto.sent}, first)
+        self.assertTrue(all(_type == 'tunnel' for _type, _, _ in proto.sent))
+        for tunnel_id in first:
+            self.assertEqual(proto.tunnels.get(tunnel_id), [None, pool.tunnels[tunnel_id][0]])
+
+        clock.advance(11)
+        self.assertEqual(len(proto.sent), 6)
+        self.assertEqual(set(pool.tunnels), first)
+        self.assertIn(pool.get()[0], first)
+
+        clock.advance(100)
+        self.assertEqual(len(pool.tunnels), 3)
+        self.assertFalse(first & set(pool.tunnels))
+        self.assertFalse(any(tunnel_id in proto.tunnels for tunnel_id in first))
+
+        proto.addrs = ['a']
+        pool.removed('b')
+        pool.removed('c')
+        self.assertTrue(all(first_hop == 'a' for first_hop, _, _ in pool.tunnels.values()))
+        pool.stop()
+
+    def test_hop_policy(self):
+        rnd = random.Random(1)
+        self.assertEqual({HopPolicy('fixed', 3, rnd=rnd).hops() for _ in range(10)}, {3})
+        uniform = [HopPolicy('uniform', min_hops=2, max_hops=5, rnd=rnd).hops() for _ in range(1000)]
+        self.assertEqual(set(uniform), {2, 3, 4, 5})
+        policy = HopPolicy('geometric', 3, max_hops=100, rnd=rnd)
+        geometric = [policy.hops() for _ in range(10000)]
+        self.assertEqual(min(geometric), 1)
+        self.assertAlmostEqual(sum(geometric) / len(geometric), 3, delta=0.1)
+        self.assertLessEqual(max(HopPolicy('geometric', 10, max_hops=4, rnd=rnd).hops() for _ in range(100)), 4)
+        self.assertEqual(HopPolicy(lambda r, p: 0).hops(), 1)
+
+    def test_ttl(self):
+        sim = Simulation(10, seed=3)
+        proto = sim.nodes[sim.addrs[0]]
+        max_hops = proto.server.hop_policy.max_hops
+        wrapper = MessageWrapper(Message('sim_probe'), 'tunnel', tunnel_id='t', ttl=1000)
+        self.assertTrue(proto.forward(wrapper, sim.addrs[1]))
+        self.assertEqual(wrapper.ttl, max_hops - 2)
+
+        wrapper = MessageWrapper(Message('sim_probe'), 'tunnel', tunnel_id='exit', ttl=0)
+        self.assertFalse(proto.forward(wrapper, sim.addrs[1]))
+        self.assertEqual(proto.tunnels.get('exit'), [sim.addrs[1], None])
+
+        wrapper = MessageWrapper(Message('sim_probe'), 'tunnel', tunnel_id='t', ttl=0)
+        self.assertFalse(proto.forward(wrapper, sim.addrs[1]))
+
+    def test_deadline(self):
+        sim = Simulation(10, seed=3)
+        sim.clock.advance(10)
+        proto = sim.nodes[sim.addrs[0]]
+        expired = metrics.expired.value
+        for deadline, datagrams in [(5., 0), (15., 1)]:
+            wrapper = MessageWrapper(Message('sim_probe'), 'tunnel', tunnel_id=str(deadline), ttl=3,
+                                     deadline=deadline)
+            sent = sim.datagrams
+            proto.datagramReceived(wrapper.to_json().encode(), ('10.0.0.1', 8000))
+            self.assertEqual(sim.datagrams - sent, datagrams)
+        self.assertEqual(metrics.expired.value, expired + 1)
+
+    def test_fixed_path(self):
+        sim = Simulation(50, seed=3)
+        origin = sim.addrs[0]
+        sim.send(origin)
+        sim.run()
+        tunnel_id, _, _ = sim.nodes[origin].server.tunnel_pool.get()
+        path = {addr: proto.tunnels.get(tunnel_id) for addr, proto in sim.nodes.items()
+                if tunnel_id in proto.tunnels}
+        self.assertGreater(len(path), 1)
+
+        sim.send(origin)
+        sim.run()
+        self.assertEqual(sim.stats['send'].expected, len(sim.stats['send'].delivered))
+        self.assertEqual({addr: proto.tunnels.get(tunnel_id) for addr, proto in sim.nodes.items()
+                          if tunnel_id in proto.tunnels}, path)
+
+    def test_loop(self):
+        sim = Simulation(10, seed=3)
+        proto = sim.nodes[sim.addrs[0]]
+        proto.tunnels.add('t', sim.addrs[1], sim.addrs[2])
+        wrapper = MessageWrapper(Message('sim_probe'), 'tunnel', tunnel_id='t')
+        self.assertTrue(proto.forward(wrapper, sim.addrs[1]))
+        self.assertFalse(proto.forward(wrapper, sim.addrs[3]))
+
+
+if __name__ == '__main__':
+    unittest.main()